@@ -0,0 +1,232 @@
+import asyncio
+import os
+import time
+import traceback
+import argparse
+import json
+from datetime import date
+from urllib.parse import urlparse
+
+import aiohttp
+import pandas as pd
+
+from util.util_status_page import PROVIDERS, INCIDENT_COLUMNS, UPTIME_COLUMNS, get_provider_host, \
+    get_partition_name, parse_history_page, parse_incident_page, parse_uptime_page
+from util.util_fixture_server import write_fixture
+
+
+class FetchError(Exception):
+    """A page could not be fetched after all attempts, as opposed to a page that does not exist (404)."""
+
+
+class StatusPageClient:
+    """
+    Fetches pages of one provider's status page over a shared aiohttp session.
+    The session's connector bounds the number of open connections across all providers.
+    """
+
+    def __init__(self, session, provider, base_url=None, fixture_dir=None, max_attempts=3):
+        self.session = session
+        self.provider = provider
+        self.site_url = PROVIDERS[provider]['url']
+        self.host = get_provider_host(provider)
+        # a stand-in server (util.util_fixture_server) serves every provider under /{host}/
+        self.fetch_url = f"{base_url.rstrip('/')}/{self.host}" if base_url else self.site_url
+        self.fixture_dir = fixture_dir
+        self.max_attempts = max_attempts
+        self.request_count = 0
+        self.failed_incident_count = 0
+
+    async def get(self, path):
+        """Page html, None when the page does not exist. Raises FetchError when every attempt failed."""
+        attempt = 0
+        while attempt < self.max_attempts:
+            try:
+                async with self.session.get(self.fetch_url + path) as response:
+                    self.request_count += 1
+                    if response.status == 404:
+                        return None
+                    response.raise_for_status()
+                    html = await response.text()
+                    if self.fixture_dir:
+                        parsed = urlparse(path)
+                        write_fixture(self.fixture_dir, self.host, parsed.path, parsed.query, html)
+                    return html
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempt += 1
+                print(f"Fetching {self.fetch_url + path} failed (attempt {attempt}): {e!r}")
+                await asyncio.sleep(2 ** attempt)
+        raise FetchError(f"giving up on {self.fetch_url + path} after {self.max_attempts} attempts")
+
+
+async def collect_history_page(client, page):
+    # a history page that failed to fetch raises FetchError, only a missing or empty page ends the history
+    html = await client.get(f"/history?page={page}")
+    if html is None:
+        return [], []
+    return parse_history_page(html, client.site_url)
+
+
+async def collect_incident(client, incident):
+    """
+    Incident record with the updates and services of its detail page, or None when the detail page could not be
+    fetched. A record without its updates would replace the archived snapshot of the incident, so it is not written.
+    """
+    try:
+        html = await client.get(urlparse(incident['Incident_Link']).path)
+    except FetchError as e:
+        html = None
+        print(f"\nWarning: skipping incident {incident['Incident_Title']}: {e}\n")
+    if html is None:
+        client.failed_incident_count += 1
+        return None
+    record = {column: incident[column] for column in INCIDENT_COLUMNS if column in incident}
+    record.update(parse_incident_page(html))
+    print(record['Incident_Title'], ". ", (json.loads(record['Updates']) or [{}])[0].get('Update_Timestamp'))
+    return record
+
+
+async def collect_incidents(client, page_window):
+    """
+    Collect all incident history pages of a provider, and then every incident detail page at once.
+    History pages are requested page_window at a time, until the first page without incidents.
+    Returns the incident records per archive partition, in page order, without the incidents whose detail page
+    could not be fetched.
+    """
+    pages = []
+    page = 1
+    flag_no_data = False
+    while not flag_no_data:
+        results = await asyncio.gather(*[collect_history_page(client, page + offset) for offset in range(page_window)])
+        for month_titles, incidents in results:
+            if not incidents:
+                flag_no_data = True
+                break
+            print(f"{client.provider}: incidents found in {month_titles[0]} page: {len(incidents)}")
+            pages.append((get_partition_name(month_titles[0]), incidents))
+        page += page_window
+
+    records = await asyncio.gather(*[collect_incident(client, incident)
+                                     for _, incidents in pages for incident in incidents])
+    partitions = {}
+    for file_name, incidents in pages:
+        partition, records = records[:len(incidents)], records[len(incidents):]
+        partitions[file_name] = [record for record in partition if record is not None]
+    return partitions
+
+
+async def collect_uptime(client, component_id, service, page_window):
+    """Collect the uptime calendar pages of a service, until the first page with a no-data day."""
+    records = []
+    page = 1
+    flag_no_data = False
+    while not flag_no_data:
+        results = await asyncio.gather(*[client.get(f"/uptime/{component_id}?page={page + offset}")
+                                         for offset in range(page_window)])
+        for html in results:
+            if html is None:
+                flag_no_data = True
+                break
+            _, page_records, flag_no_data = parse_uptime_page(html, client.site_url, service)
+            records.extend(page_records)
+            if flag_no_data:
+                break
+        page += page_window
+    print(f"{service}: uptime days collected: {len(records)}")
+    return records
+
+
+def archive_incidents(partitions, provider, output_dir, execution_date):
+    archive_folder = f"{output_dir}/incident/{execution_date}/{provider}"
+    os.makedirs(archive_folder, exist_ok=True)
+    for file_name, records in partitions.items():
+        pd.DataFrame(records, columns=INCIDENT_COLUMNS).to_csv(f"{archive_folder}/{file_name}", index=False)
+
+
+def archive_uptime_by_service(records, service, output_dir, execution_date):
+    archive_folder = f"{output_dir}/uptime/{execution_date}/{service}"
+    os.makedirs(archive_folder, exist_ok=True)
+    pd.DataFrame(records, columns=UPTIME_COLUMNS).to_csv(f"{archive_folder}/uptime_history.csv", index=False)
+
+
+async def collect_provider_incidents(client, args):
+    partitions = await collect_incidents(client, args.page_window)
+    archive_incidents(partitions, client.provider, args.output_dir, args.execution_date)
+    return sum(len(records) for records in partitions.values())
+
+
+async def collect_provider_uptime(client, args):
+    # the default uptime page lists every component of the service dropdown
+    html = await client.get("/uptime")
+    components, _, _ = parse_uptime_page(html, client.site_url, None) if html else ([], [], True)
+    component_ids = {component['name'].lower(): component['id'] for component in components}
+
+    services = [service for service in PROVIDERS[client.provider]['services'] if service in component_ids]
+    for service in set(PROVIDERS[client.provider]['services']) - set(services):
+        print(f"\nWarning: service {service} not found in the {client.provider} uptime page.\n")
+
+    results = await asyncio.gather(*[collect_uptime(client, component_ids[service], service, args.page_window)
+                                     for service in services])
+    for service, records in zip(services, results):
+        archive_uptime_by_service(records, service, args.output_dir, args.execution_date)
+    return sum(len(records) for records in results)
+
+
+async def collect_data(args):
+    """Collect every selected provider and data type concurrently over one bounded connection pool."""
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        clients = [StatusPageClient(session, provider, args.base_url, args.save_fixtures)
+                   for provider in args.providers]
+        jobs = []
+        for client in clients:
+            if 'incident' in args.data_types:
+                jobs.append((f"{client.provider} incidents", collect_provider_incidents(client, args)))
+            if 'uptime' in args.data_types:
+                jobs.append((f"{client.provider} uptime", collect_provider_uptime(client, args)))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[job for _, job in jobs], return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+    for (name, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            print(f"Collecting {name}. An error occurred: ", result)
+            traceback.print_exception(result)
+        else:
+            print(f"{name}: {result} records")
+    request_count = sum(client.request_count for client in clients)
+    print(f"{request_count} requests in {elapsed:.2f}s ({request_count / elapsed:.1f} requests/s)")
+    for client in clients:
+        if client.failed_incident_count:
+            print(f"\nWarning: {client.provider}: {client.failed_incident_count} incidents skipped, "
+                  f"their detail pages could not be fetched.\n")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Collect incident and uptime data from status pages over HTTP.')
+    parser.add_argument('-P', '--providers', nargs='+', choices=list(PROVIDERS), default=list(PROVIDERS),
+                        help="Providers to collect. Default is all providers.")
+    parser.add_argument('-D', '--data-types', nargs='+', choices=['incident', 'uptime'],
+                        default=['incident', 'uptime'], help="Data to collect. Default is both.")
+    parser.add_argument('--base-url', default=None,
+                        help="Fetch pages from a stand-in server, e.g. http://127.0.0.1:8080 "
+                             "(see util/util_fixture_server.py), instead of the status pages.")
+    parser.add_argument('--concurrency', type=int, default=16, help="Maximum number of open connections.")
+    parser.add_argument('--page-window', type=int, default=4,
+                        help="Number of history/uptime pages requested ahead at once.")
+    parser.add_argument('--timeout', type=float, default=60, help="Request timeout in seconds.")
+    parser.add_argument('--output-dir', default='data/raw')
+    parser.add_argument('--execution-date', default=date.today().strftime("%Y-%m-%d"),
+                        help="Partition to archive the data in, YYYY-MM-DD. Default is today.")
+    parser.add_argument('--save-fixtures', default=None, help="Save every fetched page as a fixture in this folder.")
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    print("Collecting {} data for providers: {}".format(' and '.join(args.data_types), ', '.join(args.providers)))
+    asyncio.run(collect_data(args))
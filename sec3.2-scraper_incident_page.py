@@ -1,6 +1,9 @@
 import time
 import os
 import traceback
+import argparse
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import json
@@ -8,12 +11,15 @@ import json
 import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException
 from selenium.webdriver.support.color import Color
 
+from util.util_data import get_incident_id
+from util.util_metrics import ScrapeMetrics
+from util.util_status_page import INCIDENT_COLUMNS
+
 
 def calculate_start_date(end_date):
     start_date = end_date - relativedelta(months=2)
@@ -22,31 +28,59 @@ def calculate_start_date(end_date):
     return start_date_str, end_date_str
 
 
-def get_archive_path(partition):
-    start_date, end_date = calculate_start_date(partition)
+def get_archive_folder():
     archive_folder = f"data/raw/incident/openai"
     os.makedirs(archive_folder, exist_ok=True)
-    return f"{archive_folder}/incident_history_{start_date}_{end_date}.csv"
+    return archive_folder
+
+
+def get_archive_path(partition):
+    start_date, end_date = calculate_start_date(partition)
+    return f"{get_archive_folder()}/incident_history_{start_date}_{end_date}.csv"
+
+
+def load_json_file(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json_file(path, data):
+    # write to a temporary file first, an interrupted run must not leave a truncated manifest behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def strip_posted_ago(update_timestamp):
+    # 'Posted 3 days ago. Aug 28, 2024 - 13:36 PDT' -> 'Aug 28, 2024 - 13:36 PDT'
+    return update_timestamp.split(". ", 1)[-1]
+
 
+def create_driver(headless=False):
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    return webdriver.Chrome(options=options)
 
-class MyIncidentPage:
+
+class MyIncidentDetailPage:
     # Class variable for XPaths that do not change across instances
     UPDATE_XPATH = "//div[@class='row update-row']"
     SERVICE_XPATH = "//div[contains(@class, 'components-affected')]"
-    INCIDENT_LIST_XPATH = "//a[contains(@class, 'incident-title')]"
-    PAGE_XPATH = "(//h4[contains(@class, 'month-title')])[1]"
-    PAGINATION_XPATH = "//div[@class='pagination']//i[@class='left-arrow']"
-    SHOW_ALL_XPATH = "//div[contains(@class, 'expand-incidents') and @aria-expanded='false']"
 
-    def __init__(self, driver):
+    def __init__(self, driver, metrics=None):
         self.driver = driver
-        self.c_key = MAC_C_KEY
+        # timers, wait histograms and retry counters of the run, see util/util_metrics.py
+        self.metrics = metrics or ScrapeMetrics('incident')
 
     def get_incident_updates(self):
         updates = []
-        update_rows = WebDriverWait(self.driver, 10).until(
+        update_rows = self.metrics.wait('incident_updates', lambda: WebDriverWait(self.driver, 10).until(
             EC.presence_of_all_elements_located((By.XPATH, self.UPDATE_XPATH))
-        )
+        ))
         # get update by rows
         for update_row in update_rows:
             title = update_row.find_element(By.XPATH, ".//div[contains(@class, 'update-title')]").text
@@ -69,40 +103,134 @@ class MyIncidentPage:
             print("Service element not found, setting service to None.")
         return service
 
-    def switch_to_incident(self, incident, original_window):
+    def get_incident_details(self):
+        return {
+            "Updates": self.get_incident_updates(),
+            "Service": self.get_incident_service()
+        }
+
+
+class IncidentDetailPool:
+    """
+    Worker pool of headless driver sessions that open incident detail pages by their links concurrently.
+    Each worker owns one driver, and keeps count of the incidents it collected and the time it spent.
+    """
+
+    def __init__(self, workers, max_attempts=3, metrics=None):
+        self.max_attempts = max_attempts
+        self.metrics = metrics or ScrapeMetrics('incident')
+        self.detail_pages = queue.Queue()
+        self.worker_stats = []
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        for worker in range(workers):
+            self.detail_pages.put((worker, MyIncidentDetailPage(create_driver(headless=True), self.metrics)))
+            self.worker_stats.append({"worker": worker, "incidents": 0, "seconds": 0.0})
+
+    def get_incident_details(self, link):
+        worker, detail_page = self.detail_pages.get()
+        try:
+            attempt = 0
+            with self.metrics.timer('scraper_incident_seconds', source='pool'):
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        detail_page.driver.get(link)
+                        details = detail_page.get_incident_details()
+                        break
+                    except Exception as e:
+                        attempt += 1
+                        self.metrics.inc('scraper_retries_total', step='incident_detail')
+                        print(f"Worker {worker}: opening {link} failed (attempt {attempt}): {e}")
+                        if attempt >= self.max_attempts:
+                            # skip the broken link instead of failing the whole page, it is not archived
+                            # so the next incremental run tries it again
+                            print(f"Warning: worker {worker} skips {link} after {attempt} attempts.")
+                            self.metrics.inc('scraper_errors_total', step='incident_detail')
+                            return None
+                    finally:
+                        self.worker_stats[worker]["seconds"] += time.perf_counter() - start
+            self.worker_stats[worker]["incidents"] += 1
+            self.metrics.report_progress()
+            return details
+        finally:
+            self.detail_pages.put((worker, detail_page))
+
+    def map_incident_details(self, links):
+        # results come back in the order of links, i.e. page order, with None for skipped links
+        return list(self.executor.map(self.get_incident_details, links))
+
+    def print_worker_throughput(self):
+        for stats in self.worker_stats:
+            throughput = stats["incidents"] / stats["seconds"] if stats["seconds"] else 0
+            print(f"Worker {stats['worker']}: {stats['incidents']} incidents in {stats['seconds']:.1f}s "
+                  f"({throughput:.2f} incidents/s)")
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.detail_pages.empty():
+            self.detail_pages.get()[1].driver.quit()
+
+
+class MyIncidentPage(MyIncidentDetailPage):
+    # Class variable for XPaths that do not change across instances
+    INCIDENT_LIST_XPATH = "//a[contains(@class, 'incident-title')]"
+    PAGE_XPATH = "(//h4[contains(@class, 'month-title')])[1]"
+    PAGINATION_XPATH = "//div[@class='pagination']//i[@class='left-arrow']"
+    SHOW_ALL_XPATH = "//div[contains(@class, 'expand-incidents') and @aria-expanded='false']"
+    # first - last update time shown next to the incident title, it changes whenever an update is posted
+    HISTORY_TIMESTAMP_XPATH = "./ancestor::div[contains(@class, 'incident-container')][1]//small"
+
+    def __init__(self, driver, incremental=False, detail_pool=None, metrics=None):
+        super().__init__(driver, metrics)
+        self.incremental = incremental
+        # open incident detail pages through a worker pool instead of one tab after another
+        self.detail_pool = detail_pool
+        self.history_url = driver.current_url.split('?')[0]
+        self.page = 1
+        # incident_id -> {update_timestamp, last_update, partition} of every archived incident
+        self.manifest_path = f"{get_archive_folder()}/manifest.json"
+        self.manifest = load_json_file(self.manifest_path, {})
+        self.checkpoint_path = f"{get_archive_folder()}/checkpoint.json"
+
+    def get_incident_summary(self, incident):
+        return {
+            "Incident_Title": incident.text,
+            "Incident_Link": incident.get_attribute('href'),
+            "Incident_color": Color.from_string(incident.value_of_css_property('color')).hex,
+            "Incident_Impact": incident.get_attribute('class').split(' ')[0],
+            "History_Timestamp": self.get_history_timestamp(incident)
+        }
+
+    def switch_to_incident(self, link, original_window):
         print("Switch to new window: ")
-        title = incident.text
-        link = incident.get_attribute('href')
-        impact = incident.get_attribute('class').split(' ')[0]
-        incident_color = Color.from_string(incident.value_of_css_property('color')).hex
-        # switch to new tab to collect incident updates
-        incident.send_keys(self.c_key + Keys.RETURN)
-        WebDriverWait(self.driver, 10).until(EC.number_of_windows_to_be(2))
-        new_window = [window for window in self.driver.window_handles if window != original_window][0]
-        self.driver.switch_to.window(new_window)
-        # collect incident updates
-        # updates = self.get_incident_updates()
-        # service = self.get_incident_service()
-        record = pd.DataFrame({
-            "Incident_Title": [title],
-            "Incident_Link": [link],
-            "Incident_color": [incident_color],
-            "Incident_Impact": [impact],
-            "Updates": [self.get_incident_updates()],
-            "Service": [self.get_incident_service()]
-        })
-        # print(record[0]['Incident_Title'], ". ", json.loads(record[0]['Updates'][0])['Update_Timestamp'])
-        print(record['Incident_Title'][0], ". ", json.loads(record['Updates'][0])[0]['Update_Timestamp'])
-        # switch back
-        self.driver.close()
-        self.driver.switch_to.window(original_window)
-        return record
+        with self.metrics.timer('scraper_incident_seconds', source='tab'):
+            # open the incident in a new tab, without an OS specific key chord
+            self.driver.switch_to.new_window('tab')
+            self.driver.get(link)
+            # collect incident updates
+            details = self.get_incident_details()
+            # switch back
+            self.driver.close()
+            self.driver.switch_to.window(original_window)
+        self.metrics.report_progress()
+        return details
+
+    def get_history_timestamp(self, incident):
+        try:
+            return incident.find_element(By.XPATH, self.HISTORY_TIMESTAMP_XPATH).text
+        except NoSuchElementException:
+            return None
+
+    def is_archived_and_unchanged(self, incident_id, history_timestamp):
+        archived = self.manifest.get(incident_id)
+        return archived is not None and history_timestamp is not None \
+            and archived['update_timestamp'] == history_timestamp
 
     def get_incident_list(self):
         try:
-            incident_list = WebDriverWait(self.driver, 5).until(
+            incident_list = self.metrics.wait('incident_list', lambda: WebDriverWait(self.driver, 5).until(
                 EC.presence_of_all_elements_located((By.XPATH, self.INCIDENT_LIST_XPATH))
-            )
+            ))
             print("Incidents found in this page: ", len(incident_list))
         except Exception as e:
             print("No incidents found.")
@@ -112,7 +240,40 @@ class MyIncidentPage:
     def archive_incidents(self, incident_df):
         date_str = self.driver.find_element(By.XPATH, self.PAGE_XPATH).text
         date_partition = datetime.strptime(date_str, "%B %Y")
-        incident_df.to_csv(get_archive_path(date_partition), index=False)
+        archive_path = get_archive_path(date_partition)
+        if self.incremental and os.path.exists(archive_path):
+            # keep the archived incidents of this partition that were not collected again
+            archived_df = pd.read_csv(archive_path)
+            archived_ids = archived_df['Incident_Link'].apply(get_incident_id)
+            collected_ids = set(incident_df['Incident_Link'].apply(get_incident_id))
+            incident_df = pd.concat([incident_df, archived_df[~archived_ids.isin(collected_ids)]])
+        incident_df.to_csv(archive_path, index=False)
+        return os.path.basename(archive_path)
+
+    def update_manifest(self, incident_df, partition):
+        for record in incident_df.to_dict('records'):
+            updates = json.loads(record['Updates'])
+            self.manifest[get_incident_id(record['Incident_Link'])] = {
+                "update_timestamp": record['History_Timestamp'],
+                "last_update": strip_posted_ago(updates[0]['Update_Timestamp']) if updates else None,
+                "partition": partition
+            }
+        save_json_file(self.manifest_path, self.manifest)
+
+    def save_checkpoint(self):
+        save_json_file(self.checkpoint_path, {"history_url": self.history_url, "next_page": self.page + 1})
+
+    def resume_from_checkpoint(self):
+        checkpoint = load_json_file(self.checkpoint_path, None)
+        if checkpoint is not None:
+            self.page = checkpoint["next_page"]
+            print(f"Resuming from checkpoint at history page {self.page}.")
+            self.driver.get(f"{checkpoint['history_url']}?page={self.page}")
+            self.metrics.sleep(1, step='resume_from_checkpoint')
+
+    def clear_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
 
     def loop_over_incidents(self):
         attempt = 0
@@ -120,6 +281,7 @@ class MyIncidentPage:
         while attempt < max_attempts:
             incident_df = pd.DataFrame()
             flag_no_data = False
+            unchanged_count = 0
             try:
                 # Collecting incident records in new tabs
                 incident_list = self.get_incident_list()
@@ -127,62 +289,122 @@ class MyIncidentPage:
                 if not incident_list:
                     flag_no_data = True
                 else:
-                    # loop over incidents when there are any
+                    # gather the incident links of the page first, then open the new or updated ones
+                    summaries = []
                     for incident_title in incident_list:
-                        incident_record = self.switch_to_incident(incident_title, original_window)
-                        incident_df = pd.concat([incident_df, pd.DataFrame(incident_record)])
-                return incident_df, flag_no_data
+                        summary = self.get_incident_summary(incident_title)
+                        incident_id = get_incident_id(summary['Incident_Link'])
+                        if self.incremental and self.is_archived_and_unchanged(incident_id,
+                                                                                summary['History_Timestamp']):
+                            unchanged_count += 1
+                            continue
+                        summaries.append(summary)
+                    print(f"Incidents archived and unchanged in this page: {unchanged_count}")
+                    self.metrics.inc('scraper_incidents_unchanged_total', unchanged_count)
+
+                    links = [summary['Incident_Link'] for summary in summaries]
+                    if self.detail_pool is not None:
+                        details = self.detail_pool.map_incident_details(links)
+                    else:
+                        details = [self.switch_to_incident(link, original_window) for link in links]
+                    records = []
+                    for summary, detail in zip(summaries, details):
+                        if detail is None:
+                            continue
+                        record = {**summary, **detail}
+                        print(record['Incident_Title'], ". ",
+                              (json.loads(record['Updates']) or [{}])[0].get('Update_Timestamp'))
+                        records.append(record)
+                    incident_df = pd.DataFrame(records, columns=INCIDENT_COLUMNS + ['History_Timestamp'])
+                    self.metrics.inc('scraper_incidents_total', len(records))
+                # every incident of the page is already archived and unchanged, so are all older pages
+                flag_up_to_date = bool(incident_list) and unchanged_count == len(incident_list)
+                return incident_df, flag_no_data, flag_up_to_date
             except StaleElementReferenceException:
                 print("Stale element, restarting incidents looping process.")
+                self.metrics.inc('scraper_retries_total', step='loop_over_incidents')
                 attempt += 1
                 continue
             except Exception as e:
                 print("Executing loop_over_incidents(). An error occurred: ", e)
+                self.metrics.inc('scraper_errors_total', step='loop_over_incidents')
                 traceback.print_exc()
+                attempt += 1
 
         print("\nWarning: this should not happen!!!\n")
-        return [], True
+        return [], True, False
 
     def show_all_incidents(self):
         show_all_buttons = self.driver.find_elements(By.XPATH, self.SHOW_ALL_XPATH)
         if show_all_buttons:
             for show_all in show_all_buttons:
                 show_all.click()
-            time.sleep(1)
+            self.metrics.sleep(1, step='show_all_incidents')
 
     def go_to_previous_page(self):
         prev_page = self.driver.find_element(By.XPATH, self.PAGINATION_XPATH)
         if prev_page:
             prev_page.click()
-            time.sleep(1)
+            self.page += 1
+            self.metrics.sleep(1, step='go_to_previous_page')
 
     def collect_data_through_pagination(self):
-        """Collect incident reports by incident history pages"""
+        """
+        Collect incident reports by incident history pages.
+        In incremental mode, incidents in the manifest whose history timestamp did not change are skipped,
+        and the pagination stops at the first page without any new or updated incident. The manifest and a
+        checkpoint are saved after every page, so an interrupted run continues from the next page.
+        """
         try:
+            if self.incremental:
+                self.resume_from_checkpoint()
             while True:
-                # Show all incidents
-                self.show_all_incidents()
-                # Get incident record by looping over incidents list in the current page
-                incident_df, flag_no_data = self.loop_over_incidents()
-                # Archive the incidents if there are any
-                if len(incident_df) > 0:
-                    self.archive_incidents(incident_df)
+                with self.metrics.timer('scraper_page_seconds'):
+                    # Show all incidents
+                    self.show_all_incidents()
+                    # Get incident record by looping over incidents list in the current page
+                    incident_df, flag_no_data, flag_up_to_date = self.loop_over_incidents()
+                    # Archive the incidents if there are any
+                    if len(incident_df) > 0:
+                        partition = self.archive_incidents(incident_df.drop(columns='History_Timestamp'))
+                        self.update_manifest(incident_df, partition)
+                    if self.incremental:
+                        self.save_checkpoint()
+                self.metrics.report_progress(force=True)
                 # Go to the previous page
-                if not flag_no_data:
-                    self.go_to_previous_page()
-                else:
+                if flag_no_data:
                     print("No more previous data. Ending incident collecting.")
                     break
+                elif flag_up_to_date:
+                    print("All incidents in this page are archived and unchanged. Ending incident collecting.")
+                    break
+                else:
+                    self.go_to_previous_page()
+            self.clear_checkpoint()
         except Exception as e:
             print("Executing collect_data_through_pagination(). An error occurred: ", e)
             traceback.print_exc()
 
 
 
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Collect incident reports from the incident history pages.')
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only collect new or updated incidents, and resume from the last checkpoint.")
+    parser.add_argument('-W', '--workers', type=int, default=0,
+                        help="Number of headless browser sessions opening incident detail pages concurrently. "
+                             "Default 0 opens them one after another in a new tab.")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Where to write the timers, wait histograms and retry counters of the run: JSON, or a "
+                             "Prometheus textfile if it ends with .prom. Default scrape_metrics.json in the archive "
+                             "folder.")
+    args = parser.parse_args()
+    return args
+
+
 if __name__ == "__main__":
 
-    MAC_C_KEY = Keys.COMMAND
-    # WINDOWS_C_KEY = Keys.CONTROL
+    args = parse_arguments()
 
     driver = webdriver.Chrome()
 
@@ -190,12 +412,19 @@ if __name__ == "__main__":
     # driver.get("https://status.anthropic.com/history")  # Anthropic incident page
     # driver.get("https://status.character.ai/history") # CharacterAI incident page
 
-
+    metrics = ScrapeMetrics('incident')
+    detail_pool = IncidentDetailPool(args.workers, metrics=metrics) if args.workers > 0 else None
     try:
-        incident_page = MyIncidentPage(driver)
+        incident_page = MyIncidentPage(driver, incremental=args.incremental, detail_pool=detail_pool,
+                                       metrics=metrics)
         incident_page.collect_data_through_pagination()
 
     finally:
+        if detail_pool is not None:
+            detail_pool.print_worker_throughput()
+            detail_pool.close()
+        metrics.report_progress(force=True)
+        metrics.write(args.metrics_file or f"{get_archive_folder()}/scrape_metrics.json")
         # Close the browser
         # input("Press Enter to close the browser")
         driver.quit()
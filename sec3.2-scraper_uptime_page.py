@@ -4,8 +4,8 @@ from datetime import date
 import traceback
 import argparse
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
@@ -13,6 +13,15 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException
 
+from util.util_data import ChunkedCSVWriter
+from util.util_metrics import ScrapeMetrics
+from util.util_status_page import PROVIDERS, UPTIME_COLUMNS
+
+
+def get_downtime(hours, minutes):
+    # '1 hrs', '25 mins' -> 85
+    return int(hours.split()[0]) * 60 + int(minutes.split()[0])
+
 
 class MyCalendarPage:
     # Class variable for XPaths that do not change across instances
@@ -21,12 +30,82 @@ class MyCalendarPage:
     PAGINATION_XPATH = "//div[@class='pagination']//i[@class='left-arrow']"
     SERVICE_DROPDOWN_XPATH = "//div[contains(@class, 'select-input__dropdown-indicator')]//span"
     SERVICE_LIST_XPATH = "//div[contains(@class, 'select-input__menu-list')]"
+    # Hovers over every calendar rect inside the page and reads the tooltip it renders,
+    # so a whole calendar page costs a single WebDriver round-trip instead of several per day.
+    BULK_TOOLTIP_SCRIPT = """
+        const rects = arguments[0];
+        const done = arguments[arguments.length - 1];
+        const nextFrame = () => new Promise(resolve => setTimeout(resolve, 0));
+        const text = (node) => node ? node.innerText.trim() : '';
+        const getTooltip = () => {
+            const tooltip = document.querySelector('div.tooltip-content');
+            return tooltip && tooltip.getClientRects().length ? tooltip : null;
+        };
+        (async () => {
+            const days = [];
+            // a tooltip left open by an earlier hover must not be read as the first day
+            const openTooltip = getTooltip();
+            let previousDate = openTooltip ? text(openTooltip.querySelector('p.date')) : null;
+            for (const rect of rects) {
+                for (const type of ['mouseover', 'mouseenter', 'mousemove']) {
+                    rect.dispatchEvent(new MouseEvent(type, {bubbles: true, view: window}));
+                }
+                // wait until the tooltip shows this rect's day
+                let tooltip = null;
+                for (let i = 0; i < 200; i++) {
+                    await nextFrame();
+                    tooltip = getTooltip();
+                    if (tooltip && text(tooltip.querySelector('p.date')) !== previousDate) break;
+                    tooltip = null;
+                }
+                if (!tooltip) {
+                    days.push(null);
+                    continue;
+                }
+                previousDate = text(tooltip.querySelector('p.date'));
+                const noData = tooltip.querySelector('div.no-data-msg');
+                days.push({
+                    date: previousDate,
+                    fill: rect.getAttribute('fill'),
+                    no_data_msg: noData ? text(noData) : null,
+                    outages: Array.from(tooltip.querySelectorAll('div.outage-field')).map(outage => ({
+                        type: text(outage.querySelector('span.label')),
+                        hours: text(outage.querySelector('span.value-hrs')),
+                        minutes: text(outage.querySelector('span.value-mins'))
+                    })),
+                    incidents: Array.from(tooltip.querySelectorAll('ul#related-events-list > li.related-event > a'))
+                        .map(link => ({title: text(link), href: link.href}))
+                });
+            }
+            done(days);
+        })();
+    """
 
-    def __init__(self, driver, service):
+    def __init__(self, driver, service, mode='hover', metrics=None):
         self.driver = driver
         self.service = service
-        # self.uptime_df = pd.DataFrame(columns=['Date', 'Outages', 'Downtime (min)', 'Incidents', 'Service'])
-        self.uptime_df = pd.DataFrame(columns=['Date', 'Outages', 'Outage_Color', 'Incidents', 'Service'])
+        self.mode = mode
+        # timers, wait histograms and retry counters of the run, see util/util_metrics.py
+        self.metrics = metrics or ScrapeMetrics('uptime')
+        # uptime records are streamed to the archive as they are collected, see archive_uptime_by_service()
+        self.uptime_writer = None
+        # WebDriver round-trips and wall-clock time per calendar page
+        self.page = 1
+        self.page_stats = []
+        self.round_trips = 0
+        self.count_round_trips()
+        if self.mode != 'hover':
+            self.driver.set_script_timeout(300)
+
+    def count_round_trips(self):
+        # every WebDriver command, including the ones sent by WebElement, goes through driver.execute()
+        execute = self.driver.execute
+
+        def counted_execute(driver_command, params=None):
+            self.round_trips += 1
+            return execute(driver_command, params)
+
+        self.driver.execute = counted_execute
 
     def get_tooltip_outages(self, tooltip):
         outage_list = tooltip.find_elements(By.XPATH, ".//div[contains(@class, 'outage-field')]")
@@ -39,9 +118,9 @@ class MyCalendarPage:
                 # get outage_type/status from <span class=“label”>
                 outage_type = outage.find_element(By.XPATH, ".//span[@class='label']").text
                 # get downtime
-                hours = outage.find_element(By.XPATH, ".//span[@class='value-hrs']").text.split()[0]
-                minutes = outage.find_element(By.XPATH, ".//span[@class='value-mins']").text.split()[0]
-                downtime = int(hours) * 60 + int(minutes)
+                hours = outage.find_element(By.XPATH, ".//span[@class='value-hrs']").text
+                minutes = outage.find_element(By.XPATH, ".//span[@class='value-mins']").text
+                downtime = get_downtime(hours, minutes)
                 outages.append({
                         "Outage_Type": outage_type,
                         "Downtime (min)": downtime,
@@ -71,11 +150,17 @@ class MyCalendarPage:
         Hover over the rect to get the tooltip information.
         Tooltip is the popup when hovering over a calendar rect, containing the uptime information for that day.
         """
+        with self.metrics.timer('scraper_hover_seconds', service=self.service):
+            record = self.read_hover_tooltip(rect)
+        self.metrics.report_progress()
+        return record
+
+    def read_hover_tooltip(self, rect):
         ActionChains(self.driver).move_to_element(rect).perform()
         try:
-            tooltip = WebDriverWait(self.driver, 10).until(
+            tooltip = self.metrics.wait('tooltip', lambda: WebDriverWait(self.driver, 10).until(
                 EC.visibility_of_element_located((By.XPATH, self.TOOLTIP_XPATH))
-            )
+            ))
 
             color = rect.get_attribute('fill')
             tooltip_date = tooltip.find_element(By.XPATH, ".//p[@class='date']").text
@@ -84,22 +169,80 @@ class MyCalendarPage:
             if self.send_no_data_warning(tooltip_date, tooltip):
                 return None
             else:
-                return pd.DataFrame({
-                    "Date": [tooltip_date],
-                    "Outages": [self.get_tooltip_outages(tooltip)],
-                    "Outage_Color": [color],
-                    "Incidents": [self.get_tooltip_incidents(tooltip)],
-                    "Service": [self.service]
-                })
+                return {
+                    "Date": tooltip_date,
+                    "Outages": self.get_tooltip_outages(tooltip),
+                    "Outage_Color": color,
+                    "Incidents": self.get_tooltip_incidents(tooltip),
+                    "Service": self.service
+                }
         except Exception as e:
             print("Executing hover_over_rect(). An error occurred: ", e)
+            self.metrics.inc('scraper_errors_total', step='hover_over_rect')
             traceback.print_exc()
             return None
 
+    def read_calendar_tooltips(self, calendar_rect_list):
+        """
+        Bulk alternative to hover_over_rect() for all rects of a page, producing the same records.
+        The tooltip of each day is read by BULK_TOOLTIP_SCRIPT in one asynchronous script execution.
+        """
+        records = []
+        for day in self.driver.execute_async_script(self.BULK_TOOLTIP_SCRIPT, calendar_rect_list):
+            if day is None:
+                print("Executing read_calendar_tooltips(). Tooltip not shown for a calendar rect.")
+                records.append(None)
+            elif day['no_data_msg'] is not None:
+                print({'Date': day['date'], 'Warning!': day['no_data_msg']})
+                records.append(None)
+            else:
+                outages = [{"Outage_Type": outage['type'],
+                            "Downtime (min)": get_downtime(outage['hours'], outage['minutes'])}
+                           for outage in day['outages']]
+                incidents = [{"Incident_Title": incident['title'], "Incident_Link": incident['href']}
+                             for incident in day['incidents']]
+                records.append({
+                    "Date": day['date'],
+                    "Outages": json.dumps(outages) if outages else outages,
+                    "Outage_Color": day['fill'],
+                    "Incidents": json.dumps(incidents),
+                    "Service": self.service
+                })
+        return records
+
+    def read_calendar_by_hover(self, calendar_rect_list):
+        return [self.hover_over_rect(calendar_rect) for calendar_rect in calendar_rect_list]
+
+    def read_calendar_page(self, calendar_rect_list, mode):
+        round_trips = self.round_trips
+        start = time.perf_counter()
+        if mode == 'bulk':
+            records = self.read_calendar_tooltips(calendar_rect_list)
+        else:
+            records = self.read_calendar_by_hover(calendar_rect_list)
+        self.page_stats.append({
+            "page": self.page,
+            "mode": mode,
+            "days": len(calendar_rect_list),
+            "round_trips": self.round_trips - round_trips,
+            "seconds": round(time.perf_counter() - start, 3)
+        })
+        return records
+
+    def compare_calendar_records(self, hover_records, bulk_records):
+        for hover_record, bulk_record in zip(hover_records, bulk_records):
+            if hover_record is None or bulk_record is None:
+                matched = hover_record is None and bulk_record is None
+            else:
+                matched = {key: str(value) for key, value in hover_record.items()} == \
+                          {key: str(value) for key, value in bulk_record.items()}
+            if not matched:
+                print("\nWarning: bulk and hover records differ!!!\n", hover_record, "\n", bulk_record)
+
     def get_calendar_rect_list(self):
-        calendar_rect_list = WebDriverWait(self.driver, 10).until(
+        calendar_rect_list = self.metrics.wait('calendar_rects', lambda: WebDriverWait(self.driver, 10).until(
             EC.presence_of_all_elements_located((By.XPATH, self.CALENDAR_XPATH))
-        )
+        ))
         print("Active calendar rects found in this page: ", len(calendar_rect_list))
         return calendar_rect_list
 
@@ -111,108 +254,206 @@ class MyCalendarPage:
             try:
                 # Collecting incident when hovering over calendar rect (a rect presents a day)
                 calendar_rect_list = self.get_calendar_rect_list()
-                for calendar_rect in calendar_rect_list:
-                    rect_record = self.hover_over_rect(calendar_rect)
-                    if rect_record is not None and not rect_record.empty:
+                if self.mode == 'compare':
+                    # hover first, then read the same page in bulk and check both give the same records
+                    hover_records = self.read_calendar_page(calendar_rect_list, 'hover')
+                    records = self.read_calendar_page(calendar_rect_list, 'bulk')
+                    self.compare_calendar_records(hover_records, records)
+                else:
+                    records = self.read_calendar_page(calendar_rect_list, self.mode)
+                for rect_record in records:
+                    if rect_record is not None:
                         print(rect_record)
-                        self.uptime_df = pd.concat([self.uptime_df, rect_record], ignore_index=True)
+                        self.archive_uptime_by_service(rect_record)
                     else:
                         flag_no_data = True
+                no_data_days = sum(rect_record is None for rect_record in records)
+                self.metrics.inc('scraper_days_total', len(records) - no_data_days, service=self.service)
+                self.metrics.inc('scraper_no_data_days_total', no_data_days, service=self.service)
                 return flag_no_data
             except StaleElementReferenceException:
                 print("Stale element, restarting incidents looping process.")
+                self.metrics.inc('scraper_retries_total', step='loop_over_calendar')
                 attempt += 1
                 continue
             except Exception as e:
                 print("Executing loop_over_incidents(). An error occurred: ", e)
+                self.metrics.inc('scraper_errors_total', step='loop_over_calendar')
                 traceback.print_exc()
+                attempt += 1
 
         print("\nWarning: this should not happen!!!\n")
         return [], True
 
-    def archive_uptime_by_service(self, uptime_df):
+    def get_archive_folder(self):
         # get now date as execution_date for archive
         execution_date = date.today().strftime("%Y-%m-%d")
         # archive_folder = f"data/raw/uptime/{self.service}/{execution_date}"
         archive_folder = f"data/raw/uptime/{execution_date}/{self.service}"
         os.makedirs(archive_folder, exist_ok=True)
-        uptime_df.to_csv(f"{archive_folder}/uptime_history.csv", index=False)
+        return archive_folder
+
+    def archive_uptime_by_service(self, uptime_record):
+        if self.uptime_writer is None:
+            self.uptime_writer = ChunkedCSVWriter(f"{self.get_archive_folder()}/uptime_history.csv", UPTIME_COLUMNS)
+        self.uptime_writer.write(uptime_record)
+
+    def archive_page_stats(self):
+        with open(f"{self.get_archive_folder()}/scrape_stats.json", "w") as f:
+            json.dump(self.page_stats, f, indent=2)
+        for mode in sorted(set(stats['mode'] for stats in self.page_stats)):
+            mode_stats = [stats for stats in self.page_stats if stats['mode'] == mode]
+            print(f"{mode}: {len(mode_stats)} pages, "
+                  f"{sum(stats['round_trips'] for stats in mode_stats)} WebDriver round-trips, "
+                  f"{sum(stats['seconds'] for stats in mode_stats):.1f}s")
 
     def go_to_previous_page(self):
         prev_page = self.driver.find_element(By.XPATH, self.PAGINATION_XPATH)
         if prev_page:
             prev_page.click()
-            time.sleep(1)
+            self.page += 1
+            self.metrics.sleep(1, step='go_to_previous_page')
 
     def change_service(self):
         # Dropdown
-        service_dropdown = WebDriverWait(self.driver, 10).until(
+        service_dropdown = self.metrics.wait('service_dropdown', lambda: WebDriverWait(self.driver, 10).until(
             EC.visibility_of_element_located((By.XPATH, self.SERVICE_DROPDOWN_XPATH))
-        )
+        ))
         service_dropdown.click()
 
         # Select service from list
-        service_list = WebDriverWait(self.driver, 10).until(
+        service_list = self.metrics.wait('service_list', lambda: WebDriverWait(self.driver, 10).until(
             EC.visibility_of_element_located((By.XPATH, self.SERVICE_LIST_XPATH))
-        )
+        ))
         options = service_list.find_elements(By.XPATH, ".//div[contains(@class, 'select-input__option')]")
         for option in options:
-            if option.text.lower() == service:
+            if option.text.lower() == self.service:
                 option.click()  # click operation
                 break
-        time.sleep(1)
+        else:
+            # do not collect the default service under the wrong name
+            raise ValueError(f"Service {self.service} not found in the service dropdown.")
+        self.metrics.sleep(1, step='change_service')
 
-    def collect_data_through_pagination(self):
-        """Collect uptime data by uptime history pages"""
+    def collect_data_through_pagination(self, default_service='api'):
+        """Collect uptime data by uptime history pages. Returns whether the service was archived."""
         try:
-            if self.service != 'api':
+            if self.service != default_service:
                 self.change_service()
 
             while True:
                 # Get the uptime record by looping over the calendar rect list in the current page
-                flag_no_data = self.loop_over_calendar()
+                with self.metrics.timer('scraper_page_seconds', service=self.service):
+                    flag_no_data = self.loop_over_calendar()
+                self.metrics.report_progress(force=True)
                 # Go to the previous page
                 if not flag_no_data:
                     self.go_to_previous_page()
                 else:
                     print("No more previous data. Ending uptime data collecting.")
                     break
-            # Archive the uptime records for the selected service
-            self.archive_uptime_by_service(self.uptime_df)
+            # Archive the remaining uptime records for the selected service
+            if self.uptime_writer is None:
+                # no records at all, still archive the header
+                ChunkedCSVWriter(f"{self.get_archive_folder()}/uptime_history.csv", UPTIME_COLUMNS).close()
+            self.archive_page_stats()
+            return True
         except Exception as e:
             print("Executing collect_data_through_pagination(). An error occurred: ", e)
             traceback.print_exc()
+            return False
+        finally:
+            if self.uptime_writer is not None:
+                self.uptime_writer.close()
+
+
+def create_driver(headless=False):
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+        # tooltips only render for rects inside the viewport
+        options.add_argument("--window-size=1920,1080")
+    return webdriver.Chrome(options=options)
+
+
+def collect_service(provider, service, mode='hover', headless=False, metrics=None):
+    """Collect the uptime data of one service in its own browser session."""
+    driver = create_driver(headless)
+    try:
+        driver.get(f"{PROVIDERS[provider]['url']}/uptime/")
+        calendar_page = MyCalendarPage(driver, service, mode, metrics)
+        # the uptime page opens on the first service of the provider
+        return calendar_page.collect_data_through_pagination(PROVIDERS[provider]['services'][0])
+    finally:
+        driver.quit()
+
+
+def collect_services(provider, services, mode='hover', sessions=1, headless=True, metrics=None):
+    """
+    Collect several services at once, each in its own browser session, at most sessions at a time.
+    A failed session only fails its own service. Returns the services that were not archived.
+    """
+    failed_services = []
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        futures = {executor.submit(collect_service, provider, service, mode, headless, metrics): service
+                   for service in services}
+        for future in as_completed(futures):
+            service = futures[future]
+            try:
+                archived = future.result()
+            except Exception as e:
+                print(f"Collecting {service}. An error occurred: ", e)
+                traceback.print_exc()
+                archived = False
+            print(f"{service}: {'archived' if archived else 'failed'}")
+            if not archived:
+                failed_services.append(service)
+    return failed_services
 
 
 def parse_arguments():
-    valid_services = ['api', 'chatgpt', 'labs', 'playground'] # openai services
-    # valid_services = ['claude.ai', 'api.anthropic.com', 'console.anthropic.com']  # anthropic services
-    # valid_services = ['character.ai']  # character.ai service
-
-    parser = argparse.ArgumentParser(description='Collect uptime data for a specified service. Default service is api.')
-    parser.add_argument('-S', '--service', type=lambda s: str(s).lower(),
-                        choices=valid_services, default='api',
-                        help=f"Choose which service to collect data for.")
+    parser = argparse.ArgumentParser(description='Collect uptime data for the specified services. '
+                                                 'Default service is the first service of the provider, e.g. api.')
+    parser.add_argument('-P', '--provider', choices=list(PROVIDERS), default='openai',
+                        help="Provider whose uptime page to collect. Default is openai.")
+    parser.add_argument('-S', '--services', type=lambda s: str(s).lower(), nargs='+', default=None,
+                        help="Choose which services of the provider to collect data for, or 'all'.")
+    parser.add_argument('-N', '--sessions', type=int, default=1,
+                        help="Number of headless browser sessions collecting services at once. "
+                             "Default 1 collects the services one after another in a visible browser.")
+    parser.add_argument('-M', '--mode', choices=['hover', 'bulk', 'compare'], default='hover',
+                        help="How to read the calendar tooltips: hover over each day, read all days of a page "
+                             "in one script execution, or do both and compare the records. Default is hover.")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Where to write the timers, wait histograms and retry counters of the run: JSON, or a "
+                             "Prometheus textfile if it ends with .prom. Default scrape_metrics.json in the archive "
+                             "partition.")
     args = parser.parse_args()
+
+    valid_services = PROVIDERS[args.provider]['services']
+    if args.services is None:
+        args.services = valid_services[:1]
+    elif args.services == ['all']:
+        args.services = valid_services
+    invalid_services = [service for service in args.services if service not in valid_services]
+    if invalid_services:
+        parser.error(f"invalid services for {args.provider}: {', '.join(invalid_services)} "
+                     f"(choose from {', '.join(valid_services)}, or all)")
     return args
 
 
 if __name__ == "__main__":
 
     args = parse_arguments()
-    service = args.service
-    print("Collecting uptime data for service: {}".format(service))
-
-    driver = webdriver.Chrome()
-    driver.get("https://status.openai.com/uptime/") # openai services
-    # driver.get("https://status.anthropic.com/uptime")  # anthropic services
-    # driver.get("https://status.character.ai/uptime")  # character.ai service
+    print("Collecting uptime data for services: {}".format(', '.join(args.services)))
 
+    # a single session keeps the visible browser of the original workflow
+    metrics = ScrapeMetrics('uptime')
     try:
-        calendar_page = MyCalendarPage(driver, service)
-        calendar_page.collect_data_through_pagination()
-
+        failed_services = collect_services(args.provider, args.services, args.mode, args.sessions,
+                                           headless=args.sessions > 1, metrics=metrics)
     finally:
-        # Close the browser
-        # input("Press Enter to close the browser")
-        driver.quit()
+        metrics.report_progress(force=True)
+        metrics.write(args.metrics_file or f"data/raw/uptime/{date.today().strftime('%Y-%m-%d')}/scrape_metrics.json")
+    if failed_services:
+        print("\nWarning: failed to collect services: {}\n".format(', '.join(failed_services)))
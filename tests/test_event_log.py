@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from util.util_event_log import EVENT_CONFIG, update_event_log
+
+RAW_DIR = os.path.abspath('data/raw')
+PARTITION = '2024-08-31'
+
+
+@pytest.mark.parametrize('data_type', list(EVENT_CONFIG))
+def test_unchanged_partitions(data_type, tmp_path, monkeypatch):
+    # the clean layer is written relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    raw_dir = tmp_path / 'raw'
+    event_dir = str(tmp_path / 'events')
+    shutil.copytree(os.path.join(RAW_DIR, data_type, PARTITION), raw_dir / data_type / PARTITION)
+    first = update_event_log(data_type, str(raw_dir), event_dir, verify=True)
+
+    # the same scrape under later dates appends header-only segments
+    for partition in ['2024-09-01', '2024-09-02']:
+        shutil.copytree(os.path.join(RAW_DIR, data_type, PARTITION), raw_dir / data_type / partition)
+        state = update_event_log(data_type, str(raw_dir), event_dir, verify=True)
+        assert state['segments'] == len(os.listdir(os.path.join(event_dir, data_type, 'log')))
+        pd.testing.assert_frame_equal(state['clean'], first['clean'])
+
+
+@pytest.mark.parametrize('data_type', list(EVENT_CONFIG))
+def test_clean_row_order(data_type, tmp_path, monkeypatch):
+    config = EVENT_CONFIG[data_type]
+    committed = os.path.abspath(os.path.join('data/clean', config['layer_type'], PARTITION, config['file_name']))
+    monkeypatch.chdir(tmp_path)
+    clean_dir = tmp_path / 'data' / 'clean' / config['layer_type'] / PARTITION
+    clean_dir.mkdir(parents=True)
+    shutil.copy(committed, clean_dir)
+
+    update_event_log(data_type, RAW_DIR, str(tmp_path / 'events'))
+    with open(committed) as expected, open(clean_dir / config['file_name']) as written:
+        assert written.read() == expected.read()
+    assert os.listdir(clean_dir) == [config['file_name']]
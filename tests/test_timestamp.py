@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.util_timestamp import parse_update_time, parse_update_timestamps
+
+TIMESTAMPS = ['Posted 3 days ago. Aug 28, 2024 - 13:36 PDT', 'Posted 7 months ago. Jan 05, 2024 - 09:02 PST']
+
+
+def test_matches_reference_parser():
+    parsed = parse_update_timestamps(TIMESTAMPS + TIMESTAMPS[:1])
+    assert list(parsed) == [parse_update_time(timestamp) for timestamp in TIMESTAMPS + TIMESTAMPS[:1]]
+
+
+@pytest.mark.parametrize('timestamps', [[np.nan, None], [np.nan], [None], []])
+def test_all_missing(timestamps):
+    parsed = parse_update_timestamps(pd.Series(timestamps, dtype=object), 'US/Pacific')
+    assert len(parsed) == len(timestamps)
+    assert parsed.isna().all()
+    assert str(parsed.dtype) == 'datetime64[ns, US/Pacific]'
+
+
+def test_missing_values_stay_nat():
+    parsed = parse_update_timestamps([TIMESTAMPS[0], None, np.nan])
+    assert parsed.iloc[0] == pd.Timestamp('2024-08-28 20:36', tz='UTC')
+    assert parsed.iloc[1:].isna().all()
@@ -0,0 +1,187 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.util_cooccurrence import MINUTES_PER_DAY
+from util.util_incident import SERVICE_LABELS
+
+
+# outage services in the order of the figures and tables, services of new providers follow in name order
+SERVICE_ORDER = ['api', 'chatgpt', 'labs', 'playground', 'api.anthropic.com', 'claude.ai', 'console.anthropic.com',
+                 'character.ai']
+
+# lower bounds of the nines buckets in percent, a day counts in every bucket it reaches
+NINES = [('=100%', 100), ('>=99.999%', 99.999), ('>=99.99%', 99.99), ('>=99.9%', 99.9), ('>=99%', 99),
+         ('>=90%', 90)]
+
+
+def load_outage_days(path='data/clean/outage/2024-08-31/outage_unexploded.csv'):
+    return pd.read_csv(path, parse_dates=['Date'])
+
+
+def get_day_matrix(df, column='scaled_total_outage_minutes', services=None, start=None, end=None, label=True):
+    """
+    Scatter one column of the outage days of all services into a service x day matrix, in a single assignment.
+    Days before a service's status page history starts, or otherwise not scraped, are NaN.
+    Returns the matrix, the service names and the dates of the columns.
+    """
+    if services is None:
+        present = set(df['Service'])
+        services = [service for service in SERVICE_ORDER if service in present]
+        services += sorted(present - set(services))
+    df = df[df['Service'].isin(services)]
+    dates = df['Date'].to_numpy().astype('datetime64[D]')
+    start = np.datetime64(start, 'D') if start is not None else dates.min()
+    end = np.datetime64(end, 'D') if end is not None else dates.max()
+    in_range = (dates >= start) & (dates <= end)
+
+    days = np.arange(start, end + 1)
+    matrix = np.full((len(services), len(days)), np.nan)
+    rows = pd.Index(services).get_indexer(df['Service'][in_range])
+    matrix[rows, (dates[in_range] - start).astype(np.int64)] = df[column].to_numpy(dtype=float)[in_range]
+    if label:
+        services = [SERVICE_LABELS.get(service, service) for service in services]
+    return matrix, services, pd.DatetimeIndex(days)
+
+
+def to_day_frame(matrix, services, dates):
+    """Matrix as a frame with a Date column and one column per service, like the notebooks' date scaffolding."""
+    return pd.DataFrame(matrix.T, columns=services).assign(Date=dates)[['Date'] + list(services)]
+
+
+def get_daily_availability(outage_minutes):
+    """Availability of each day in percent."""
+    return (1 - outage_minutes / MINUTES_PER_DAY) * 100
+
+
+def get_window_availability(outage_minutes, starts, lengths):
+    """
+    Availability in percent of consecutive day windows, given their first column and length.
+    Uses the cumulative outage minutes and observed days along each row, so every window costs O(1).
+    A window counts the days observed in it, windows without any observed day are NaN.
+    """
+    observed = ~np.isnan(outage_minutes)
+    zeros = np.zeros((outage_minutes.shape[0], 1))
+    minutes = np.hstack([zeros, np.cumsum(np.where(observed, outage_minutes, 0), axis=1)])
+    days = np.hstack([zeros, np.cumsum(observed, axis=1)])
+    ends = starts + lengths
+    window_minutes = minutes[:, ends] - minutes[:, starts]
+    window_days = days[:, ends] - days[:, starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (1 - window_minutes / (window_days * MINUTES_PER_DAY)) * 100, window_days
+
+
+def get_period_availability(outage_minutes, dates, freq='W'):
+    """
+    Availability per calendar period in percent, e.g. freq='W' (weeks from Monday) or 'M' (months).
+    Returns the service x period matrix and the periods.
+    """
+    periods = dates.to_period(freq)
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    lengths = np.diff(np.r_[starts, len(dates)])
+    availability, _ = get_window_availability(outage_minutes, starts, lengths)
+    return availability, periods[starts]
+
+
+def get_rolling_availability(outage_minutes, window):
+    """
+    Availability in percent of every window of `window` consecutive days, the column of a window is its last day.
+    Windows with an unobserved day are NaN, so they never show up as best or worst windows.
+    """
+    days = outage_minutes.shape[1]
+    availability = np.full(outage_minutes.shape, np.nan)
+    if days < window:
+        return availability
+    starts = np.arange(days - window + 1)
+    window_availability, window_days = get_window_availability(outage_minutes, starts, np.full(len(starts), window))
+    availability[:, window - 1:] = np.where(window_days == window, window_availability, np.nan)
+    return availability
+
+
+def get_availability_table(availability, services):
+    """
+    Min, max, mean and median daily availability of each service, and the share of its observed days in each
+    nines bucket, all in percent. One comparison of the whole matrix against all bucket bounds.
+    """
+    observed = (~np.isnan(availability)).sum(axis=1)
+    bounds = np.array([bound for _, bound in NINES])
+    with np.errstate(invalid='ignore'):
+        counts = (availability[None, :, :] >= bounds[:, None, None]).sum(axis=2)
+        below = (availability < bounds[-1]).sum(axis=1)
+    table = pd.DataFrame({
+        'Service': services,
+        'Min': np.nanmin(availability, axis=1),
+        'Max': np.nanmax(availability, axis=1),
+        'Mean': np.nanmean(availability, axis=1),
+        'Median': np.nanmedian(availability, axis=1),
+    })
+    for (name, _), count in zip(NINES, counts):
+        table[name] = count / observed * 100
+    table[f'<{bounds[-1]:g}%'] = below / observed * 100
+    return table
+
+
+def get_worst_windows(outage_minutes, services, dates, window, top=1):
+    """
+    The `top` non-overlapping windows of `window` days with the lowest availability, per service.
+    Returns one row per window with its first and last day, availability and outage minutes.
+    """
+    availability = get_rolling_availability(outage_minutes, window)
+    records = []
+    for row, service in enumerate(services):
+        # windows ordered from worst to best, then greedily skip the ones overlapping a window already taken
+        order = np.argsort(availability[row], kind='stable')
+        order = order[~np.isnan(availability[row][order])]
+        taken = np.zeros(len(dates), dtype=bool)
+        found = 0
+        for end in order:
+            if found == top:
+                break
+            start = end - window + 1
+            if taken[start:end + 1].any():
+                continue
+            taken[start:end + 1] = True
+            found += 1
+            records.append({
+                'Service': service,
+                'start': dates[start],
+                'end': dates[end],
+                'availability': availability[row, end],
+                'outage_minutes': np.nansum(outage_minutes[row, start:end + 1]),
+            })
+    return pd.DataFrame(records, columns=['Service', 'start', 'end', 'availability', 'outage_minutes'])
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Daily, weekly, monthly and rolling service availability.')
+    parser.add_argument('--path', default='data/clean/outage/2024-08-31/outage_unexploded.csv')
+    parser.add_argument('--column', default='scaled_total_outage_minutes',
+                        help='Outage minutes column, scaled_total_outage_minutes or total_outage_minutes.')
+    parser.add_argument('-W', '--window', type=int, default=30, help='Days of the rolling and worst windows.')
+    parser.add_argument('--top', type=int, default=3, help='Worst windows to report per service.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    df = load_outage_days(args.path)
+    start_time = time.perf_counter()
+    outage_minutes, services, dates = get_day_matrix(df, args.column)
+    daily = get_daily_availability(outage_minutes)
+    table = get_availability_table(daily, services)
+    weekly, weeks = get_period_availability(outage_minutes, dates, 'W')
+    monthly, months = get_period_availability(outage_minutes, dates, 'M')
+    rolling = get_rolling_availability(outage_minutes, args.window)
+    worst = get_worst_windows(outage_minutes, services, dates, args.window, args.top)
+    elapsed = time.perf_counter() - start_time
+
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', None)
+    print(f'Daily availability (%):\n{table.round(2)}\n')
+    print(f'Worst weekly availability (%):\n{pd.Series(np.nanmin(weekly, axis=1), index=services).round(3)}\n')
+    print(f'Monthly availability (%):\n{pd.DataFrame(monthly, index=services, columns=months).T.round(3)}\n')
+    print(f'Worst {args.window}-day windows:\n{worst}\n')
+    print(f'{len(services)} services x {len(dates)} days in {elapsed:.3f}s')
@@ -0,0 +1,159 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from util.util_availability import get_availability_table, get_daily_availability, get_day_matrix
+from util.util_data import read_data, load_json_column, unnest_lst_json, unnest_dict, explode_incident_dates, \
+    explode_incident_services
+from util.util_schema import to_typed_incident
+from util.util_synthetic import SYNTHETIC_ROOT, generate_dataset
+from util.util_transform import parse_outages, transform_incidents, transform_uptime
+
+
+RESULTS_PATH = 'data/benchmark/results.csv'
+RESULT_COLUMNS = ['run_at', 'commit', 'scale', 'stage', 'rows', 'seconds', 'peak_mib']
+
+# 1x is about the size of the collected dataset: 3 providers with 3 services each, 3 years, ~550 incidents
+BASE_PROVIDERS = 3
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def get_dataset(scale, root=SYNTHETIC_ROOT, seed=0):
+    """Synthetic dataset of scale times the base providers, regenerated only when its config changed."""
+    root = os.path.join(root, f'scale={scale}')
+    config_path = os.path.join(root, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+        if config['n_providers'] == BASE_PROVIDERS * scale and config['seed'] == seed:
+            return root, config
+    start = time.perf_counter()
+    config = generate_dataset(root, n_providers=BASE_PROVIDERS * scale, seed=seed)
+    print(f"generated {config['incident_count']} incidents in {time.perf_counter() - start:.1f}s")
+    return root, config
+
+
+def measure(results, scale, stage, make_args, func, profile_memory=True):
+    """
+    Time func(*make_args()) and, in a second run under tracemalloc, its peak allocated memory.
+    The arguments are built outside the measured runs, so copies of the inputs are not counted.
+    """
+    args = make_args()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+    peak_mib = None
+    if profile_memory:
+        args = make_args()
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args)
+        peak_mib = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    if isinstance(result, list):
+        # one frame per provider, the rows are the rows of all frames
+        rows = sum(len(part) for part in result)
+    else:
+        rows = len(result) if hasattr(result, '__len__') else None
+    results.append({'scale': scale, 'stage': stage, 'rows': rows, 'seconds': seconds, 'peak_mib': peak_mib})
+    memory = f', peak {peak_mib:.1f} MiB' if peak_mib is not None else ''
+    print(f'{scale}x {stage}: {seconds:.3f}s{memory}, {rows} rows')
+    return result
+
+
+def to_typed_provider_incidents(stages, providers):
+    # the service mask has at most 64 bits, the incidents of a provider only affect its own services
+    all_services = [service for config in providers.values() for service in config['services']]
+    columns = [column for column in stages.columns if column not in set(all_services)]
+    return [to_typed_incident(stages.loc[stages['provider'] == provider, columns + config['services']],
+                              config['services']) for provider, config in providers.items()]
+
+
+def get_service_lists(stages, services):
+    # the affected services of each incident, read back from its own service flags, so they stay aligned with
+    # the rows transform_incidents kept after dropping duplicate snapshots
+    flags = stages[services].to_numpy() == 1
+    return stages.assign(services=[[service for service, flag in zip(services, row) if flag] for row in flags])
+
+
+def run_scale(scale, root=SYNTHETIC_ROOT, profile_memory=True):
+    """Every stage from the raw CSVs to the analysis inputs, each fed with the output of the stage before it."""
+    root, config = get_dataset(scale, root)
+    incident_dir = os.path.join(root, 'raw', 'incident', config['execution_date'])
+    uptime_dir = os.path.join(root, 'raw', 'uptime', config['execution_date'])
+    services = config['services']
+    results = []
+
+    raw_incidents = measure(results, scale, 'read_data incident', lambda: (incident_dir,), read_data, profile_memory)
+    raw_uptime = measure(results, scale, 'read_data uptime', lambda: (uptime_dir,), read_data, profile_memory)
+    incidents = measure(results, scale, 'load_json_column Updates',
+                        lambda: (raw_incidents.reset_index(drop=True), 'Updates'), load_json_column, profile_memory)
+    measure(results, scale, 'unnest_lst_json Updates', lambda: (incidents[['Incident_Link', 'Updates']].copy(),
+                                                               'Updates'), unnest_lst_json, profile_memory)
+    outages = load_json_column(raw_uptime.reset_index(drop=True), 'Outages')
+    outages['Outages'] = outages['Outages'].apply(parse_outages)
+    measure(results, scale, 'unnest_dict Outages', lambda: (outages.copy(), 'Outages'), unnest_dict, profile_memory)
+
+    stages = measure(results, scale, 'transform_incidents', lambda: (raw_incidents.copy(), services),
+                     transform_incidents, profile_memory)
+    outage_days = measure(results, scale, 'transform_uptime', lambda: (raw_uptime.copy(),), transform_uptime,
+                          profile_memory)
+    measure(results, scale, 'explode_incident_dates', lambda: (stages,), explode_incident_dates, profile_memory)
+    service_lists = get_service_lists(stages, services)
+    measure(results, scale, 'explode_incident_services', lambda: (service_lists,), explode_incident_services,
+            profile_memory)
+    measure(results, scale, 'to_typed_incident', lambda: (stages, config['providers']), to_typed_provider_incidents,
+            profile_memory)
+    measure(results, scale, 'availability table',
+            lambda: (outage_days,), lambda df: get_availability_table(
+                get_daily_availability(get_day_matrix(df, services=services)[0]), services), profile_memory)
+    return results
+
+
+def save_results(results, path=RESULTS_PATH):
+    """Append the results to the CSV of all benchmark runs, with the run time and commit."""
+    df = pd.DataFrame(results)
+    df.insert(0, 'run_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    df.insert(1, 'commit', get_commit())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df[RESULT_COLUMNS].to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+    print(f'writing results to: {path}')
+    return df
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Time and memory-profile the data path on synthetic datasets.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help=f'Dataset sizes, in multiples of {BASE_PROVIDERS} providers.')
+    parser.add_argument('--root', default=SYNTHETIC_ROOT, help='Where the synthetic datasets are generated.')
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--no-memory', action='store_true', help='Only time the stages, without tracemalloc runs.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    results = []
+    for scale in args.scales:
+        results += run_scale(scale, args.root, not args.no_memory)
+    df = save_results(results, args.results)
+
+    pd.set_option('display.width', 200)
+    print(df.pivot(index='stage', columns='scale', values='seconds').loc[df['stage'].unique()].round(3))
@@ -0,0 +1,136 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from util.util_incident import SERVICE_LABELS
+from util.util_lifecycle import DURATIONS, SERVICE_COLUMNS, load_incident_stages, drop_ordering_violations, \
+    get_service_durations, to_hours
+
+
+PERCENTILES = [90, 95]
+# bootstrap values kept in memory at once per service, resamples are drawn in batches of at most this many values
+MAX_BATCH_VALUES = 2 ** 24
+RESULT_COLUMNS = ['service', 'metric', 'statistic', 'n', 'estimate', 'ci_low', 'ci_high']
+
+
+def get_statistic_names(percentiles=PERCENTILES):
+    return ['mean', 'median'] + [f'p{q:g}' for q in percentiles]
+
+
+def compute_statistics(samples, percentiles=PERCENTILES):
+    """
+    Mean, median and percentiles along the last axis, one row per statistic.
+    The samples are sorted once and every percentile is interpolated from the sorted values, the same linear
+    interpolation as np.percentile, which would partition the samples again for each percentile.
+    """
+    ordered = np.sort(samples, axis=-1)
+    positions = np.array([50] + list(percentiles), dtype=float) / 100 * (samples.shape[-1] - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.ceil(positions).astype(int)
+    quantiles = ordered[..., lower] + (ordered[..., upper] - ordered[..., lower]) * (positions - lower)
+    return np.concatenate([np.mean(samples, axis=-1)[None], np.moveaxis(quantiles, -1, 0)])
+
+
+def bootstrap_statistics(values, n_resamples, rng, percentiles=PERCENTILES, max_batch_values=MAX_BATCH_VALUES):
+    """
+    Statistics of n_resamples bootstrap resamples of values, as a (statistics x resamples) array.
+    All resamples of a batch are drawn as one index matrix and reduced along its rows, with no loop per resample.
+    """
+    values = np.asarray(values, dtype=float)
+    batch_size = max(1, max_batch_values // len(values))
+    batches = []
+    for start in range(0, n_resamples, batch_size):
+        indices = rng.integers(0, len(values), size=(min(batch_size, n_resamples - start), len(values)))
+        batches.append(compute_statistics(values[indices], percentiles))
+    return np.concatenate(batches, axis=1)
+
+
+def bootstrap_service(service, metric_values, n_resamples, seed, confidence=0.95, percentiles=PERCENTILES):
+    """Percentile bootstrap intervals of every metric of one service, run in a worker process."""
+    rng = np.random.default_rng(seed)
+    alpha = (1 - confidence) / 2
+    names = get_statistic_names(percentiles)
+    rows = []
+    for metric, values in metric_values.items():
+        if len(values) == 0:
+            continue
+        estimates = compute_statistics(values, percentiles)
+        bounds = np.quantile(bootstrap_statistics(values, n_resamples, rng, percentiles), [alpha, 1 - alpha], axis=1)
+        for i, name in enumerate(names):
+            rows.append([service, metric, name, len(values), estimates[i], bounds[0, i], bounds[1, i]])
+    return rows
+
+
+def get_metric_values(durations, metrics=DURATIONS):
+    """Non-missing durations in hours of every service, and of all services pooled as 'All'."""
+    hours = to_hours(durations[metrics])
+    services = [SERVICE_LABELS[column] for column in SERVICE_COLUMNS] + ['All']
+    groups = dict(list(hours.groupby(durations['service'])))
+    groups['All'] = hours
+    return {service: {metric: groups[service][metric].dropna().to_numpy() for metric in metrics}
+            for service in services if service in groups}
+
+
+def bootstrap_durations(durations, n_resamples=10000, confidence=0.95, percentiles=PERCENTILES, workers=None,
+                        seed=0):
+    """
+    Bootstrap confidence intervals of the mean, median and percentiles of every per-service duration metric.
+    Services are spread over a process pool. Each service gets its own seed from seed, so the result does not
+    depend on the number of workers.
+    """
+    metric_values = get_metric_values(durations)
+    seeds = np.random.SeedSequence(seed).spawn(len(metric_values))
+    args = [(service, values, n_resamples, service_seed, confidence, percentiles)
+            for (service, values), service_seed in zip(metric_values.items(), seeds)]
+    if workers == 1:
+        results = [bootstrap_service(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(bootstrap_service, *zip(*args)))
+    return pd.DataFrame([row for rows in results for row in rows], columns=RESULT_COLUMNS)
+
+
+def format_intervals(intervals, statistic='mean', decimals=2):
+    """Service x metric table of 'estimate [ci_low, ci_high]' for one statistic."""
+    df = intervals[intervals['statistic'] == statistic]
+    cells = df.apply(lambda row: f"{row['estimate']:.{decimals}f} [{row['ci_low']:.{decimals}f}, "
+                                 f"{row['ci_high']:.{decimals}f}]", axis=1)
+    table = pd.DataFrame({'service': df['service'], 'metric': df['metric'], 'cell': cells})
+    table = table.pivot(index='service', columns='metric', values='cell')
+    return table.reindex(index=pd.unique(df['service']), columns=pd.unique(df['metric']))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Bootstrap confidence intervals of the stage durations, MTTR and '
+                                                 'MTBF per service.')
+    parser.add_argument('--path', default='data/clean/incident/2024-08-31/incident_stages.csv')
+    parser.add_argument('-B', '--resamples', type=int, default=10000)
+    parser.add_argument('-C', '--confidence', type=float, default=0.95)
+    parser.add_argument('-q', '--percentiles', type=float, nargs='*', default=PERCENTILES)
+    parser.add_argument('-W', '--workers', type=int, default=None, help='Parallel processes, default all cores.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help='CSV of all intervals.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    durations = get_service_durations(drop_ordering_violations(load_incident_stages(args.path)))
+    start = time.perf_counter()
+    intervals = bootstrap_durations(durations, args.resamples, args.confidence, args.percentiles, args.workers,
+                                    args.seed)
+    elapsed = time.perf_counter() - start
+
+    pd.set_option('display.width', 250)
+    pd.set_option('display.max_columns', 20)
+    for statistic in ['mean', 'median']:
+        print(f'{statistic} [hours] with {args.confidence:.0%} bootstrap interval:\n'
+              f'{format_intervals(intervals, statistic)}\n')
+    if args.output:
+        print(f'writing intervals to: {args.output}')
+        intervals.to_csv(args.output, index=False)
+    print(f'{args.resamples} resamples of {intervals["service"].nunique()} services in {elapsed:.2f}s')
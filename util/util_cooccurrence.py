@@ -0,0 +1,183 @@
+import argparse
+import time
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from util.util_incident import SERVICE_LABELS, get_incident_services
+
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(timestamps):
+    """Minutes since the epoch, tz-aware timestamps are taken in UTC."""
+    timestamps = pd.to_datetime(timestamps)
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    return timestamps.to_numpy().astype('datetime64[m]').astype(np.int64)
+
+
+def load_incident_intervals(path='data/clean/incident/2024-08-31/incident_stages.csv', label=True):
+    """One [start_timestamp, close_timestamp) interval per incident and affected service."""
+    df = pd.read_csv(path)
+    services = get_incident_services(df)
+    rows = services['row'].to_numpy()
+    return pd.DataFrame({
+        'service': services['service' if label else 'column'].to_numpy(),
+        'start': to_minutes(df['start_timestamp'].iloc[rows]),
+        'end': to_minutes(df['close_timestamp'].iloc[rows]),
+        'incident_id': df['incident_id'].to_numpy()[rows],
+    })
+
+
+def load_outage_intervals(path='data/clean/outage/2024-08-31/outage_unexploded.csv', label=True):
+    """
+    One whole-day interval per service and outage day. The uptime calendar only gives outage minutes per day,
+    not when in the day they happened, so outages are as precise as the calendar day.
+    """
+    df = pd.read_csv(path, parse_dates=['Date'])
+    # outage_flag counts the outage types of the day, partial and major
+    df = df[df['outage_flag'] > 0]
+    start = to_minutes(df['Date'])
+    return pd.DataFrame({
+        'service': df['Service'].map(SERVICE_LABELS).to_numpy() if label else df['Service'].to_numpy(),
+        'start': start,
+        'end': start + MINUTES_PER_DAY,
+    })
+
+
+def merge_intervals(intervals):
+    """Union of the intervals of each service, as disjoint intervals sorted by service and start."""
+    intervals = intervals[intervals['end'] > intervals['start']].sort_values(['service', 'start'], kind='stable')
+    previous_end = intervals.groupby('service', sort=False)['end'].transform(
+        lambda end: end.cummax().shift(fill_value=np.iinfo(np.int64).min))
+    intervals = intervals.assign(run=(intervals['start'] > previous_end).cumsum())
+    return intervals.groupby('run').agg(service=('service', 'first'), start=('start', 'min'),
+                                        end=('end', 'max')).reset_index(drop=True)
+
+
+def get_activity_matrix(intervals, services=None):
+    """
+    Sweep over the sorted interval endpoints of all services.
+    Consecutive endpoints bound the elementary segments, in which the set of services with a failure is constant.
+    Returns the segment boundaries, the sparse segment x service activity matrix and the service names.
+    """
+    intervals = merge_intervals(intervals)
+    if services is None:
+        services = sorted(intervals['service'].unique())
+    intervals = intervals[intervals['service'].isin(services)]
+    service_index = pd.Index(services)
+
+    boundaries = np.unique(np.concatenate([intervals['start'].to_numpy(), intervals['end'].to_numpy()]))
+    first = np.searchsorted(boundaries, intervals['start'].to_numpy())
+    last = np.searchsorted(boundaries, intervals['end'].to_numpy())
+    # each merged interval covers the contiguous segments first..last-1
+    counts = last - first
+    segments = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    columns = np.repeat(service_index.get_indexer(intervals['service']), counts)
+    activity = sparse.csr_matrix((np.ones(len(segments), dtype=np.int64), (segments, columns)),
+                                 shape=(max(len(boundaries) - 1, 0), len(services)))
+    activity.sort_indices()
+    return boundaries, activity, services
+
+
+def get_pairwise_cooccurrence(boundaries, activity, services):
+    """
+    Overlap minutes and overlapping episodes of every service pair, with the segment lengths as weights.
+    An episode is a maximal run of consecutive segments in which both services fail.
+    """
+    lengths = sparse.diags(np.diff(boundaries))
+    overlap = (activity.T @ lengths @ activity).toarray()
+    # a segment continues an episode when both services also failed in the segment before
+    continued = activity[1:].multiply(activity[:-1])
+    episodes = (activity.T @ activity).toarray() - (continued.T @ continued).toarray()
+
+    overlap = pd.DataFrame(overlap, index=services, columns=services)
+    episodes = pd.DataFrame(episodes, index=services, columns=services)
+    # probability.loc[a, b]: share of the failure time of b during which a also failed, P(a | b)
+    durations = np.diag(overlap.to_numpy())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probability = pd.DataFrame(overlap.to_numpy() / durations, index=services, columns=services)
+    return overlap, episodes, probability
+
+
+def get_kway_cooccurrence(boundaries, activity, services, max_k=3):
+    """
+    Overlap minutes and episodes of every combination of 2..max_k services that failed at the same time.
+    Segments are first reduced to their distinct active sets and transitions between active sets, so only the
+    combinations contained in an observed active set are enumerated, once per distinct set.
+    """
+    lengths = np.diff(boundaries)
+    window = boundaries[-1] - boundaries[0] if len(boundaries) else 0
+    active_sets = {}
+    transitions = {}
+    previous = ()
+    for active, length in zip(map(tuple, np.split(activity.indices, activity.indptr[1:-1])), lengths):
+        if len(active) >= 2:
+            active_sets[active] = active_sets.get(active, 0) + length
+            if active != previous:
+                transitions[previous, active] = transitions.get((previous, active), 0) + 1
+        previous = active
+
+    overlap = {}
+    for active, length in active_sets.items():
+        for k in range(2, min(max_k, len(active)) + 1):
+            for combination in combinations(active, k):
+                overlap[combination] = overlap.get(combination, 0) + length
+    # an episode of a combination starts where it is active and was not in the segment before
+    episodes = {}
+    for (previous, active), count in transitions.items():
+        previous = set(previous)
+        for k in range(2, min(max_k, len(active)) + 1):
+            for combination in combinations(active, k):
+                if not previous.issuperset(combination):
+                    episodes[combination] = episodes.get(combination, 0) + count
+
+    records = [{
+        'services': ', '.join(services[i] for i in combination),
+        'k': len(combination),
+        'overlap_minutes': overlap[combination],
+        'episodes': episodes.get(combination, 0),
+        'p_joint': overlap[combination] / window if window else np.nan,
+    } for combination in overlap]
+    columns = ['services', 'k', 'overlap_minutes', 'episodes', 'p_joint']
+    return pd.DataFrame(records, columns=columns).sort_values(['k', 'overlap_minutes'], ascending=[True, False],
+                                                              ignore_index=True)
+
+
+def get_cooccurrence(intervals, services=None, max_k=2):
+    """Pairwise overlap, episodes and conditional probabilities, plus the k-way combinations up to max_k."""
+    boundaries, activity, services = get_activity_matrix(intervals, services)
+    overlap, episodes, probability = get_pairwise_cooccurrence(boundaries, activity, services)
+    kway = get_kway_cooccurrence(boundaries, activity, services, max_k) if max_k > 2 else None
+    return {'overlap': overlap, 'episodes': episodes, 'probability': probability, 'combinations': kway}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Co-occurrence of failures across services.')
+    parser.add_argument('source', choices=['incident', 'outage'],
+                        help='Incident intervals (minute resolution) or outage days (day resolution).')
+    parser.add_argument('--path', default=None, help='incident_stages.csv or outage_unexploded.csv to load.')
+    parser.add_argument('-k', '--max-k', type=int, default=3, help='Largest combination of services to report.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    load_intervals = load_incident_intervals if args.source == 'incident' else load_outage_intervals
+    intervals = load_intervals(args.path) if args.path else load_intervals()
+
+    start = time.perf_counter()
+    result = get_cooccurrence(intervals, max_k=args.max_k)
+    elapsed = time.perf_counter() - start
+    unit = MINUTES_PER_DAY if args.source == 'outage' else 1
+    print(f'Overlap ({"days" if unit > 1 else "minutes"}):\n{result["overlap"] // unit}\n')
+    print(f'Overlapping episodes:\n{result["episodes"]}\n')
+    print(f'Conditional probability P(row | column) (%):\n{(result["probability"] * 100).round(2)}\n')
+    if result['combinations'] is not None:
+        print(f'Combinations:\n{result["combinations"]}\n')
+    print(f'{len(intervals)} intervals in {elapsed:.3f}s')
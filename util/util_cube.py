@@ -0,0 +1,288 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.util_incident import INCIDENT_SERVICE_COLUMNS, SERVICE_LABELS, TIMEZONE, DAY_NAMES, get_day_of_week, \
+    get_incident_services
+from util.util_status_page import PROVIDERS, get_provider_host
+from util.util_transform import get_uptime_provider
+
+
+CUBE_PATH = 'data/.cache/cube/cube.npz'
+
+# stored dimensions and measures of each fact, at the finest grain: one cell per provider or service, day (and hour)
+# and impact. An incident counts once in incident, and once per affected service in service_incident.
+FACTS = {
+    'incident': {'dimensions': ['provider', 'no_service', 'day', 'hour', 'impact'],
+                 'measures': ['count', 'duration_minutes']},
+    'service_incident': {'dimensions': ['service', 'day', 'hour', 'impact'], 'measures': ['count', 'duration_minutes']},
+    'outage': {'dimensions': ['service', 'day', 'impact'],
+               'measures': ['days', 'outage_days', 'partial_days', 'major_days', 'outage_minutes',
+                            'scaled_outage_minutes', 'incident_count']},
+}
+
+# dimensions a roll-up can group by, derived from the stored ones
+ROLLUP_DIMENSIONS = ['provider', 'service', 'no_service', 'day', 'week', 'month', 'year', 'day_of_week', 'hour',
+                     'impact']
+
+
+def to_days(dates):
+    """Days since the epoch of naive dates."""
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(np.int32)
+
+
+def aggregate_cells(dimensions, measures):
+    """Sum the measures of rows with the same dimension values, cells sorted by their dimensions."""
+    cells = pd.DataFrame({**dimensions, **measures}).groupby(list(dimensions), sort=True).sum().reset_index()
+    return {column: cells[column].to_numpy() for column in cells.columns}
+
+
+# provider of the incident_stages.csv provider column, named after the status page host, e.g. 'character'
+INCIDENT_PROVIDERS = {get_provider_host(provider).split('.')[1]: provider for provider in PROVIDERS}
+
+
+def get_incident_cells(df, timezone=TIMEZONE):
+    """
+    Incident cells: one count per incident, on the local day and hour of its start, with the minutes from start to
+    close as duration. Incidents that flag no service are kept, with no_service 1.
+    """
+    start = pd.to_datetime(df['start_timestamp'], utc=True)
+    close = pd.to_datetime(df['close_timestamp'], utc=True)
+    local = start.dt.tz_convert(timezone).dt.tz_localize(None)
+    dimensions = {
+        'provider': pd.Index(list(PROVIDERS)).get_indexer(df['provider'].map(INCIDENT_PROVIDERS)).astype(np.int8),
+        'no_service': (df[INCIDENT_SERVICE_COLUMNS].to_numpy() != 1).all(axis=1).astype(np.int8),
+        'day': to_days(local.dt.normalize()),
+        'hour': local.dt.hour.to_numpy().astype(np.int8),
+        'impact': df['incident_impact_level'].to_numpy().astype(np.int8),
+    }
+    measures = {
+        'count': np.ones(len(df), dtype=np.int32),
+        'duration_minutes': ((close - start).dt.total_seconds() / 60).to_numpy(),
+    }
+    return aggregate_cells(dimensions, measures)
+
+
+def get_service_incident_cells(df, services, timezone=TIMEZONE):
+    """
+    Service incident cells: one count per incident and affected service, on the local day and hour of its start, with
+    the minutes from start to close as duration. Incidents that flag no service are not in any cell.
+    """
+    incident_services = get_incident_services(df)
+    rows = incident_services['row'].to_numpy()
+    start = pd.to_datetime(df['start_timestamp'], utc=True).iloc[rows]
+    close = pd.to_datetime(df['close_timestamp'], utc=True).iloc[rows]
+    local = start.dt.tz_convert(timezone).dt.tz_localize(None)
+    dimensions = {
+        'service': pd.Index(services).get_indexer(incident_services['service']).astype(np.int16),
+        'day': to_days(local.dt.normalize()),
+        'hour': local.dt.hour.to_numpy().astype(np.int8),
+        'impact': df['incident_impact_level'].to_numpy()[rows].astype(np.int8),
+    }
+    measures = {
+        'count': np.ones(len(rows), dtype=np.int32),
+        'duration_minutes': ((close - start).dt.total_seconds() / 60).to_numpy(),
+    }
+    return aggregate_cells(dimensions, measures)
+
+
+def get_outage_cells(df, services):
+    """Outage cells: every calendar day of the uptime history, with the outage flags and minutes of the day."""
+    dimensions = {
+        'service': pd.Index(services).get_indexer(df['Service'].map(SERVICE_LABELS)).astype(np.int16),
+        'day': to_days(df['Date']),
+        'impact': df['outage_impact_level'].to_numpy().astype(np.int8),
+    }
+    measures = {
+        'days': np.ones(len(df), dtype=np.int32),
+        'outage_days': (df['outage_flag'] > 0).to_numpy().astype(np.int32),
+        'partial_days': df['partial_outage_flag'].to_numpy().astype(np.int32),
+        'major_days': df['major_outage_flag'].to_numpy().astype(np.int32),
+        'outage_minutes': df['total_outage_minutes'].to_numpy().astype(float),
+        'scaled_outage_minutes': df['scaled_total_outage_minutes'].to_numpy().astype(float),
+        'incident_count': df['incident_count'].to_numpy().astype(np.int32),
+    }
+    return aggregate_cells(dimensions, measures)
+
+
+class AggregateCube:
+    """
+    Incident and outage measures aggregated to the finest grain the figures and tables use, stored as one array per
+    dimension and measure of the non-empty cells. Roll-ups and slices sum the cells, which are a few thousand
+    instead of the rows of the clean data, and never reread the CSVs.
+    Incident counts by provider, calendar or in total come from the incident fact, which counts every incident once;
+    counts by service from the service_incident fact, where an incident counts once per affected service.
+    """
+
+    def __init__(self, services, cells, timezone=TIMEZONE):
+        self.services = np.asarray(services)
+        self.providers = np.array([get_uptime_provider(service) for service in self.get_raw_services()])
+        self.cells = cells
+        self.timezone = timezone
+
+    def get_raw_services(self):
+        raw_names = {label: service.lower() for service, label in SERVICE_LABELS.items()}
+        return [raw_names.get(service, service) for service in self.services]
+
+    def get_codes(self, fact, dimension):
+        """Integer code of each cell in a roll-up dimension, and a function from codes to labels."""
+        cells = self.cells[fact]
+        if dimension == 'provider' and 'provider' in cells:
+            return cells['provider'], lambda values: np.array(list(PROVIDERS))[values]
+        if dimension in ('provider', 'service') and 'service' not in cells:
+            raise ValueError(f"{fact} cells have no {dimension} dimension")
+        if dimension == 'provider':
+            codes, labels = pd.factorize(self.providers)
+            return codes[cells['service']], lambda values: labels[values]
+        if dimension == 'service':
+            return cells['service'], lambda values: self.services[values]
+        if dimension in ('hour', 'impact', 'no_service'):
+            if dimension not in cells:
+                raise ValueError(f"{fact} cells have no {dimension} dimension")
+            return cells[dimension], lambda values: values
+        day = cells['day']
+        if dimension == 'day':
+            return day, lambda values: values.astype('datetime64[D]')
+        if dimension == 'week':
+            # weeks start on Monday
+            return day - get_day_of_week(day), lambda values: values.astype('datetime64[D]')
+        if dimension == 'month':
+            return day.astype('datetime64[D]').astype('datetime64[M]').astype(np.int32), \
+                lambda values: values.astype('datetime64[M]')
+        if dimension == 'year':
+            return day.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int32) + 1970, lambda values: values
+        if dimension == 'day_of_week':
+            return get_day_of_week(day), lambda values: pd.Categorical(np.array(DAY_NAMES)[values], categories=DAY_NAMES,
+                                                                 ordered=True)
+        raise ValueError(f"Unknown dimension: {dimension}")
+
+    def get_mask(self, fact, where=None, start=None, end=None):
+        """Cells of the slice: where maps dimensions to a value or a list of values, start and end bound the day."""
+        cells = self.cells[fact]
+        mask = np.ones(len(cells['day']), dtype=bool)
+        for dimension, values in (where or {}).items():
+            codes, to_labels = self.get_codes(fact, dimension)
+            labels = np.asarray(to_labels(codes))
+            values = np.atleast_1d(values)
+            if dimension == 'service':
+                values = [SERVICE_LABELS.get(value, value) for value in values]
+            elif labels.dtype.kind == 'M':
+                values = values.astype(labels.dtype)
+            mask &= np.isin(labels, values)
+        if start is not None:
+            mask &= cells['day'] >= to_days([start])[0]
+        if end is not None:
+            mask &= cells['day'] <= to_days([end])[0]
+        return mask
+
+    def rollup(self, fact, by=(), where=None, start=None, end=None):
+        """
+        Measures of a fact summed by the dimensions in by, over the cells of the slice, e.g.
+        rollup('incident', ['provider', 'day_of_week'], where={'impact': [2, 3]}, start='2024-01-01'), or
+        rollup('incident', ['provider', 'day_of_week'], where={'no_service': 0}) for the incidents of some service,
+        as counted by the provider series of util_temporal.
+        Groups without any cell are not in the result, e.g. a weekday without incidents.
+        """
+        measures = FACTS[fact]['measures']
+        mask = self.get_mask(fact, where, start, end)
+        cells = self.cells[fact]
+        if not by:
+            return pd.DataFrame({measure: [cells[measure][mask].sum()] for measure in measures})
+
+        codes, to_labels = zip(*(self.get_codes(fact, dimension) for dimension in by))
+        codes = [np.asarray(code)[mask].astype(np.int64) for code in codes]
+        lows = [code.min() if len(code) else 0 for code in codes]
+        shape = [code.max() - low + 1 if len(code) else 1 for code, low in zip(codes, lows)]
+        flat = np.ravel_multi_index([code - low for code, low in zip(codes, lows)], shape)
+        groups, inverse = np.unique(flat, return_inverse=True)
+        group_codes = np.unravel_index(groups, shape)
+        result = {dimension: to_labels[i](group_codes[i] + lows[i]) for i, dimension in enumerate(by)}
+        for measure in measures:
+            values = cells[measure][mask]
+            sums = np.bincount(inverse, weights=values, minlength=len(groups))
+            result[measure] = sums.astype(values.dtype) if values.dtype.kind == 'i' else sums
+        return pd.DataFrame(result)
+
+    def save(self, path=CUBE_PATH):
+        """Plain npz arrays, loaded without pickle."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = {'services': self.services.astype(str), 'timezone': np.array(self.timezone)}
+        for fact, cells in self.cells.items():
+            arrays.update({f'{fact}/{column}': values for column, values in cells.items()})
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        print(f'writing cube to: {path}')
+        return path
+
+
+def build_cube(incident_path='data/clean/incident/2024-08-31/incident_stages.csv',
+               outage_path='data/clean/outage/2024-08-31/outage_unexploded.csv', timezone=TIMEZONE):
+    incidents = pd.read_csv(incident_path)
+    outages = pd.read_csv(outage_path)
+    # service labels in the order of the incident flag columns, then services only in the uptime calendar
+    labels = [SERVICE_LABELS[service] for service in INCIDENT_SERVICE_COLUMNS]
+    services = list(dict.fromkeys(labels + list(outages['Service'].map(SERVICE_LABELS))))
+    cells = {'incident': get_incident_cells(incidents, timezone),
+             'service_incident': get_service_incident_cells(incidents, services, timezone),
+             'outage': get_outage_cells(outages, services)}
+    return AggregateCube(services, cells, timezone)
+
+
+def load_cube(path=CUBE_PATH):
+    with np.load(path) as arrays:
+        cells = {fact: {} for fact in FACTS}
+        for name in arrays.files:
+            if '/' in name:
+                fact, column = name.split('/')
+                cells[fact][column] = arrays[name]
+        return AggregateCube(arrays['services'], cells, str(arrays['timezone']))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build the incident and outage aggregate cube, or roll it up.')
+    parser.add_argument('--path', default=CUBE_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Aggregate the clean data into the cube.')
+    build.add_argument('--incident-path', default='data/clean/incident/2024-08-31/incident_stages.csv')
+    build.add_argument('--outage-path', default='data/clean/outage/2024-08-31/outage_unexploded.csv')
+    build.add_argument('--timezone', default=TIMEZONE, help='Local time of the days and hours of the incidents.')
+
+    rollup = subparsers.add_parser('rollup', help='Sum the measures of a fact by some dimensions.')
+    rollup.add_argument('fact', choices=list(FACTS))
+    # no choices, argparse checks an empty list of dimensions against them and rejects the total roll-up
+    rollup.add_argument('by', nargs='*', help=f'Dimensions among {", ".join(ROLLUP_DIMENSIONS)}, none for the total.')
+    rollup.add_argument('-s', '--services', nargs='+', default=None, help='Service labels or raw names.')
+    rollup.add_argument('-p', '--providers', nargs='+', default=None)
+    rollup.add_argument('-i', '--impacts', nargs='+', type=int, default=None)
+    rollup.add_argument('-n', '--no-service', type=int, choices=[0, 1], default=None,
+                        help='Only incidents that flag no service (1), or some service (0).')
+    rollup.add_argument('--start', default=None, help='First day, YYYY-MM-DD.')
+    rollup.add_argument('--end', default=None, help='Last day, YYYY-MM-DD.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    start_time = time.perf_counter()
+    if args.command == 'build':
+        cube = build_cube(args.incident_path, args.outage_path, args.timezone)
+        cube.save(args.path)
+        print(', '.join(f'{fact}: {len(cells["day"])} cells' for fact, cells in cube.cells.items()) +
+              f' in {time.perf_counter() - start_time:.2f}s')
+    else:
+        cube = load_cube(args.path)
+        loaded = time.perf_counter()
+        where = {dimension: values for dimension, values in (('service', args.services), ('provider', args.providers),
+                                                             ('impact', args.impacts),
+                                                             ('no_service', args.no_service)) if values is not None}
+        result = cube.rollup(args.fact, args.by, where, args.start, args.end)
+        pd.set_option('display.width', 250)
+        pd.set_option('display.max_rows', 200)
+        print(result.to_string(index=False))
+        print(f'loaded in {(loaded - start_time) * 1000:.1f}ms, rolled up in {(time.perf_counter() - loaded) * 1000:.1f}ms')
@@ -1,25 +1,39 @@
 import os
 import pandas as pd
+import numpy as np
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from datetime import timedelta
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from util.util_timestamp import parse_timestamp_columns
+from util.util_unnest import flatten_records
 
-def read_data(base_dir):
-    df = pd.DataFrame()
+
+def read_data(base_dir, workers=None):
+    file_paths = []
     for root, dirs, files in os.walk(base_dir):
-        for file_name in files:
+        # walk in name order, os.walk lists entries in file system order, which differs across machines
+        dirs.sort()
+        for file_name in sorted(files):
             file_path = os.path.join(root, file_name)
             if file_path.endswith('.csv'):
                 print(f'loading: {file_path}')
-                df = pd.concat([df, pd.read_csv(file_path)])
-    return df
-
-
-def write_partitioned_data(df, data_layer, data_type, file_name):
-    partition = date.today().strftime('%Y-%m-%d')
+                file_paths.append(file_path)
+    # parse the files in parallel and concatenate once, in path order, so keep='first' deduplication is reproducible
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        dfs = list(executor.map(pd.read_csv, file_paths))
+    return pd.concat(dfs) if dfs else pd.DataFrame()
+
+
+def write_partitioned_data(df, data_layer, data_type, file_name, backend='csv', execution_date=None):
+    partition = execution_date or date.today().strftime('%Y-%m-%d')
+    if backend == 'parquet':
+        # typed columnar copy, partitioned by provider, see util/util_parquet.py
+        from util.util_parquet import write_parquet_dataset
+        return write_parquet_dataset(df, data_layer, data_type, os.path.splitext(file_name)[0], partition)
     archive_folder = f"data/{data_layer}/{data_type}/{partition}"
     os.makedirs(archive_folder, exist_ok=True)
     path = os.path.join(archive_folder, file_name)
@@ -28,6 +42,42 @@ def write_partitioned_data(df, data_layer, data_type, file_name):
     return path
 
 
+class ChunkedCSVWriter:
+    """
+    Append-only CSV writer for scraped records. Rows are buffered and appended to the file every chunk_size rows,
+    so memory stays flat and a crash loses at most one chunk. The header is written when the file is opened.
+    """
+
+    def __init__(self, path, columns, chunk_size=100):
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.row_count = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        pd.DataFrame(columns=columns).to_csv(path, index=False)
+
+    def write(self, record):
+        self.rows.append(record)
+        self.row_count += 1
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            pd.DataFrame(self.rows, columns=self.columns).to_csv(self.path, mode='a', header=False, index=False)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
 def get_incident_id(incident):
     if pd.isna(incident):
         return incident
@@ -41,15 +91,18 @@ def load_json_column(df, column):
 
 
 def unnest_lst_json(df, column):
-    df = df.explode(column).reset_index(drop=True)
-    df = df.join(pd.json_normalize(df[column]))
-    df.drop(columns=column, inplace=True)
-    return df
+    """One row per list item, the parent rows are taken by position instead of exploding the frame."""
+    records, parents = flatten_records(df[column], keep_empty=True)
+    df = df.drop(columns=column).iloc[parents].reset_index(drop=True)
+    return df.join(records)
 
 
 def unnest_dict(df, column, inplace=True):
-    df = df.join(pd.json_normalize(df[column]))
-    df.drop(columns=column, inplace=inplace)
+    records, _ = flatten_records(df[column], keep_empty=True)
+    records.index = df.index
+    df = df.join(records)
+    if inplace:
+        df = df.drop(columns=column)
     return df
 
 
@@ -57,8 +110,7 @@ def load_stg_incident(execution_date):
     incident = pd.read_csv(f'data/stg/incident/{execution_date}/incident_stages.csv')
     # incident timestamp columns: to datetime (PDT/PST )
     cols_inci_timestamp = [col for col in incident.columns if 'timestamp' in col]
-    incident[cols_inci_timestamp] = incident[cols_inci_timestamp].apply(
-        lambda x: pd.to_datetime(x).dt.tz_convert('America/Los_Angeles'))
+    incident = parse_timestamp_columns(incident, cols_inci_timestamp, 'America/Los_Angeles')
     incident['services'] = incident['services'].apply(lambda x: json.loads(x.replace("'", '"')))
     return incident
 
@@ -88,18 +140,52 @@ def generate_incident_dates(start, end):
     return [start_date + timedelta(days=x) for x in range(num_days)]
 
 
-def explode_incident_dates(df):
-    df['date'] = df.apply(lambda x: generate_incident_dates(x['start_timestamp'], x['close_timestamp']), axis=1)
-    df['date'] = df['date'].apply(pd.to_datetime)
-    df = df.explode('date')
-    return df
+def explode_incident_dates(df, overlap_minutes=False):
+    """
+    One row per incident and calendar day of [start_timestamp, close_timestamp], in the timezone of the timestamps.
+    Same rows as exploding generate_incident_dates() per incident, built with repeats and offsets over arrays.
+    With overlap_minutes, an 'overlap_minutes' column gives how many minutes of the day the incident covered.
+    """
+    start = pd.to_datetime(df['start_timestamp'])
+    close = pd.to_datetime(df['close_timestamp'])
+    tz = start.dt.tz
+    # calendar days are taken from the local wall time
+    start_day = (start.dt.tz_localize(None) if tz else start).dt.normalize().to_numpy()
+    close_day = (close.dt.tz_convert(tz).dt.tz_localize(None) if tz else close).dt.normalize().to_numpy()
+
+    num_days = (close_day - start_day) // np.timedelta64(1, 'D') + 1
+    positions = np.repeat(np.arange(len(df)), num_days)
+    day_offsets = np.arange(num_days.sum()) - np.repeat(np.cumsum(num_days) - num_days, num_days)
+    dates = start_day[positions] + day_offsets * np.timedelta64(1, 'D')
+
+    exploded = df.iloc[positions].copy()
+    exploded['date'] = dates
+    if overlap_minutes:
+        day_start = pd.DatetimeIndex(dates)
+        day_end = day_start + pd.Timedelta(days=1)
+        if tz:
+            # days around DST changes are 23 or 25 hours long
+            day_start = day_start.tz_localize(tz).tz_convert('UTC').tz_localize(None)
+            day_end = day_end.tz_localize(tz).tz_convert('UTC').tz_localize(None)
+            start = start.dt.tz_convert('UTC').dt.tz_localize(None)
+            close = close.dt.tz_convert('UTC').dt.tz_localize(None)
+        overlap = (np.minimum(close.to_numpy()[positions], day_end.to_numpy())
+                   - np.maximum(start.to_numpy()[positions], day_start.to_numpy()))
+        exploded['overlap_minutes'] = overlap / np.timedelta64(1, 'm')
+    return exploded
 
 
 def explode_incident_services(df):
-    df = df.explode('services')
-    df.rename(columns={'services': 'service'}, inplace=True)
-    df = df[df['service'].notna() & df['service'].ne('')]
-    return df
+    """
+    One row per incident and affected service. Only the services column is exploded, the other columns are
+    taken once with the row positions of the kept services.
+    """
+    services = df['services'].reset_index(drop=True).explode()
+    services = services[services.notna() & services.ne('')]
+    exploded = df.iloc[services.index.to_numpy()].copy()
+    exploded['services'] = services.to_numpy()
+    exploded.rename(columns={'services': 'service'}, inplace=True)
+    return exploded
 
 
 def print_incident_with_service_stats(incident):
@@ -0,0 +1,127 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.util_data import read_data, get_incident_id, write_partitioned_data
+
+
+# 'Posted 3 days ago. ' in front of every update timestamp changes between scrapes without any new content
+POSTED_AGO_PATTERN = r'Posted [^".]* ago\. '
+
+DEDUP_CONFIG = {
+    'incident': {'layer_type': 'incident', 'file_name': 'incident_snapshots.csv'},
+    'uptime': {'layer_type': 'outage', 'file_name': 'uptime_snapshots.csv'},
+}
+
+REPORT_COLUMNS = ['partition', 'rows', 'duplicates', 'added', 'replaced', 'unchanged', 'total']
+
+
+def get_snapshot_index(df, data_type):
+    """Key of each raw row: the incident id of the link, or the service and calendar day."""
+    if data_type == 'incident':
+        return pd.Index(df['Incident_Link'].apply(get_incident_id), name='incident_id')
+    # a few thousand distinct days, parse each of them once
+    codes, days = pd.factorize(df['Date'])
+    dates = pd.to_datetime(days, format='%d %b %Y').strftime('%Y-%m-%d').to_numpy()[codes]
+    return pd.MultiIndex.from_arrays([df['Service'], dates], names=['service', 'date'])
+
+
+def get_content_hash(df):
+    """
+    64 bit hash of each row's content, so snapshots are compared by one integer instead of the full row text.
+    The relative 'Posted ... ago.' prefix of the update timestamps is not part of the content.
+    """
+    content = df.copy()
+    if 'Updates' in content.columns:
+        content['Updates'] = content['Updates'].str.replace(POSTED_AGO_PATTERN, '', regex=True)
+    return pd.util.hash_pandas_object(content, index=False).to_numpy()
+
+
+def drop_duplicate_snapshots(df, data_type):
+    """
+    Keep one row per incident or service day of a partition, compared by key instead of by every column.
+    The first row is kept: the incremental incident scraper writes newly collected rows before the archived ones.
+    Rows come in the path order of read_data(), so the kept row does not depend on the file system.
+    """
+    return df[~get_snapshot_index(df, data_type).duplicated(keep='first')]
+
+
+def get_snapshots(df, data_type):
+    """Rows of a partition indexed by their key, one row per key, with their content hash."""
+    df = drop_duplicate_snapshots(df, data_type)
+    snapshots = df.assign(content_hash=get_content_hash(df))
+    snapshots.index = get_snapshot_index(df, data_type)
+    return snapshots
+
+
+def merge_snapshot(latest, df, data_type):
+    """Merge one partition into the latest snapshots, returns the merged snapshots and the row counts."""
+    snapshots = get_snapshots(df, data_type)
+    counts = {'rows': len(df), 'duplicates': len(df) - len(snapshots)}
+    if latest is None:
+        counts.update(added=len(snapshots), replaced=0, unchanged=0, total=len(snapshots))
+        return snapshots, counts
+
+    known = snapshots.index.isin(latest.index)
+    unchanged = np.zeros(len(snapshots), dtype=bool)
+    unchanged[known] = latest.loc[snapshots.index[known], 'content_hash'].to_numpy() == \
+        snapshots['content_hash'].to_numpy()[known]
+    replaced = known & ~unchanged
+    latest = pd.concat([latest.drop(index=snapshots.index[replaced]), snapshots[~unchanged]])
+    counts.update(added=int((~known).sum()), replaced=int(replaced.sum()), unchanged=int(unchanged.sum()),
+                  total=len(latest))
+    return latest, counts
+
+
+def get_partitions(raw_dir, data_type):
+    partition_dir = os.path.join(raw_dir, data_type)
+    return sorted(partition for partition in os.listdir(partition_dir)
+                  if os.path.isdir(os.path.join(partition_dir, partition)))
+
+
+def merge_latest_snapshots(data_type, raw_dir='data/raw', partitions=None):
+    """
+    Latest snapshot of every incident (or service day) across the scrape partitions, oldest first.
+    Only one partition is read at a time. A key seen before is replaced when its content hash changed.
+    Returns the snapshots, in the raw columns, and a report of the rows added, replaced and unchanged per partition.
+    """
+    latest = None
+    report = []
+    for partition in partitions or get_partitions(raw_dir, data_type):
+        df = read_data(os.path.join(raw_dir, data_type, partition))
+        latest, counts = merge_snapshot(latest, df, data_type)
+        report.append({'partition': partition, **counts})
+        print(f"{data_type} {partition}: {counts['rows']} rows, {counts['duplicates']} duplicates, "
+              f"{counts['added']} added, {counts['replaced']} replaced, {counts['unchanged']} unchanged")
+    if latest is None:
+        raise ValueError(f"No {data_type} partitions found in {raw_dir}")
+    latest = latest.reset_index(drop=True).drop(columns='content_hash')
+    return latest, pd.DataFrame(report, columns=REPORT_COLUMNS)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Merge the raw scrape partitions into the latest snapshot of each '
+                                                 'incident and service day.')
+    parser.add_argument('-T', '--data-types', nargs='+', choices=list(DEDUP_CONFIG), default=list(DEDUP_CONFIG))
+    parser.add_argument('--raw-dir', default='data/raw')
+    parser.add_argument('-p', '--partitions', nargs='+', default=None, help='Partitions to merge, default all.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    for data_type in args.data_types:
+        start_time = time.perf_counter()
+        latest, report = merge_latest_snapshots(data_type, args.raw_dir, args.partitions)
+        config = DEDUP_CONFIG[data_type]
+        # written next to the stg data of the newest partition
+        execution_date = report['partition'].iloc[-1]
+        write_partitioned_data(latest, 'stg', config['layer_type'], config['file_name'], execution_date=execution_date)
+        write_partitioned_data(report, 'stg', config['layer_type'], f'{data_type}_dedup_report.csv',
+                               execution_date=execution_date)
+        print(report.to_string(index=False))
+        print(f'{data_type}: {len(latest)} snapshots in {time.perf_counter() - start_time:.2f}s')
@@ -0,0 +1,316 @@
+import argparse
+import glob
+import io
+import os
+import time
+
+import pandas as pd
+
+from util.util_data import read_data, write_partitioned_data, impact_mapping_reverse
+from util.util_dedup import get_snapshots, get_partitions
+from util.util_transform import transform_incidents, transform_uptime
+
+
+EVENT_DIR = 'data/events'
+
+EVENT_CONFIG = {
+    'incident': {'layer_type': 'incident', 'file_name': 'incident_stages.csv', 'summary_name': 'incident_summary.csv',
+                 'group': 'provider'},
+    'uptime': {'layer_type': 'outage', 'file_name': 'outage_unexploded.csv', 'summary_name': 'outage_summary.csv',
+               'group': 'Service'},
+}
+
+# columns the log adds to the raw columns of each event
+KEY_COLUMN = 'event_key'
+HASH_COLUMN = 'content_hash'
+
+
+def get_event_keys(index):
+    """String key of each snapshot: the incident id, or 'service/YYYY-MM-DD' of an uptime day."""
+    if isinstance(index, pd.MultiIndex):
+        return index.get_level_values(0).astype(str) + '/' + index.get_level_values(1).astype(str)
+    return index.astype(str)
+
+
+def get_clean_keys(clean, data_type):
+    """The same keys from the clean rows, so derived rows can be replaced by the events they came from."""
+    if data_type == 'incident':
+        return pd.Index(clean['incident_id'].astype(str), name=KEY_COLUMN)
+    return pd.Index(clean['Service'] + '/' + pd.to_datetime(clean['Date']).dt.strftime('%Y-%m-%d'), name=KEY_COLUMN)
+
+
+def transform_events(events, data_type):
+    """Clean rows of a batch of events, indexed by event key. The transformations are row by row."""
+    raw = events.drop(columns=[KEY_COLUMN, HASH_COLUMN]).reset_index(drop=True)
+    clean = transform_incidents(raw) if data_type == 'incident' else transform_uptime(raw)
+    clean.index = get_clean_keys(clean, data_type)
+    return clean
+
+
+def get_incident_summary(df):
+    """Incident count, time range, impact levels and stage counts, as df_summary in the incident notebook."""
+    cols_timestamp = [col for col in df.columns if 'timestamp' in col]
+    timestamps = df[cols_timestamp].apply(lambda column: pd.to_datetime(column, utc=True))
+    impact_level_count = df['incident_impact_level'].value_counts().reindex(list(impact_mapping_reverse),
+                                                                           fill_value=0)
+    summary = {'Incident Count': df['incident_id'].nunique(), 'Start': timestamps.min().min(),
+               'End': timestamps.max().max()}
+    summary.update(impact_level_count.rename(index=impact_mapping_reverse).to_dict())
+    summary.update({col.split('_')[0]: df[col].sum() for col in df.columns if 'flag' in col})
+    return summary
+
+
+def get_outage_summary(df):
+    """Per service aggregates of the uptime days, as df_summary in the outage notebook."""
+    dates = pd.to_datetime(df['Date'])
+    return {
+        'start_date': dates.min(),
+        'end_date': dates.max(),
+        'sum_months': dates.dt.to_period('M').nunique(),
+        'sum_total_outages_counts': df['outage_flag'].sum(),
+        'sum_major_outages_counts': df['major_outage_flag'].sum(),
+        'sum_partial_outages_counts': df['partial_outage_flag'].sum(),
+        'sum_total_outages_minutes': df['total_outage_minutes'].sum(),
+        'sum_scaled_total_outages_minutes': df['scaled_total_outage_minutes'].sum(),
+        'sum_incident_counts': df['incident_count'].sum(),
+    }
+
+
+SUMMARY_FUNCTIONS = {'incident': get_incident_summary, 'uptime': get_outage_summary}
+
+
+def get_summary_table(summaries, clean, data_type):
+    """Summary rows of every group, in order of first appearance of the group in the clean rows."""
+    group = EVENT_CONFIG[data_type]['group']
+    groups = pd.unique(clean[group])
+    return pd.DataFrame([{group: name, **summaries[name]} for name in groups])
+
+
+class EventLog:
+    """
+    Append-only log of raw snapshots of one data type, in segment files data/events/{data_type}/log/NNNNNN_{partition}.csv.
+    A raw partition only appends the incidents or uptime days that are new or whose content hash changed, so the log
+    grows by the daily delta and not by the full scrape. The latest hash of every key is kept next to the segments
+    and can always be rebuilt from them.
+    """
+
+    def __init__(self, data_type, event_dir=EVENT_DIR):
+        self.data_type = data_type
+        self.log_dir = os.path.join(event_dir, data_type, 'log')
+        self.index_path = os.path.join(event_dir, data_type, 'log_index.pkl')
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.index = self.load_index()
+
+    def get_segments(self):
+        return sorted(glob.glob(os.path.join(self.log_dir, '*.csv')))
+
+    def load_index(self):
+        segments = self.get_segments()
+        index = pd.read_pickle(self.index_path) if os.path.exists(self.index_path) else None
+        if index is None or index['segments'] != len(segments):
+            # missing or stale after an interrupted append, the segments are the source of truth
+            hashes = pd.Series(dtype='uint64')
+            partitions = []
+            for path in segments:
+                segment = pd.read_csv(path, usecols=[KEY_COLUMN, HASH_COLUMN], dtype={KEY_COLUMN: str,
+                                                                                      HASH_COLUMN: 'uint64'})
+                hashes = pd.concat([hashes[~hashes.index.isin(segment[KEY_COLUMN])],
+                                    segment.set_index(KEY_COLUMN)[HASH_COLUMN]])
+                partitions.append(self.get_segment_partition(path))
+            index = {'segments': len(segments), 'hashes': hashes, 'partitions': partitions}
+        return index
+
+    @staticmethod
+    def get_segment_partition(path):
+        return os.path.splitext(os.path.basename(path))[0].split('_', 1)[1]
+
+    def save_index(self):
+        tmp_path = f'{self.index_path}.tmp'
+        pd.to_pickle(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+    def append_partition(self, partition_dir, partition):
+        """Append the new and changed snapshots of a raw partition as one segment, returns the number of events."""
+        df = read_data(partition_dir)
+        snapshots = get_snapshots(df, self.data_type)
+        keys = get_event_keys(snapshots.index)
+        hashes = self.index['hashes']
+        # compared as uint64, a reindex would turn the hashes of unknown keys into float NaN
+        changed = ~keys.isin(hashes.index)
+        changed[~changed] = hashes.loc[keys[~changed]].to_numpy() != snapshots[HASH_COLUMN].to_numpy()[~changed]
+
+        events = snapshots[changed].drop(columns=HASH_COLUMN)
+        events.insert(0, HASH_COLUMN, snapshots[HASH_COLUMN].to_numpy()[changed])
+        events.insert(0, KEY_COLUMN, keys[changed])
+        path = os.path.join(self.log_dir, f"{self.index['segments']:06d}_{partition}.csv")
+        tmp_path = f'{path}.tmp'
+        events.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+        new_hashes = pd.Series(events[HASH_COLUMN].to_numpy(), index=events[KEY_COLUMN].to_numpy(), dtype='uint64')
+        self.index = {'segments': self.index['segments'] + 1,
+                      'hashes': pd.concat([hashes[~hashes.index.isin(new_hashes.index)], new_hashes]),
+                      'partitions': self.index['partitions'] + [partition]}
+        self.save_index()
+        print(f'{self.data_type} {partition}: {len(df)} raw rows, {len(snapshots)} snapshots, {len(events)} events')
+        return len(events)
+
+    def read_segments(self, start=0):
+        """Events of the segments from position start on, in log order, or None when there are none."""
+        segments = [pd.read_csv(path, dtype={KEY_COLUMN: str, HASH_COLUMN: 'uint64'})
+                    for path in self.get_segments()[start:]]
+        # a partition without changes still appends its header-only segment, so that it is not appended again
+        segments = [segment for segment in segments if len(segment)]
+        if not segments:
+            return None
+        return pd.concat(segments, ignore_index=True)
+
+
+def get_event_order(events):
+    """Keys in order of their first event, the order of the clean rows."""
+    return pd.Index(pd.unique(events[KEY_COLUMN]), name=KEY_COLUMN)
+
+
+def build_full(log):
+    """Full rebuild: transform the latest snapshot of every key in the log at once."""
+    events = log.read_segments()
+    order = get_event_order(events)
+    latest = events.drop_duplicates(KEY_COLUMN, keep='last').set_index(KEY_COLUMN, drop=False).loc[order]
+    clean = transform_events(latest.reset_index(drop=True), log.data_type)
+    summarize = SUMMARY_FUNCTIONS[log.data_type]
+    group = EVENT_CONFIG[log.data_type]['group']
+    summaries = {name: summarize(rows) for name, rows in clean.groupby(group, sort=False)}
+    return {'segments': len(log.get_segments()), 'clean': clean, 'summaries': summaries}
+
+
+def apply_events(state, log):
+    """
+    Incremental recompute: transform only the events of the segments appended since the state was built, replace
+    their clean rows in place (new keys are added at the end) and recompute the summaries of the touched groups.
+    Returns the new state and the number of events applied.
+    """
+    events = log.read_segments(state['segments'])
+    if events is None:
+        return {**state, 'segments': len(log.get_segments())}, 0
+    latest = events.drop_duplicates(KEY_COLUMN, keep='last')
+    new = transform_events(latest.set_index(KEY_COLUMN, drop=False).loc[get_event_order(events)]
+                           .reset_index(drop=True), log.data_type)
+
+    clean = state['clean']
+    group = EVENT_CONFIG[log.data_type]['group']
+    touched = set(new[group]) | set(clean.loc[clean.index.isin(new.index), group])
+    order = clean.index.append(new.index[~new.index.isin(clean.index)])
+    clean = pd.concat([clean[~clean.index.isin(new.index)], new]).reindex(order)
+
+    summarize = SUMMARY_FUNCTIONS[log.data_type]
+    summaries = {name: rows for name, rows in state['summaries'].items() if name not in touched}
+    touched_rows = clean[clean[group].isin(touched)]
+    summaries.update({name: summarize(rows) for name, rows in touched_rows.groupby(group, sort=False)})
+    return {'segments': len(log.get_segments()), 'clean': clean, 'summaries': summaries}, len(latest)
+
+
+def get_state_path(data_type, event_dir=EVENT_DIR):
+    return os.path.join(event_dir, data_type, 'state.pkl')
+
+
+def load_state(data_type, event_dir=EVENT_DIR):
+    path = get_state_path(data_type, event_dir)
+    return pd.read_pickle(path) if os.path.exists(path) else None
+
+
+def save_state(state, data_type, event_dir=EVENT_DIR):
+    path = get_state_path(data_type, event_dir)
+    tmp_path = f'{path}.tmp'
+    pd.to_pickle(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def get_outputs(state, data_type, order=None):
+    """Clean table and summary table of a state, the clean rows in the key order given, if any."""
+    clean = order_like(state['clean'], order).reset_index(drop=True)
+    return clean, get_summary_table(state['summaries'], clean, data_type)
+
+
+def get_clean_order(data_type, layer_type, file_name):
+    """Keys of the latest clean file in the clean layer, or None when there is none yet."""
+    paths = sorted(glob.glob(os.path.join('data', 'clean', layer_type, '*', file_name)))
+    if not paths:
+        return None
+    return get_clean_keys(pd.read_csv(paths[-1]), data_type)
+
+
+def order_like(clean, order):
+    """Rows of the keys in order first, in that order, then the other rows in log order."""
+    if order is None:
+        return clean
+    order = order[order.isin(clean.index)]
+    return clean.loc[order.append(clean.index[~clean.index.isin(order)])]
+
+
+def to_csv_text(df):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+
+def verify_state(state, log):
+    """Compare the written tables of the incremental state with a full rebuild from the log."""
+    full = build_full(log)
+    for name, incremental, rebuilt in zip(['clean', 'summary'], get_outputs(state, log.data_type),
+                                          get_outputs(full, log.data_type)):
+        if to_csv_text(incremental) != to_csv_text(rebuilt):
+            raise ValueError(f'{log.data_type} {name}: incremental and full rebuild differ')
+    print(f'{log.data_type}: incremental state matches the full rebuild of {full["segments"]} segments')
+
+
+def update_event_log(data_type, raw_dir='data/raw', event_dir=EVENT_DIR, partitions=None, full=False, verify=False):
+    """Append the raw partitions not in the log yet, bring the clean tables up to date and write them."""
+    log = EventLog(data_type, event_dir)
+    for partition in partitions or get_partitions(raw_dir, data_type):
+        if partition not in log.index['partitions']:
+            log.append_partition(os.path.join(raw_dir, data_type, partition), partition)
+    if not log.index['partitions']:
+        raise ValueError(f"No {data_type} partitions found in {raw_dir}")
+
+    start_time = time.perf_counter()
+    state = None if full else load_state(data_type, event_dir)
+    if state is None:
+        state = build_full(log)
+        print(f'{data_type}: full rebuild of {len(state["clean"])} rows in {time.perf_counter() - start_time:.2f}s')
+    else:
+        state, count = apply_events(state, log)
+        print(f'{data_type}: {count} events applied in {time.perf_counter() - start_time:.2f}s')
+    save_state(state, data_type, event_dir)
+    if verify:
+        verify_state(state, log)
+
+    # rows keep the order of the clean file already written, so a run over unchanged data leaves it as it is
+    config = EVENT_CONFIG[data_type]
+    order = get_clean_order(data_type, config['layer_type'], config['file_name'])
+    clean, summary = get_outputs(state, data_type, order)
+    execution_date = log.index['partitions'][-1]
+    write_partitioned_data(clean, 'clean', config['layer_type'], config['file_name'], execution_date=execution_date)
+    # the summaries are not part of the clean layer, they are kept next to the log
+    summary_path = os.path.join(event_dir, data_type, config['summary_name'])
+    print(f'writing data to: {summary_path}')
+    summary.to_csv(summary_path, index=False)
+    return state
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Append raw partitions to the event log and recompute the clean '
+                                                 'tables of the incidents and days they touch.')
+    parser.add_argument('-T', '--data-types', nargs='+', choices=list(EVENT_CONFIG), default=list(EVENT_CONFIG))
+    parser.add_argument('--raw-dir', default='data/raw')
+    parser.add_argument('--event-dir', default=EVENT_DIR)
+    parser.add_argument('-p', '--partitions', nargs='+', default=None, help='Raw partitions to append, default all.')
+    parser.add_argument('--full', action='store_true', help='Rebuild the clean tables from the whole log.')
+    parser.add_argument('--verify', action='store_true', help='Check the tables against a full rebuild.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    for data_type in args.data_types:
+        update_event_log(data_type, args.raw_dir, args.event_dir, args.partitions, args.full, args.verify)
@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import html
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from aiohttp import web
+from dateutil.relativedelta import relativedelta
+
+from util.util_status_page import PROVIDERS, get_provider_host
+
+
+def get_fixture_path(root, host, path, query=''):
+    """
+    Map a status page request to its fixture file, e.g.
+    status.openai.com /history?page=2 -> {root}/status.openai.com/history@page=2.html
+    """
+    path = path.strip('/') or 'index'
+    if '..' in path.split('/'):
+        raise ValueError(f"Invalid fixture path: {path}")
+    if query:
+        path = f"{path}@{query}"
+    return os.path.join(root, host, f"{path}.html")
+
+
+def write_fixture(root, host, path, query, content):
+    fixture_path = get_fixture_path(root, host, path, query)
+    os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+    with open(fixture_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return fixture_path
+
+
+def make_app(root, latency=0):
+    """Stand-in status page server replaying fixtures from root, optionally delayed by latency seconds."""
+    app = web.Application()
+    app['stats'] = {'served': 0, 'not_found': 0}
+
+    async def replay(request):
+        if latency:
+            await asyncio.sleep(latency)
+        try:
+            fixture_path = get_fixture_path(root, request.match_info['host'], request.match_info['path'],
+                                            request.query_string)
+        except ValueError:
+            raise web.HTTPBadRequest()
+        if not os.path.isfile(fixture_path):
+            app['stats']['not_found'] += 1
+            raise web.HTTPNotFound()
+        app['stats']['served'] += 1
+        with open(fixture_path, encoding='utf-8') as f:
+            return web.Response(text=f.read(), content_type='text/html')
+
+    app.router.add_get('/{host}/{path:.*}', replay)
+    return app
+
+
+# Fixture rendering. Pages carry the markup the scrapers read, nothing more.
+
+def render_page(body):
+    return f"<!DOCTYPE html>\n<html>\n<body>\n{body}\n</body>\n</html>\n"
+
+
+def get_update_time_text(update):
+    # 'Posted 3 days ago. Aug 28, 2024 - 13:36 PDT' -> 'Aug 28, 2024 - 13:36 PDT'
+    return update['Update_Timestamp'].split('. ', 1)[-1]
+
+
+def render_history_page(months, page):
+    blocks = []
+    for month_start, incidents in months:
+        rows = []
+        for incident in incidents:
+            updates = json.loads(incident['Updates'])
+            history_timestamp = ''
+            if updates:
+                history_timestamp = f"{get_update_time_text(updates[-1])} - {get_update_time_text(updates[0])}"
+            style = f' style="color: {incident["Incident_color"]}"' if pd.notna(incident['Incident_color']) else ''
+            rows.append(
+                f'<div class="incident-container">'
+                f'<a class="{incident["Incident_Impact"]} incident-title font-large" '
+                f'href="/incidents/{incident["Incident_Link"].split("/")[-1]}"{style}>'
+                f'{html.escape(incident["Incident_Title"])}</a>'
+                f'<small class="secondary font-small">{html.escape(history_timestamp)}</small></div>'
+            )
+        if not rows:
+            rows.append('<small class="font-small">No incidents reported for this month.</small>')
+        blocks.append(
+            f'<div class="month">'
+            f'<h4 class="month-title font-large">{month_start.strftime("%B")} <var>{month_start.year}</var></h4>'
+            f'<div class="month-incidents">{"".join(rows)}</div></div>'
+        )
+    pagination = (f'<div class="pagination"><a href="/history?page={page + 1}"><i class="left-arrow"></i></a>'
+                  f'<a href="/history?page={max(page - 1, 1)}"><i class="right-arrow"></i></a></div>')
+    return render_page(f'<div class="months-container">{"".join(blocks)}</div>\n{pagination}')
+
+
+def render_incident_page(incident):
+    rows = []
+    for update in json.loads(incident['Updates']):
+        rows.append(
+            f'<div class="row update-row">'
+            f'<div class="update-title span3 font-large">{html.escape(update["Update_Title"])}</div>'
+            f'<div class="update-body span9"><span class="whitespace-pre-wrap">'
+            f'{html.escape(update["Update_Body"])}</span></div>'
+            f'<div class="update-timestamp font-small color-secondary">'
+            f'{html.escape(update["Update_Timestamp"])}</div></div>'
+        )
+    components = ''
+    if pd.notna(incident['Service']):
+        components = (f'<div class="components-affected font-small color-secondary border-color">'
+                      f'{html.escape(incident["Service"])}</div>')
+    return render_page(
+        f'<div class="incident-name {incident["Incident_Impact"]} font-largest">'
+        f'{html.escape(incident["Incident_Title"])}</div>\n'
+        f'<div class="incident-updates-container">{"".join(rows)}</div>\n{components}'
+    )
+
+
+def render_uptime_page(components, component, months):
+    props = {'components': components, 'component': component, 'months': months}
+    return render_page(
+        f'<div data-react-class="UptimeCalendar" data-react-props="{html.escape(json.dumps(props), quote=True)}">'
+        f'</div>'
+    )
+
+
+def get_component_id(service):
+    # stable stand-in for the status page component id
+    return hashlib.md5(service.encode()).hexdigest()[:12]
+
+
+def get_page_months(execution_date, page):
+    """First day of the three months shown on a page, oldest first. Page 1 ends with the execution month."""
+    end_month = execution_date.replace(day=1) - relativedelta(months=3 * (page - 1))
+    return [end_month - relativedelta(months=offset) for offset in (2, 1, 0)]
+
+
+def build_incident_fixtures(raw_dir, root, provider, execution_date):
+    host = get_provider_host(provider)
+    pages = {}
+    for file_path in sorted(glob.glob(os.path.join(raw_dir, provider, '*.csv'))):
+        # incident_history_{start}_{end}.csv, end is the most recent month of the page
+        end_month = datetime.strptime(os.path.basename(file_path)[:-4].split('_')[-1], '%Y%m').date()
+        delta = relativedelta(execution_date.replace(day=1), end_month)
+        page = (delta.years * 12 + delta.months) // 3 + 1
+        incidents = pd.read_csv(file_path).to_dict('records')
+        pages.setdefault(page, []).extend(incidents)
+        for incident in incidents:
+            write_fixture(root, host, f"incidents/{incident['Incident_Link'].split('/')[-1]}", '',
+                          render_incident_page(incident))
+
+    # the page after the last one has no incidents, which ends the pagination
+    for page in range(1, max(pages, default=0) + 2):
+        page_months = get_page_months(execution_date, page)
+        months = {month_start: [] for month_start in page_months}
+        for incident in pages.get(page, []):
+            updates = json.loads(incident['Updates'])
+            month_start = page_months[-1]
+            if updates:
+                created = datetime.strptime(get_update_time_text(updates[-1]).rsplit(' ', 1)[0], '%b %d, %Y - %H:%M')
+                month_start = min(max(created.date().replace(day=1), page_months[0]), page_months[-1])
+            months[month_start].append(incident)
+        write_fixture(root, host, 'history', f'page={page}',
+                      render_history_page(sorted(months.items(), reverse=True), page))
+    print(f'{provider}: {sum(len(incidents) for incidents in pages.values())} incident fixtures')
+
+
+def build_uptime_fixtures(raw_dir, root, provider, execution_date):
+    host = get_provider_host(provider)
+    services = [service for service in PROVIDERS[provider]['services']
+                if os.path.isfile(os.path.join(raw_dir, service, 'uptime_history.csv'))]
+    components = [{'id': get_component_id(service), 'name': service} for service in services]
+
+    for component in components:
+        uptime = pd.read_csv(os.path.join(raw_dir, component['name'], 'uptime_history.csv'))
+        days = {datetime.strptime(row['Date'], '%d %b %Y').date(): row for row in uptime.to_dict('records')}
+        page = 1
+        while True:
+            months = []
+            flag_no_data = False
+            for month_start in get_page_months(execution_date, page):
+                month_days = []
+                day = month_start
+                while day.month == month_start.month and day <= execution_date:
+                    if day in days:
+                        row = days[day]
+                        outages = {'m': 0, 'p': 0}
+                        for outage in json.loads(row['Outages']):
+                            outages['m' if outage['Outage_Type'] == 'Major outage' else 'p'] = \
+                                outage['Downtime (min)'] * 60
+                        related_events = [{'name': incident['Incident_Title'],
+                                           'code': incident['Incident_Link'].split('/')[-1]}
+                                          for incident in json.loads(row['Incidents'])]
+                        # like the live page state, the day carries no colour, the parser derives it
+                        month_days.append({'date': day.isoformat(), 'outages': outages,
+                                           'related_events': related_events})
+                    else:
+                        month_days.append({'date': day.isoformat(), 'no_data': True})
+                        flag_no_data = True
+                    day += timedelta(days=1)
+                months.append({'name': month_start.strftime('%B'), 'year': month_start.year, 'days': month_days})
+            content = render_uptime_page(components, component, months)
+            write_fixture(root, host, f"uptime/{component['id']}", f'page={page}', content)
+            if page == 1 and component is components[0]:
+                write_fixture(root, host, 'uptime', '', content)
+            if flag_no_data:
+                break
+            page += 1
+        print(f'{component["name"]}: {len(days)} uptime days in {page} fixture pages')
+
+
+def build_fixtures(raw_dir, root, execution_date):
+    """Render status page fixtures for every provider from the raw scrape partitions of execution_date."""
+    execution_date_str = execution_date.strftime('%Y-%m-%d')
+    for provider in PROVIDERS:
+        incident_dir = os.path.join(raw_dir, 'incident', execution_date_str)
+        if os.path.isdir(os.path.join(incident_dir, provider)):
+            build_incident_fixtures(incident_dir, root, provider, execution_date)
+        build_uptime_fixtures(os.path.join(raw_dir, 'uptime', execution_date_str), root, provider, execution_date)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build or serve status page fixtures for offline scraping.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Render fixtures from raw scrape partitions.')
+    build.add_argument('--raw-dir', default='data/raw')
+    build.add_argument('--execution-date', default='2024-08-31', help='Raw partition to render, YYYY-MM-DD.')
+    build.add_argument('--root', default='data/fixtures/status_page')
+
+    serve = subparsers.add_parser('serve', help='Replay fixtures over HTTP.')
+    serve.add_argument('--root', default='data/fixtures/status_page')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--latency', type=float, default=0.0, help='Delay per response in seconds.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    if args.command == 'build':
+        start = time.perf_counter()
+        build_fixtures(args.raw_dir, args.root, datetime.strptime(args.execution_date, '%Y-%m-%d').date())
+        print(f'Fixtures written to {args.root} in {time.perf_counter() - start:.1f}s')
+    else:
+        print(f'Serving fixtures from {args.root} on http://{args.host}:{args.port}/<status page host>/')
+        web.run_app(make_app(args.root, args.latency), host=args.host, port=args.port)
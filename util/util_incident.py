@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from util.util_transform import get_uptime_provider
+
+
+# service flag columns of incident_stages.csv
+INCIDENT_SERVICE_COLUMNS = ['Playground', 'API', 'Labs', 'ChatGPT', 'api.anthropic.com', 'claude.ai',
+                            'console.anthropic.com', 'Character.AI']
+
+# service names used in the figures and tables, for both the incident columns and the outage services
+SERVICE_LABELS = {
+    'API': 'API-OpenAI', 'api': 'API-OpenAI',
+    'ChatGPT': 'ChatGPT', 'chatgpt': 'ChatGPT',
+    'Labs': 'DALL·E', 'labs': 'DALL·E',
+    'Playground': 'Playground', 'playground': 'Playground',
+    'api.anthropic.com': 'API-Anthropic',
+    'claude.ai': 'Claude',
+    'console.anthropic.com': 'Console',
+    'Character.AI': 'Character.AI', 'character.ai': 'Character.AI',
+}
+
+# local time of the hour of day and day of week, as in sec5-temporal_analysis.ipynb
+TIMEZONE = 'US/Pacific'
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def get_day_of_week(days):
+    """Day of week of days since the epoch, from Monday 0 to Sunday 6. The epoch was a Thursday."""
+    return (days + 3) % 7
+
+
+def get_incident_services(df):
+    """
+    One row per incident and affected service of incident_stages.csv rows, from the service flag columns: the row
+    position of the incident, the flag column of the service, its label and its provider.
+    """
+    rows, columns = np.nonzero(df[INCIDENT_SERVICE_COLUMNS].to_numpy() == 1)
+    services = np.array(INCIDENT_SERVICE_COLUMNS)[columns]
+    return pd.DataFrame({
+        'row': rows,
+        'column': services,
+        'service': [SERVICE_LABELS[service] for service in services],
+        'provider': [get_uptime_provider(service.lower()) for service in services],
+    })
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from util.util_cooccurrence import MINUTES_PER_DAY, to_minutes
+from util.util_incident import SERVICE_LABELS, get_incident_services
+from util.util_pipeline import hash_file
+from util.util_status_page import PROVIDERS
+from util.util_transform import IMPACT_LEVELS, get_uptime_provider
+
+
+INDEX_PATH = 'data/.cache/interval_index/index.pkl'
+
+# clean file of each kind of interval, one per partition: data/clean/{layer_type}/{partition}/{file_name}
+INDEX_SOURCES = {
+    'incident': {'layer_type': 'incident', 'file_name': 'incident_stages.csv'},
+    'outage': {'layer_type': 'outage', 'file_name': 'outage_unexploded.csv'},
+}
+
+# impact names accepted by the queries, e.g. min_impact='major'
+IMPACT_NAMES = {level.replace('impact-', ''): value for level, value in IMPACT_LEVELS.items()}
+MAINTENANCE_LEVEL = IMPACT_LEVELS['impact-maintenance']
+
+RECORD_COLUMNS = ['kind', 'service', 'provider', 'start', 'end', 'impact', 'key']
+QUERY_MODES = ['overlap', 'within', 'at']
+
+
+def get_service_provider(service):
+    """Provider of a raw service name of either source, as named in PROVIDERS, e.g. 'Character.AI' -> 'characterai'."""
+    return get_uptime_provider(service.lower())
+
+
+def get_incident_records(df):
+    """
+    One closed [start_timestamp, close_timestamp] interval in minutes per incident and affected service.
+    Every incident of the partition is covered, so incidents that lost a service drop it on update.
+    """
+    services = get_incident_services(df)
+    rows = services['row'].to_numpy()
+    records = pd.DataFrame({
+        'service': services['service'].to_numpy(),
+        'provider': services['provider'].to_numpy(),
+        'start': to_minutes(df['start_timestamp'].iloc[rows]),
+        'end': to_minutes(df['close_timestamp'].iloc[rows]),
+        'impact': df['incident_impact_level'].to_numpy()[rows],
+        'key': df['incident_id'].to_numpy()[rows],
+    })
+    return records, df['incident_id'].unique()
+
+
+def get_outage_records(df):
+    """
+    One whole-day interval per service and outage day, keyed by service and day, like load_outage_intervals.
+    Every day of the partition is covered, outage or not, so a day that is no longer an outage is dropped on update.
+    """
+    dates = pd.to_datetime(df['Date'])
+    keys = df['Service'].map(SERVICE_LABELS) + '/' + dates.dt.strftime('%Y-%m-%d')
+    outage = (df['outage_flag'] > 0).to_numpy()
+    start = to_minutes(dates[outage])
+    records = pd.DataFrame({
+        'service': df['Service'][outage].map(SERVICE_LABELS).to_numpy(),
+        'provider': df['Service'][outage].map(get_service_provider).to_numpy(),
+        'start': start,
+        'end': start + MINUTES_PER_DAY - 1,
+        'impact': df['outage_impact_level'].to_numpy()[outage],
+        'key': keys.to_numpy()[outage],
+    })
+    return records, keys.unique()
+
+
+RECORD_LOADERS = {'incident': get_incident_records, 'outage': get_outage_records}
+
+
+def build_block(records):
+    """
+    Query arrays of one kind and service, sorted by start. max_end is the running maximum of the end minutes, so
+    the intervals ending before a minute t are exactly the ones before the first position with max_end >= t.
+    """
+    order = np.lexsort((records['end'].to_numpy(), records['start'].to_numpy()))
+    start = records['start'].to_numpy(dtype=np.int64)[order]
+    end = records['end'].to_numpy(dtype=np.int64)[order]
+    return {
+        'provider': records['provider'].iloc[0],
+        'start': start,
+        'end': end,
+        'max_end': np.maximum.accumulate(end),
+        'impact': records['impact'].to_numpy(dtype=np.int64)[order],
+        'key': records['key'].to_numpy(dtype=object)[order],
+        # timestamps as returned by the queries, formatted once here instead of per result
+        'start_text': format_minutes(start),
+        'end_text': format_minutes(end),
+    }
+
+
+def to_query_minute(timestamp):
+    """Minutes since the epoch of a timestamp, string or datetime, naive timestamps are taken as UTC."""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.value // 60_000_000_000
+
+
+def format_minutes(minutes):
+    return np.char.add(np.datetime_as_string(minutes.astype('datetime64[m]')), 'Z').astype(object)
+
+
+def get_impact_mask(impact, kind, min_impact):
+    """
+    Impact filter of a block. Incident levels 0-3 are ordered by severity, maintenance (4) is not a severity and
+    only matches min_impact='maintenance'. Outage levels 0-4 are all severities, from the scaled outage minutes.
+    """
+    if kind == 'incident' and min_impact < MAINTENANCE_LEVEL:
+        return (impact >= min_impact) & (impact != MAINTENANCE_LEVEL)
+    return impact >= min_impact
+
+
+class IntervalIndex:
+    """
+    Incident and outage intervals of the clean data, indexed per kind and service by sorted endpoint arrays.
+    Services are looked up through the provider index, so a query only bisects the blocks it asks for and filters the
+    few candidate intervals by impact. The index remembers the clean partitions it was built from, and update()
+    only reads partitions that are new or changed since.
+    """
+
+    def __init__(self):
+        self.blocks = {kind: {} for kind in INDEX_SOURCES}
+        self.providers = {kind: {} for kind in INDEX_SOURCES}
+        self.partitions = {}
+        self.file_hashes = {}
+
+    def upsert(self, kind, records, covered_keys):
+        """Replace every interval of the covered keys by the new records, rebuilding only the touched services."""
+        blocks = self.blocks[kind]
+        touched = set(records['service'])
+        kept = []
+        for service, block in blocks.items():
+            replaced = np.isin(block['key'], covered_keys)
+            if replaced.any():
+                touched.add(service)
+            if service in touched:
+                kept.append(pd.DataFrame({'service': service, 'provider': block['provider'],
+                                          **{column: block[column][~replaced] for column in RECORD_COLUMNS[3:]}}))
+        merged = pd.concat(kept + [records], ignore_index=True)
+        for service in touched:
+            service_records = merged[merged['service'] == service]
+            if len(service_records):
+                blocks[service] = build_block(service_records)
+            else:
+                blocks.pop(service, None)
+        self.providers[kind] = {}
+        for service, block in sorted(blocks.items()):
+            self.providers[kind].setdefault(block['provider'], []).append(service)
+        return sorted(touched)
+
+    def update(self, clean_dir='data/clean'):
+        """Index the clean partitions that are new or changed, oldest first. Returns the partitions indexed."""
+        indexed = []
+        for kind, source in INDEX_SOURCES.items():
+            pattern = os.path.join(clean_dir, source['layer_type'], '*', source['file_name'])
+            for path in sorted(glob.glob(pattern)):
+                file_hash = hash_file(path, self.file_hashes)
+                if self.partitions.get(path) == file_hash:
+                    continue
+                records, covered_keys = RECORD_LOADERS[kind](pd.read_csv(path))
+                services = self.upsert(kind, records, covered_keys)
+                self.partitions[path] = file_hash
+                indexed.append(path)
+                print(f'indexed {len(records)} {kind} intervals of {path}, services: {", ".join(services)}')
+        return indexed
+
+    def get_services(self, kind, services=None, providers=None):
+        """Indexed services of a kind, by label or raw name, restricted to the providers."""
+        selected = sorted(self.blocks[kind]) if services is None else \
+            [SERVICE_LABELS.get(service, service) for service in services]
+        if providers is not None:
+            provider_services = {service for provider in providers for service in self.providers[kind].get(provider, [])}
+            selected = [service for service in selected if service in provider_services]
+        return [service for service in selected if service in self.blocks[kind]]
+
+    def query(self, kind, start, end=None, mode='overlap', services=None, providers=None, min_impact=None):
+        """
+        Intervals of a kind ('incident' or 'outage') as JSON-ready dicts, by service and then by start.
+        Intervals are closed at minute resolution. mode 'overlap' finds the intervals sharing a minute with
+        [start, end], 'within' the ones inside [start, end] and 'at' the ones containing start.
+        """
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unknown query mode: {mode}")
+        first = to_query_minute(start)
+        last = first if mode == 'at' or end is None else to_query_minute(end)
+        if isinstance(min_impact, str):
+            min_impact = IMPACT_NAMES[min_impact]
+
+        results = []
+        for service in self.get_services(kind, services, providers):
+            block = self.blocks[kind][service]
+            if mode == 'within':
+                lo = np.searchsorted(block['start'], first, 'left')
+            else:
+                lo = np.searchsorted(block['max_end'], first, 'left')
+            hi = np.searchsorted(block['start'], last, 'right')
+            if lo >= hi:
+                continue
+            mask = block['end'][lo:hi] <= last if mode == 'within' else block['end'][lo:hi] >= first
+            if min_impact is not None:
+                mask &= get_impact_mask(block['impact'][lo:hi], kind, min_impact)
+            positions = np.flatnonzero(mask) + lo
+            results.extend({'kind': kind, 'service': service, 'provider': block['provider'], 'start': start_text,
+                            'end': end_text, 'impact': impact, 'key': key}
+                           for start_text, end_text, impact, key in zip(block['start_text'][positions],
+                                                                        block['end_text'][positions],
+                                                                        block['impact'][positions].tolist(),
+                                                                        block['key'][positions]))
+        return results
+
+    def query_frame(self, *args, **kwargs):
+        return pd.DataFrame(self.query(*args, **kwargs), columns=RECORD_COLUMNS)
+
+    def summary(self):
+        return {kind: {service: len(block['start']) for service, block in blocks.items()}
+                for kind, blocks in self.blocks.items()}
+
+    def save(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        pd.to_pickle(self, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def load_index(path=INDEX_PATH, clean_dir='data/clean'):
+    """Persisted index brought up to date with the clean partitions, saved again when a partition was added."""
+    index = pd.read_pickle(path) if os.path.exists(path) else IntervalIndex()
+    if index.update(clean_dir):
+        index.save(path)
+    return index
+
+
+def get_query_list(request, name):
+    values = [value for item in request.query.getall(name, []) for value in item.split(',') if value]
+    return values or None
+
+
+def make_app(index, path=INDEX_PATH, clean_dir='data/clean', refresh=0):
+    """
+    Local query API over the index, e.g.
+    GET /incident/overlap?start=2024-06-01&end=2024-06-08&service=claude.ai,api.anthropic.com&min_impact=major
+    GET /outage/at?time=2024-06-04T12:00&provider=anthropic
+    With refresh, the clean data is checked for new partitions every refresh seconds.
+    """
+    app = web.Application()
+    app['index'] = index
+
+    async def query(request):
+        kind = request.match_info['kind']
+        mode = request.match_info['mode']
+        if kind not in INDEX_SOURCES or mode not in QUERY_MODES:
+            raise web.HTTPNotFound()
+        params = request.query
+        try:
+            start = params['time'] if mode == 'at' else params['start']
+            results = app['index'].query(kind, start, params.get('end'), mode, get_query_list(request, 'service'),
+                                         get_query_list(request, 'provider'), params.get('min_impact'))
+        except (KeyError, ValueError) as e:
+            raise web.HTTPBadRequest(text=f'Invalid query: {e}')
+        return web.json_response({'count': len(results), 'results': results})
+
+    async def summary(request):
+        return web.json_response({'partitions': sorted(app['index'].partitions), **app['index'].summary()})
+
+    async def refresh_index(app):
+        while True:
+            await asyncio.sleep(refresh)
+            if app['index'].update(clean_dir):
+                app['index'].save(path)
+
+    async def start_refresh(app):
+        app['refresh'] = asyncio.create_task(refresh_index(app))
+
+    async def stop_refresh(app):
+        app['refresh'].cancel()
+
+    app.router.add_get('/', summary)
+    app.router.add_get('/{kind}/{mode}', query)
+    if refresh:
+        app.on_startup.append(start_refresh)
+        app.on_cleanup.append(stop_refresh)
+    return app
+
+
+def time_queries(index, n=1000):
+    """Mean query time in microseconds of a few typical queries, from n repetitions each."""
+    queries = {
+        'overlap week, 2 services, >= major': dict(kind='incident', start='2024-06-01', end='2024-06-08',
+                                                   services=['claude.ai', 'api.anthropic.com'], min_impact='major'),
+        'overlap year, all services': dict(kind='incident', start='2024-01-01', end='2024-12-31'),
+        'within month, openai': dict(kind='incident', start='2024-03-01', end='2024-04-01', mode='within',
+                                     providers=['openai']),
+        'outages at a minute': dict(kind='outage', start='2024-06-04T12:00', mode='at'),
+    }
+    timings = {}
+    for name, query in queries.items():
+        start = time.perf_counter()
+        for _ in range(n):
+            results = index.query(**query)
+        timings[name] = {'results': len(results), 'microseconds': (time.perf_counter() - start) / n * 1e6}
+    return pd.DataFrame(timings).T
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Interval index over the clean incidents and outages.')
+    parser.add_argument('--index-path', default=INDEX_PATH)
+    parser.add_argument('--clean-dir', default='data/clean')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('update', help='Index new or changed clean partitions.')
+
+    query = subparsers.add_parser('query', help='Query the index.')
+    query.add_argument('kind', choices=list(INDEX_SOURCES))
+    query.add_argument('start', help='Start of the range, or the point in time with --mode at.')
+    query.add_argument('end', nargs='?', default=None)
+    query.add_argument('-m', '--mode', choices=QUERY_MODES, default='overlap')
+    query.add_argument('-s', '--services', nargs='+', default=None, help='Service labels or raw names.')
+    query.add_argument('-p', '--providers', nargs='+', default=None, choices=list(PROVIDERS))
+    query.add_argument('--min-impact', choices=list(IMPACT_NAMES), default=None)
+
+    subparsers.add_parser('benchmark', help='Time typical queries.')
+
+    serve = subparsers.add_parser('serve', help='Answer queries over HTTP.')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8081)
+    serve.add_argument('--refresh', type=float, default=60.0, help='Seconds between checks for new partitions, '
+                                                                   '0 to disable.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    start_time = time.perf_counter()
+    index = load_index(args.index_path, args.clean_dir)
+    print(f'index of {len(index.partitions)} partitions loaded in {time.perf_counter() - start_time:.3f}s')
+
+    if args.command == 'update':
+        print(pd.DataFrame(index.summary()).fillna(0).astype(int))
+    elif args.command == 'query':
+        pd.set_option('display.width', 250)
+        results = index.query_frame(args.kind, args.start, args.end, args.mode, args.services, args.providers,
+                                    args.min_impact)
+        print(results.to_string(index=False))
+        print(f'{len(results)} intervals')
+    elif args.command == 'benchmark':
+        print(time_queries(index))
+    else:
+        print(f'Serving the interval index on http://{args.host}:{args.port}/<incident|outage>/<overlap|within|at>')
+        web.run_app(make_app(index, args.index_path, args.clean_dir, args.refresh), host=args.host, port=args.port)
@@ -0,0 +1,186 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import gmean
+
+from util.util_incident import SERVICE_LABELS
+from util.util_timestamp import parse_timestamp_columns
+
+
+# S1 = investigating, S2 = identified, S3 = monitoring, S4 = resolved, S5 = postmortem
+STAGES = ['investigating', 'identified', 'monitoring', 'resolved', 'postmortem']
+STAGE_BITS = {stage: 1 << i for i, stage in enumerate(STAGES)}
+TIMESTAMP_COLUMNS = [f'{stage}_timestamp' for stage in STAGES] + ['start_timestamp', 'close_timestamp']
+
+# service flag columns of incident_stages.csv, in the order of the figures and tables
+SERVICE_COLUMNS = ['API', 'ChatGPT', 'Labs', 'Playground', 'api.anthropic.com', 'claude.ai', 'console.anthropic.com',
+                   'Character.AI']
+
+PERIODS = ['P_investigate', 'P_repair', 'P_check', 'P_learn']
+DURATIONS = PERIODS + ['MTTR', 'MTBF']
+
+
+def load_incident_stages(path='data/clean/incident/2024-08-31/incident_stages.csv'):
+    return parse_timestamp_columns(pd.read_csv(path), TIMESTAMP_COLUMNS)
+
+
+def get_path_name(mask):
+    """Lifecycle path of a stage bitmask, e.g. 0b01101 -> 'S1_S3_S4'."""
+    return '_'.join(f'S{i + 1}' for i in range(len(STAGES)) if mask & (1 << i))
+
+
+def get_stage_mask(df):
+    """Bitmask of the stages an incident went through, STAGE_BITS[stage] is set when {stage}_flag is 1."""
+    mask = np.zeros(len(df), dtype=np.int64)
+    for stage, bit in STAGE_BITS.items():
+        mask |= (df[f'{stage}_flag'].to_numpy() == 1) * bit
+    return pd.Series(mask, index=df.index, name='stage_mask')
+
+
+def get_ordering_violations(df):
+    """
+    One boolean column per consecutive stage pair, True where the earlier stage was posted after the later one.
+    Stages that are missing are never violations.
+    """
+    violations = {}
+    for earlier, later in zip(STAGES[:-1], STAGES[1:]):
+        violations[f'{earlier}>{later}'] = (df[f'{earlier}_timestamp'] > df[f'{later}_timestamp']).to_numpy()
+    return pd.DataFrame(violations, index=df.index)
+
+
+def drop_ordering_violations(df):
+    """Drop the corner cases with stages out of order, print the violation count per stage pair."""
+    violations = get_ordering_violations(df)
+    print(violations.sum().to_dict())
+    return df[~violations.any(axis=1)].reset_index(drop=True)
+
+
+def get_service_incidents(df):
+    """One row per incident and affected service, with the service label in a 'service' column."""
+    flags = df[SERVICE_COLUMNS].to_numpy() == 1
+    rows, columns = np.nonzero(flags)
+    service_incidents = df.iloc[rows].reset_index(drop=True)
+    service_incidents.insert(0, 'service', [SERVICE_LABELS[SERVICE_COLUMNS[column]] for column in columns])
+    return service_incidents
+
+
+def count_paths(df):
+    """Number of incidents per lifecycle path, most frequent first, ties in order of first appearance."""
+    counts = get_stage_mask(df).value_counts(sort=False)
+    counts = counts.sort_values(ascending=False, kind='stable')
+    return pd.DataFrame({'case': counts.index.map(get_path_name), 'stage_mask': counts.index,
+                         'count': counts.to_numpy()})
+
+
+def get_path_table(df):
+    """Lifecycle path counts with one indicator column per stage and the percentage, plus a sum_all row."""
+    counts = count_paths(df)
+    total = counts['count'].sum()
+    table = pd.DataFrame({'case': counts['case']})
+    for stage, bit in STAGE_BITS.items():
+        table[stage] = (counts['stage_mask'] & bit > 0).astype(int)
+    table['count'] = counts['count']
+    table['percentage'] = (counts['count'] / total).map('{:.2%}'.format)
+    sum_all = pd.DataFrame({'case': ['sum_all'], **{stage: [0] for stage in STAGES}, 'count': [total],
+                            'percentage': ['100.00%']})
+    return pd.concat([table, sum_all], ignore_index=True)
+
+
+def get_service_path_table(df, percentage=True):
+    """
+    Service x lifecycle path counts in a single group-by, or the share of each path in the incidents of the
+    service. Paths are ordered by their count over all services.
+    """
+    service_incidents = get_service_incidents(df)
+    masks = get_stage_mask(service_incidents)
+    counts = masks.groupby([service_incidents['service'], masks]).size().unstack(fill_value=0)
+    counts = counts[counts.sum().sort_values(ascending=False, kind='stable').index]
+    counts.columns = counts.columns.map(get_path_name)
+    counts = counts.reindex([SERVICE_LABELS[column] for column in SERVICE_COLUMNS]).rename_axis(index='service',
+                                                                                                columns='case')
+    if percentage:
+        counts = counts.div(counts.sum(axis=1), axis=0).round(4)
+    return counts
+
+
+def add_stage_durations(df):
+    """Duration columns of each incident: P_investigate, P_repair, P_check, P_learn and MTTR."""
+    df = df.copy()
+    for period, (earlier, later) in zip(PERIODS, zip(STAGES[:-1], STAGES[1:])):
+        df[period] = df[f'{later}_timestamp'] - df[f'{earlier}_timestamp']
+    df['MTTR'] = df['resolved_timestamp'] - df[['investigating_timestamp', 'identified_timestamp',
+                                                'monitoring_timestamp']].min(axis=1)
+    return df
+
+
+def get_service_durations(df):
+    """
+    Stage durations, MTTR and MTBF of every service in one pass: one row per incident and affected service,
+    sorted by service and start time. MTBF is the time since the previous incident of the same service.
+    """
+    durations = add_stage_durations(get_service_incidents(df))
+    durations = durations.sort_values(['service', 'start_timestamp'], kind='stable', ignore_index=True)
+    durations['MTBF'] = durations.groupby('service', sort=False)['start_timestamp'].diff()
+    return durations
+
+
+def to_hours(durations):
+    return durations.apply(lambda column: column.dt.total_seconds() / 60 / 60)
+
+
+def get_duration_table(durations):
+    """
+    Mean durations per service in hours, P_learn and MTBF in days, with the arithmetic mean over all service
+    incidents and the geometric mean over the service incidents without missing values.
+    """
+    services = [SERVICE_LABELS[column] for column in SERVICE_COLUMNS]
+    hours = to_hours(durations[DURATIONS])
+    table = hours.groupby(durations['service']).mean().reindex(services)
+    table.loc['Arith. Mean'] = hours.mean()
+    complete = hours[durations.notna().all(axis=1)]
+    table.loc['Geom. Mean'] = gmean(complete, axis=0)
+    table[['P_learn', 'MTBF']] = table[['P_learn', 'MTBF']] / 24
+    return table.rename_axis('service').reset_index().round(2)
+
+
+def get_period_share_tables(durations):
+    """
+    Sum of each period per service in hours, its share of the total incident duration, and the share of the
+    first three periods in the MTTR.
+    """
+    services = [SERVICE_LABELS[column] for column in SERVICE_COLUMNS]
+    sums = to_hours(durations[PERIODS]).groupby(durations['service']).sum().reindex(services).rename_axis('service')
+    share = sums.div(sums.sum(axis=1), axis=0).round(4)
+    share_mttr = sums[PERIODS[:3]].div(sums[PERIODS[:3]].sum(axis=1), axis=0).round(4)
+    return sums.round(2), share, share_mttr
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Incident lifecycle paths, stage durations, MTTR and MTBF.')
+    parser.add_argument('--path', default='data/clean/incident/2024-08-31/incident_stages.csv')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    df = load_incident_stages(args.path)
+    start = time.perf_counter()
+    df = drop_ordering_violations(df)
+    path_table = get_path_table(df)
+    service_path_table = get_service_path_table(df)
+    durations = get_service_durations(df)
+    duration_table = get_duration_table(durations)
+    sums, share, share_mttr = get_period_share_tables(durations)
+    elapsed = time.perf_counter() - start
+
+    pd.set_option('display.width', 200)
+    print(f'Incident status count:\n{path_table}\n')
+    print(f'Incident status count by service (%):\n{service_path_table * 100}\n')
+    print(f'Mean duration by service [hours, P_learn and MTBF in days]:\n{duration_table}\n')
+    print(f'Sum of each period by service [hours]:\n{sums}\n')
+    print(f'Share of each period in the incident duration:\n{share}\n')
+    print(f'Share of each period in the MTTR:\n{share_mttr}\n')
+    print(f'{len(df)} incidents in {elapsed:.3f}s')
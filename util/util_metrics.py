@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# upper bounds of the duration histograms, in seconds. 1, 5 and 10 are the fixed sleep and the WebDriverWait timeouts
+# of the scrapers, so waits that run into a timeout land in their own bucket.
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def get_label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels, extra=None):
+    labels = list(labels) + list(extra or [])
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + '}'
+
+
+def format_bucket(bound):
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+class ScrapeMetrics:
+    """
+    Counters and duration histograms of one scraper run, shared by its pages and worker threads.
+    Metrics have a name and labels, e.g. scraper_wait_seconds{wait="tooltip"}. At the end of a run they are written
+    as JSON, or as a Prometheus textfile when the path ends with .prom.
+    """
+
+    def __init__(self, scraper, buckets=DURATION_BUCKETS, progress_interval=10):
+        self.scraper = scraper
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.progress_interval = progress_interval
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.last_progress = self.start
+
+    def inc(self, name, value=1, **labels):
+        key = (name, get_label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, get_label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'max': 0.0}
+            # counts per bucket, made cumulative when exported
+            histogram['counts'][next(i for i, bound in enumerate(self.buckets) if seconds <= bound)] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def wait(self, wait, until):
+        """
+        Time a blocking wait, e.g. lambda: WebDriverWait(driver, 5).until(...), and count the waits that raised,
+        which for WebDriverWait means they ran into the timeout.
+        """
+        try:
+            with self.timer('scraper_wait_seconds', wait=wait):
+                return until()
+        except Exception:
+            self.inc('scraper_wait_timeouts_total', wait=wait)
+            raise
+
+    def sleep(self, seconds, step):
+        with self.timer('scraper_sleep_seconds', step=step):
+            time.sleep(seconds)
+
+    def get_count(self, name):
+        return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def get_total_seconds(self, name):
+        return sum(histogram['sum'] for (key, _), histogram in self.histograms.items() if key == name)
+
+    def get_observation_count(self, name):
+        return sum(sum(histogram['counts']) for (key, _), histogram in self.histograms.items() if key == name)
+
+    def report_progress(self, force=False):
+        """One line summary of the run so far, at most every progress_interval seconds unless forced."""
+        now = time.perf_counter()
+        if not force and now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        elapsed = now - self.start
+        with self.lock:
+            pages = self.get_observation_count('scraper_page_seconds')
+            items = self.get_observation_count('scraper_incident_seconds') + self.get_count('scraper_days_total') + \
+                self.get_count('scraper_no_data_days_total')
+            waits = self.get_total_seconds('scraper_wait_seconds')
+            sleeps = self.get_total_seconds('scraper_sleep_seconds')
+            retries = self.get_count('scraper_retries_total')
+            timeouts = self.get_count('scraper_wait_timeouts_total')
+        item_name = 'incidents' if self.scraper == 'incident' else 'days'
+        print(f"[{self.scraper} {elapsed:.0f}s] {pages} pages, {items} {item_name} "
+              f"({items / elapsed if elapsed else 0:.2f}/s), waiting {waits:.1f}s ({timeouts} timeouts), "
+              f"sleeping {sleeps:.1f}s, {retries} retries")
+
+    def to_dict(self):
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                count = sum(histogram['counts'])
+                histograms.append({
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': count,
+                    'sum': round(histogram['sum'], 6),
+                    'mean': round(histogram['sum'] / count, 6) if count else None,
+                    'max': round(histogram['max'], 6),
+                    'buckets': {format_bucket(bound): count
+                                for bound, count in zip(self.buckets, histogram['counts'])}
+                })
+        return {
+            'scraper': self.scraper,
+            'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed_seconds': round(time.perf_counter() - self.start, 3),
+            'counters': counters,
+            'histograms': histograms
+        }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format, e.g. for the node_exporter textfile collector."""
+        scraper = [('scraper', self.scraper)]
+        lines = []
+        typed = set()
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{name}{format_labels(scraper + list(labels))} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(scraper + list(labels), [('le', format_bucket(bound))])}"
+                                 f" {cumulative}")
+                lines.append(f'{name}_sum{format_labels(scraper + list(labels))} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{format_labels(scraper + list(labels))} {cumulative}')
+        lines.append('# TYPE scraper_run_seconds gauge')
+        lines.append(f'scraper_run_seconds{format_labels(scraper)} {time.perf_counter() - self.start:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to path, JSON or a Prometheus textfile (.prom), replacing the file atomically."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        print(f'writing metrics to: {path}')
+        return path
@@ -0,0 +1,214 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from util.util_status_page import PROVIDERS
+
+
+PARQUET_ROOT = 'data/parquet'
+DATA_LAYERS = ['raw', 'stg', 'clean']
+
+# low-cardinality text columns, stored dictionary encoded
+CATEGORY_COLUMNS = ['provider', 'Service', 'service', 'Incident_Impact', 'Incident_color', 'Outage_Color']
+# column used for date range filters, first one present in the dataset
+DATE_COLUMNS = ['Date', 'date', 'start_timestamp']
+SERVICE_COLUMNS = ['Service', 'service']
+
+PARTITIONING = ds.partitioning(pa.schema([('execution_date', pa.string()), ('provider', pa.string())]),
+                               flavor='hive')
+
+PROVIDER_BY_SERVICE = {service: provider for provider, config in PROVIDERS.items() for service in config['services']}
+
+
+def get_dataset_path(data_layer, data_type, name, root=PARQUET_ROOT):
+    return os.path.join(root, data_layer, data_type, name)
+
+
+def get_date_column(columns):
+    return next((column for column in DATE_COLUMNS if column in columns), None)
+
+
+def cast_types(df):
+    """Parse the text columns of a scraped or transformed dataset into timestamp, timedelta and categorical types."""
+    df = df.copy()
+    for column in df.columns:
+        if column.endswith('timestamp'):
+            df[column] = pd.to_datetime(df[column], utc=True)
+        elif column in ('Date', 'date'):
+            df[column] = pd.to_datetime(df[column])
+        elif column == 'time_span':
+            df[column] = pd.to_timedelta(df[column])
+        elif column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def write_parquet_dataset(df, data_layer, data_type, name, execution_date=None, root=PARQUET_ROOT,
+                          row_group_size=4096):
+    """
+    Write a dataset partition to {root}/{layer}/{type}/{name}/execution_date={date}/provider={provider}/.
+    Rows are sorted by the date column, so the row group statistics let date range filters skip row groups.
+    An existing partition of the same execution date is replaced.
+    """
+    if 'provider' not in df.columns:
+        raise ValueError(f"{name}: a provider column is required to partition the dataset.")
+    execution_date = execution_date or date.today().strftime('%Y-%m-%d')
+    df = cast_types(df)
+    date_column = get_date_column(df.columns)
+    column_order = json.dumps(list(df.columns))
+
+    partition_path = os.path.join(get_dataset_path(data_layer, data_type, name, root),
+                                  f'execution_date={execution_date}')
+    shutil.rmtree(partition_path, ignore_errors=True)
+    for provider, provider_df in df.groupby('provider', observed=True):
+        if date_column is not None:
+            provider_df = provider_df.sort_values(date_column, kind='stable')
+        table = pa.Table.from_pandas(provider_df.drop(columns='provider'), preserve_index=False)
+        table = table.replace_schema_metadata({**table.schema.metadata, b'column_order': column_order})
+        provider_path = os.path.join(partition_path, f'provider={provider}')
+        os.makedirs(provider_path, exist_ok=True)
+        pq.write_table(table, os.path.join(provider_path, 'part-0.parquet'), row_group_size=row_group_size)
+    print(f'writing data to: {partition_path}')
+    return partition_path
+
+
+def get_service_filter(schema, services):
+    service_column = next((column for column in SERVICE_COLUMNS if column in schema.names), None)
+    if service_column is not None:
+        return ds.field(service_column).isin(services)
+    # cleaned incidents flag each affected service in its own column, e.g. API, ChatGPT, claude.ai
+    service_flags = [column for column in schema.names if column.lower() in {s.lower() for s in services}]
+    if not service_flags:
+        raise ValueError(f"No service column found for services: {services}")
+    expression = ds.field(service_flags[0]) == 1
+    for column in service_flags[1:]:
+        expression = expression | (ds.field(column) == 1)
+    return expression
+
+
+def get_date_filter(schema, start, end):
+    date_column = get_date_column(schema.names)
+    if date_column is None:
+        raise ValueError("No date column found for a date range filter.")
+    date_type = schema.field(date_column).type
+    expression = None
+    for bound, compare in ((start, lambda field, value: field >= value), (end, lambda field, value: field <= value)):
+        if bound is None:
+            continue
+        bound = pd.Timestamp(bound)
+        if getattr(date_type, 'tz', None) and bound.tz is None:
+            bound = bound.tz_localize('UTC')
+        condition = compare(ds.field(date_column), pa.scalar(bound, type=date_type))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_parquet_dataset(data_layer, data_type, name, execution_date=None, providers=None, services=None,
+                         start=None, end=None, columns=None, root=PARQUET_ROOT):
+    """
+    Load a Parquet dataset written by write_parquet_dataset(), on all cores.
+    Provider and execution date filters prune partitions, service and date range filters (inclusive) are pushed
+    down to the row groups, so only matching data is read.
+    """
+    dataset = ds.dataset(get_dataset_path(data_layer, data_type, name, root), format='parquet',
+                         partitioning=PARTITIONING)
+    conditions = []
+    if execution_date is not None:
+        conditions.append(ds.field('execution_date') == execution_date)
+    if providers is not None:
+        conditions.append(ds.field('provider').isin(providers))
+    if services is not None:
+        conditions.append(get_service_filter(dataset.schema, services))
+    if start is not None or end is not None:
+        conditions.append(get_date_filter(dataset.schema, start, end))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    df = dataset.to_table(columns=columns, filter=expression, use_threads=True).to_pandas()
+    if 'provider' in df.columns:
+        df['provider'] = df['provider'].astype('category')
+    metadata = dataset.schema.metadata or {}
+    if columns is None and b'column_order' in metadata:
+        column_order = [column for column in json.loads(metadata[b'column_order']) if column in df.columns]
+        df = df[column_order + [column for column in df.columns if column not in column_order]]
+    return df
+
+
+def read_raw_partition(data_type_dir, data_type):
+    """Raw data is scraped into one folder per provider (incidents) or per service (uptime)."""
+    dfs = []
+    for folder in sorted(os.listdir(data_type_dir)):
+        csv_files = sorted(glob.glob(os.path.join(data_type_dir, folder, '*.csv')))
+        if not csv_files:
+            continue
+        df = pd.concat([pd.read_csv(file_path) for file_path in csv_files], ignore_index=True)
+        df['provider'] = folder if folder in PROVIDERS else PROVIDER_BY_SERVICE.get(folder, folder)
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True) if dfs else None
+
+
+def convert_data_tree(data_dir='data', root=PARQUET_ROOT):
+    """Convert the CSV partitions data/{layer}/{type}/{date}/ into Parquet datasets under root."""
+    for data_layer in DATA_LAYERS:
+        for partition_dir in sorted(glob.glob(os.path.join(data_dir, data_layer, '*', '*'))):
+            if not os.path.isdir(partition_dir):
+                continue
+            data_type, execution_date = partition_dir.split(os.sep)[-2:]
+            if data_layer == 'raw':
+                df = read_raw_partition(partition_dir, data_type)
+                if df is not None:
+                    write_parquet_dataset(df, data_layer, data_type, f'{data_type}_history', execution_date, root)
+                continue
+            for file_path in sorted(glob.glob(os.path.join(partition_dir, '*.csv'))):
+                df = pd.read_csv(file_path)
+                if 'provider' not in df.columns:
+                    print(f'skipping {file_path}: no provider column')
+                    continue
+                name = os.path.splitext(os.path.basename(file_path))[0]
+                write_parquet_dataset(df, data_layer, data_type, name, execution_date, root)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Convert the CSV data tree to Parquet, or load a Parquet dataset.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help='Convert every CSV partition of the data tree.')
+    convert.add_argument('--data-dir', default='data')
+    convert.add_argument('--root', default=PARQUET_ROOT)
+
+    load = subparsers.add_parser('load', help='Load a dataset with filters and print a summary.')
+    load.add_argument('data_layer', choices=DATA_LAYERS)
+    load.add_argument('data_type', help='e.g. incident, outage, uptime')
+    load.add_argument('name', help='e.g. incident_stages, outage_unexploded, uptime_history')
+    load.add_argument('--execution-date', default=None)
+    load.add_argument('-P', '--providers', nargs='+', default=None)
+    load.add_argument('-S', '--services', nargs='+', default=None)
+    load.add_argument('--start', default=None, help='First date to include, e.g. 2024-01-01.')
+    load.add_argument('--end', default=None, help='Last date to include, e.g. 2024-06-30.')
+    load.add_argument('--root', default=PARQUET_ROOT)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    start_time = time.perf_counter()
+    if args.command == 'convert':
+        convert_data_tree(args.data_dir, args.root)
+        print(f'Converted {args.data_dir} to {args.root} in {time.perf_counter() - start_time:.1f}s')
+    else:
+        df = read_parquet_dataset(args.data_layer, args.data_type, args.name, args.execution_date, args.providers,
+                                  args.services, args.start, args.end, root=args.root)
+        print(df.dtypes)
+        print(df)
+        print(f'Loaded {len(df)} rows in {time.perf_counter() - start_time:.3f}s')
@@ -0,0 +1,348 @@
+import argparse
+import ast
+import functools
+import glob
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+import util.util_availability as util_availability
+import util.util_data as util_data
+import util.util_dedup as util_dedup
+import util.util_lifecycle as util_lifecycle
+import util.util_timestamp as util_timestamp
+import util.util_transform as util_transform
+from util.util_data import read_data, write_partitioned_data
+
+
+CACHE_DIR = 'data/.cache/pipeline'
+TABLE_DIR = 'plot/table'
+
+# modules whose source is part of the cache key of the stages using them, with the util modules they import
+TRANSFORM_CODE = [util_data, util_dedup, util_timestamp, util_transform]
+TABLE_CODE = [util_lifecycle, util_availability]
+
+
+class Stage:
+    """
+    A pipeline step: func(*upstream results, **params) returns a picklable result, e.g. a DataFrame, cached by a hash
+    of the stage's input files, upstream outputs, params and code. Stages may also publish files (outputs).
+    """
+
+    def __init__(self, name, func, inputs=(), upstream=(), params=None, code=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.upstream = list(upstream)
+        self.params = params or {}
+        self.code = list(code)
+        self.outputs = list(outputs)
+
+
+def load_json_file(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json_file(path, data):
+    # write to a temporary file first, an interrupted run must not leave a truncated manifest behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def hash_file(path, file_hashes):
+    """Content hash of a file, rehashed only when its size or modification time changed since the last run."""
+    stat = os.stat(path)
+    known = file_hashes.get(path)
+    if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    file_hashes[path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+    return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_module_source(name):
+    """Source of a util module by name, read from its file, so optional modules are not imported to hash them."""
+    with open(importlib.util.find_spec(name).origin) as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=None)
+def get_util_imports(source):
+    """Names a module source imports from util modules, mapped to the module they come from."""
+    imports = {}
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.ImportFrom) and node.module and node.module.startswith('util.'):
+            imports.update({alias.asname or alias.name: node.module for alias in node.names})
+        elif isinstance(node, ast.Import):
+            imports.update({alias.asname or alias.name: alias.name for alias in node.names
+                            if alias.name.startswith('util.')})
+    return imports
+
+
+def get_code_names(code):
+    """Global names a code object and the functions nested in it refer to."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= get_code_names(const)
+    return names
+
+
+def get_code_name(source):
+    if isinstance(source, str):
+        return source
+    if inspect.ismodule(source):
+        return source.__name__
+    return f'{source.__module__}.{source.__qualname__}'
+
+
+def get_referenced_code(source):
+    """
+    util code a module or function uses directly, modules by name. A module uses every util module it imports from,
+    also inside functions. A function uses the modules of the util names it refers to, and the functions and classes
+    of its own module.
+    """
+    if isinstance(source, str) or inspect.ismodule(source):
+        return sorted(set(get_util_imports(get_module_source(get_code_name(source))).values()))
+    module = inspect.getmodule(source)
+    imports = get_util_imports(inspect.getsource(module))
+    referenced = []
+    for name in sorted(get_code_names(source.__code__)):
+        value = vars(module).get(name)
+        if name in imports:
+            referenced.append(imports[name])
+        elif (inspect.isfunction(value) or inspect.isclass(value)) and value.__module__ == module.__name__:
+            referenced.append(value)
+    return referenced
+
+
+def get_stage_code(stage):
+    """
+    The stage function and its code list, then the util code they use, transitively, so that editing a module a
+    stage only reaches through imports (e.g. util_unnest through util_data) also changes the stage key.
+    """
+    explicit = [stage.func] + stage.code
+    names = {get_code_name(source) for source in explicit}
+    extra = []
+    todo = list(explicit)
+    while todo:
+        for source in get_referenced_code(todo.pop()):
+            if get_code_name(source) not in names:
+                names.add(get_code_name(source))
+                extra.append(source)
+                todo.append(source)
+    return explicit + sorted(extra, key=get_code_name)
+
+
+def get_source(source):
+    return get_module_source(source) if isinstance(source, str) else inspect.getsource(source)
+
+
+def get_stage_key(stage, upstream_hashes, file_hashes):
+    sha = hashlib.sha256()
+    sha.update(stage.name.encode())
+    sha.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+    for source in get_stage_code(stage):
+        sha.update(get_source(source).encode())
+    for path in stage.inputs:
+        sha.update(f'{path}:{hash_file(path, file_hashes)}'.encode())
+    for name in stage.upstream:
+        sha.update(f'{name}:{upstream_hashes[name]}'.encode())
+    return sha.hexdigest()
+
+
+def get_cache_path(stage, key, cache_dir):
+    return os.path.join(cache_dir, f"{stage.name.replace('/', '-')}-{key[:16]}.pkl")
+
+
+def run_stage(func, params, upstream_paths, cache_path):
+    """
+    Run one stage in a worker process and cache its result. Returns the hash of the cached result and the run time
+    in the worker, which leaves out the time the stage waited for a free worker.
+    """
+    start = time.perf_counter()
+    inputs = [pd.read_pickle(path) for path in upstream_paths]
+    result = func(*inputs, **params)
+    tmp_path = f'{cache_path}.tmp'
+    pd.to_pickle(result, tmp_path)
+    os.replace(tmp_path, cache_path)
+    with open(cache_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest(), time.perf_counter() - start
+
+
+def run_pipeline(stages, cache_dir=CACHE_DIR, workers=None, force=False):
+    """
+    Run the stages in dependency order, independent stages in parallel processes.
+    A stage is skipped when its key (input files, upstream outputs, params and code) matches the last run and its
+    cached result and published files still exist. A rebuilt stage with an unchanged result does not invalidate
+    the stages downstream of it.
+    Returns the run time in seconds of every built stage, and None for the cached ones.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    manifest = load_json_file(manifest_path, {})
+    file_hashes = load_json_file(os.path.join(cache_dir, 'file_hashes.json'), {})
+    stages = {stage.name: stage for stage in stages}
+    unknown = {name for stage in stages.values() for name in stage.upstream} - set(stages)
+    if unknown:
+        raise ValueError(f"Unknown upstream stages: {', '.join(sorted(unknown))}")
+    output_hashes = {}
+    pending = dict(stages)
+    running = {}
+    run_times = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [stage for stage in pending.values() if all(name in output_hashes for name in stage.upstream)]
+            for stage in ready:
+                del pending[stage.name]
+                key = get_stage_key(stage, output_hashes, file_hashes)
+                cache_path = get_cache_path(stage, key, cache_dir)
+                entry = manifest.get(stage.name, {})
+                if not force and entry.get('key') == key and os.path.exists(cache_path) and \
+                        all(os.path.exists(path) for path in stage.outputs):
+                    output_hashes[stage.name] = entry['output_hash']
+                    run_times[stage.name] = None
+                    print(f'{stage.name}: cached')
+                    continue
+                upstream_paths = [manifest[name]['cache_path'] for name in stage.upstream]
+                future = executor.submit(run_stage, stage.func, stage.params, upstream_paths, cache_path)
+                running[future] = (stage, key, cache_path)
+            if not running:
+                if not ready:
+                    raise ValueError(f"Dependency cycle between stages: {', '.join(sorted(pending))}")
+                # everything ready was cached, look for the stages they unblocked
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key, cache_path = running.pop(future)
+                output_hashes[stage.name], run_times[stage.name] = future.result()
+                previous = manifest.get(stage.name, {}).get('cache_path')
+                if previous and previous != cache_path and os.path.exists(previous):
+                    os.remove(previous)
+                manifest[stage.name] = {'key': key, 'output_hash': output_hashes[stage.name],
+                                        'cache_path': cache_path}
+                save_json_file(manifest_path, manifest)
+                print(f'{stage.name}: built in {run_times[stage.name]:.2f}s')
+
+    save_json_file(os.path.join(cache_dir, 'file_hashes.json'), file_hashes)
+    return run_times
+
+
+def load_stage_result(name, cache_dir=CACHE_DIR):
+    """Cached result of a stage of the last run, e.g. the typed clean incidents without reparsing the CSV."""
+    manifest = load_json_file(os.path.join(cache_dir, 'manifest.json'), {})
+    return pd.read_pickle(manifest[name]['cache_path'])
+
+
+def transform_raw_folder(raw_dir, data_type):
+    df = read_data(raw_dir)
+    return util_transform.transform_incidents(df) if data_type == 'incident' else util_transform.transform_uptime(df)
+
+
+def publish_clean_data(*parts, data_type, file_name, execution_date):
+    df = pd.concat(parts, ignore_index=True)
+    write_partitioned_data(df, 'clean', data_type, file_name, execution_date=execution_date)
+    return df
+
+
+def get_incident_tables(incidents):
+    # computed in one stage, the tables share the corner case filtering and the service durations
+    incidents = util_lifecycle.drop_ordering_violations(incidents)
+    durations = util_lifecycle.get_service_durations(incidents)
+    return {
+        'table-incident-status-count.csv': util_lifecycle.get_path_table(incidents).drop(columns='case'),
+        'table-incident-status-count-by-service.csv': util_lifecycle.get_service_path_table(incidents).reset_index(),
+        'table-mean-duration-of-model-parameters-by-service.csv': util_lifecycle.get_duration_table(durations),
+    }
+
+
+def get_outage_tables(outages):
+    outage_minutes, services, _ = util_availability.get_day_matrix(outages)
+    availability = util_availability.get_daily_availability(outage_minutes)
+    table = util_availability.get_availability_table(availability, services).round(2)
+    table[table.columns[1:]] = table[table.columns[1:]].astype(str) + '%'
+    return {'table-service_availability.csv': table}
+
+
+def write_table(tables, table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    print(f'writing table to: {path}')
+    table = tables[table]
+    table.to_csv(path, index=False)
+    return table
+
+
+def get_stages(execution_date, raw_dir='data/raw', table_dir=TABLE_DIR):
+    """raw -> clean per provider (incidents) and per service (uptime) in parallel, then the paper tables."""
+    stages = []
+    for data_type, raw_type, file_name in (('incident', 'incident', 'incident_stages.csv'),
+                                           ('outage', 'uptime', 'outage_unexploded.csv')):
+        partition_dir = os.path.join(raw_dir, raw_type, execution_date)
+        folders = sorted(folder for folder in os.listdir(partition_dir)
+                         if os.path.isdir(os.path.join(partition_dir, folder)))
+        for folder in folders:
+            folder_dir = os.path.join(partition_dir, folder)
+            stages.append(Stage(f'{raw_type}/{folder}', transform_raw_folder,
+                                inputs=sorted(glob.glob(os.path.join(folder_dir, '*.csv'))),
+                                params={'raw_dir': folder_dir, 'data_type': raw_type}, code=TRANSFORM_CODE))
+        stages.append(Stage(f'clean/{data_type}', publish_clean_data,
+                            upstream=[f'{raw_type}/{folder}' for folder in folders],
+                            params={'data_type': data_type, 'file_name': file_name,
+                                    'execution_date': execution_date},
+                            outputs=[os.path.join('data', 'clean', data_type, execution_date, file_name)]))
+
+    for data_type, func, table_names in (
+            ('incident', get_incident_tables, ['table-incident-status-count.csv',
+                                               'table-incident-status-count-by-service.csv',
+                                               'table-mean-duration-of-model-parameters-by-service.csv']),
+            ('outage', get_outage_tables, ['table-service_availability.csv'])):
+        stages.append(Stage(f'tables/{data_type}', func, upstream=[f'clean/{data_type}'], code=TABLE_CODE))
+        for table in table_names:
+            path = os.path.join(table_dir, execution_date, table)
+            stages.append(Stage(f'table/{table}', write_table, upstream=[f'tables/{data_type}'],
+                                params={'table': table, 'path': path}, outputs=[path]))
+    return stages
+
+
+def get_latest_execution_date(raw_dir='data/raw'):
+    return max(os.path.basename(path) for path in glob.glob(os.path.join(raw_dir, 'incident', '*')))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Incremental rebuild from the raw scrape to the paper tables.')
+    parser.add_argument('-D', '--execution-date', default=None, help='Raw partition to build, default the latest.')
+    parser.add_argument('-W', '--workers', type=int, default=None, help='Parallel processes, default all cores.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--table-dir', default=TABLE_DIR)
+    parser.add_argument('--force', action='store_true', help='Rebuild every stage.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    execution_date = args.execution_date or get_latest_execution_date()
+    start_time = time.perf_counter()
+    run_times = run_pipeline(get_stages(execution_date, table_dir=args.table_dir), args.cache_dir, args.workers,
+                             args.force)
+    built = [name for name, seconds in run_times.items() if seconds is not None]
+    print(f'{execution_date}: {len(built)} stages built, {len(run_times) - len(built)} cached, '
+          f'in {time.perf_counter() - start_time:.1f}s')
@@ -0,0 +1,593 @@
+import argparse
+import fnmatch
+import os
+import shutil
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.colors import BoundaryNorm, ListedColormap
+from matplotlib.ticker import PercentFormatter
+
+import util.plotting as plotting
+import util.util_availability as util_availability
+import util.util_incident as util_incident
+import util.util_lifecycle as util_lifecycle
+import util.util_temporal as util_temporal
+from util.util_pipeline import Stage, run_pipeline, get_incident_tables, get_outage_tables, write_table, TABLE_CODE
+
+
+PLOT_DIR = 'plot'
+CACHE_DIR = 'data/.cache/render'
+INCIDENT_PATH = 'data/clean/incident/2024-08-31/incident_stages.csv'
+OUTAGE_PATH = 'data/clean/outage/2024-08-31/outage_unexploded.csv'
+# monthly ChatGPT website visits of sec1, from similarweb
+VISITS_PATH = 'data/website_visits_chatgpt.csv'
+
+SERVICES = [util_lifecycle.SERVICE_LABELS[column] for column in util_lifecycle.SERVICE_COLUMNS]
+# services of each provider in the order of the stacked bars, with the palette of the provider
+PROVIDER_SERVICES = {
+    'OpenAI': (['API-OpenAI', 'ChatGPT', 'DALL·E', 'Playground'], 'Blues'),
+    'Anthropic': (['API-Anthropic', 'Claude', 'Console'], 'Oranges'),
+    'Character.AI': (['Character.AI'], 'Greens'),
+}
+SERVICE_PROVIDERS = {service: provider for provider, (services, _) in PROVIDER_SERVICES.items() for service in services}
+# incident flag columns and short labels of the impacted service combinations of sec6
+COMBINATION_SERVICES = {
+    'openai': {'API': 'O1', 'ChatGPT': 'O2', 'Labs': 'O3', 'Playground': 'O4'},
+    'anthropic': {'api.anthropic.com': 'A1', 'claude.ai': 'A2', 'console.anthropic.com': 'A3'},
+}
+ACF_FREQUENCIES = ['month', 'week', 'day']
+SCRAPE_END = '2024-08-31 23:59'
+
+# dashed reference lines of the duration figures, in hours (MTTR) or days (MTBF)
+REFERENCE_LINES = {
+    'MTTR': [(10 / 60, '10m'), (0.5, '0.5h'), (3, '3h'), (10, '10h'), (24, '24h')],
+    'MTBF': [(1, '1d'), (7, '7d'), (30, '30d')],
+}
+# reference lines of the titled 10x6 duration figures, labelled at the top or the bottom of the axes
+TITLED_REFERENCE_LINES = {
+    'MTTR': {'top': [], 'bottom': [(10 / 60, '10 mins'), (0.5, '30 mins'), (1, '1 hour'), (3, '3 hours'),
+                                   (10, '10 hours'), (24, '1 day')]},
+    'MTBF': {'top': [(0.5, '0.5 day'), (1, '1 day'), (3, '3 days')], 'bottom': [(7, '1 week'), (30, '1 month')]},
+}
+DURATION_UNITS = {'MTTR': 'hours', 'MTBF': 'days'}
+
+
+def get_usetex():
+    """LaTeX text rendering, as in the notebooks, when a LaTeX installation is available."""
+    return shutil.which('latex') is not None
+
+
+def set_figure_font(preset, usetex, height_multiplier=1.0):
+    """
+    Apply a util.plotting preset. Without LaTeX the text is drawn by matplotlib (mathtext) in the same bold sizes,
+    which also renders much faster than a LaTeX run per text element.
+    """
+    getattr(plotting, f'set_{preset}_figure_font')(height_multiplier=height_multiplier)
+    if not usetex:
+        plt.rcParams['text.usetex'] = False
+        plt.rcParams['text.latex.preamble'] = ''
+        plt.rcParams['font.family'] = 'serif'
+        plt.rcParams['axes.titleweight'] = 'bold'
+
+
+def escape(text):
+    return text.replace('%', r'\%') if plt.rcParams['text.usetex'] else text
+
+
+def bold(text):
+    """Bold label, \\textbf under LaTeX, the bold font weight of the preset otherwise."""
+    return rf'\textbf{{{escape(text)}}}' if plt.rcParams['text.usetex'] else text
+
+
+def save_figure(fig, path, **kwargs):
+    """Save the figure as PDF for the paper and PNG for the README, then free it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    paths = [f'{path}.pdf', f'{path}.png']
+    for figure_path in paths:
+        fig.savefig(figure_path, **kwargs)
+    plt.close(fig)
+    return paths
+
+
+def add_reference_lines(ax, lines, y, fontsize, va='top', linewidth=1.5, ha='center', rotation=0):
+    for x, label in lines:
+        ax.axvline(x=x, color='black', linestyle='--', linewidth=linewidth)
+        ax.text(x, y, bold(label), color='black', fontsize=fontsize, ha=ha, va=va, rotation=rotation,
+                transform=ax.get_xaxis_transform())
+
+
+def to_units(durations, metric):
+    hours = durations[metric].dt.total_seconds() / 60 / 60
+    return hours / 24 if DURATION_UNITS[metric] == 'days' else hours
+
+
+def get_provider_durations(durations):
+    """MTTR and MTBF per provider: each incident once per provider, MTBF since the previous incident of the provider."""
+    df = durations.assign(provider=durations['service'].map(SERVICE_PROVIDERS))
+    df = df.drop_duplicates(['incident_id', 'provider']).sort_values(['provider', 'start_timestamp'], kind='stable')
+    df['MTBF'] = df.groupby('provider', sort=False)['start_timestamp'].diff()
+    return df
+
+
+def get_status_shares(incidents):
+    """Share of each lifecycle path in the incidents of every service, paths through S5 summed as All-with-S5."""
+    shares = util_lifecycle.get_service_path_table(incidents)
+    with_s5 = [case for case in shares.columns if case.endswith('S5')]
+    return shares.drop(columns=with_s5).assign(**{'All-with-S5': shares[with_s5].sum(axis=1)})
+
+
+def get_short_service_names():
+    """O_1 to C_1, the short names of the services in the order of PROVIDER_SERVICES."""
+    return [f'{provider[0]}_{i + 1}' for provider, (services, _) in PROVIDER_SERVICES.items()
+            for i in range(len(services))]
+
+
+def get_monthly_visits(outages, incidents, path=VISITS_PATH):
+    """
+    Monthly ChatGPT website visits, oldest first, with the ChatGPT outage days and incidents of the months that had
+    any. Incident months are taken from the UTC start, as in sec1-chatgpt_website_visits.ipynb.
+    """
+    visits = pd.read_csv(path)[::-1].reset_index(drop=True)
+    outages = outages[(outages['Service'] == 'chatgpt') & (outages['outage_flag'] >= 1)]
+    incidents = incidents[incidents['ChatGPT'] == 1]
+    return {
+        'visits': visits,
+        'outages': outages.groupby(outages['Date'].dt.strftime('%Y-%m')).size(),
+        'incidents': incidents.groupby(incidents['start_timestamp'].dt.strftime('%Y-%m')).size(),
+    }
+
+
+def get_acf_series(starts, end=SCRAPE_END):
+    """Autocorrelation and confidence band of every series at the resolutions of the sec5 figures."""
+    return {freq: {key: value for key, value in util_temporal.analyze_series(starts, freq, end=end).items()
+                   if key in ('acf', 'confidence')} for freq in ACF_FREQUENCIES}
+
+
+def get_outage_cooccurrence(outages):
+    """
+    Days on which both services of a pair had an outage, and the share of the outage days of the column service
+    with an outage of the row service, in percent. Also the share of the observed days of each service with an outage.
+    """
+    outage_flags, services, _ = util_availability.get_day_matrix(outages, column='outage_flag')
+    observed = ~np.isnan(outage_flags)
+    flags = (np.where(observed, outage_flags, 0) > 0).astype(np.int64)
+    count = flags @ flags.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probability = count / np.diag(count)[None, :] * 100
+    return {
+        'count': pd.DataFrame(count, index=services, columns=services),
+        'probability': pd.DataFrame(probability, index=services, columns=services),
+        'days_percent': pd.Series(flags.sum(axis=1) / observed.sum(axis=1) * 100, index=services),
+    }
+
+
+def get_cooccurrence_tables(cooccurrence):
+    """The sec6 tables, percentages with the LaTeX escape of the paper."""
+    def to_percent(values):
+        return values.round(2).astype(str) + r'\%'
+    return {
+        'table-outage_probability.csv': cooccurrence['probability'].apply(to_percent),
+        'table-outage_days_percent.csv': to_percent(cooccurrence['days_percent']).to_frame().T,
+    }
+
+
+def plot_provider_ecdf(durations, metric, path, usetex, titled=False):
+    """
+    ECDF of the MTTR or MTBF of every provider. The titled variant is the 10x6 figure with a title and the reference
+    lines labelled in words along the lines.
+    """
+    set_figure_font('half_column', usetex)
+    durations = get_provider_durations(durations)
+    fig, ax = plt.subplots(figsize=(10, 6) if titled else (10, 7))
+    colors = sns.color_palette('tab10' if titled else 'bright', n_colors=len(PROVIDER_SERVICES))
+    for provider, color, marker in zip(PROVIDER_SERVICES, colors, ['^', 'o', 's']):
+        values = to_units(durations[durations['provider'] == provider], metric).dropna()
+        sns.ecdfplot(x=values.to_numpy(), label=bold(provider), ax=ax, color=color, marker=marker, linestyle='-',
+                     linewidth=2)
+    if titled:
+        lines = TITLED_REFERENCE_LINES[metric]
+        add_reference_lines(ax, lines['top'], 0.98, 22, va='top', linewidth=1, ha='left', rotation=90)
+        add_reference_lines(ax, lines['bottom'], 0.02, 22, va='bottom', linewidth=1, ha='left', rotation=90)
+        ax.set_title(bold(f'{metric} grouped by provider [{DURATION_UNITS[metric]}]'), fontsize=28)
+    else:
+        add_reference_lines(ax, REFERENCE_LINES[metric], 1.08, 30)
+    ax.set_xlabel(bold(f'{metric} [{DURATION_UNITS[metric]}]'), fontsize=28)
+    ax.set_xscale('log')
+    ax.set_ylabel(bold('ECDF'), fontsize=28)
+    ax.legend(title=bold('Provider'), loc='upper left', fontsize=26 if titled else 30,
+              title_fontsize=28 if titled else None)
+    ax.tick_params(axis='both', labelsize=26 if titled else 32)
+    ax.grid(which='both', linestyle='--', linewidth=0.5)
+    fig.tight_layout()
+    return save_figure(fig, path)
+
+
+def plot_service_boxes(durations, metric, path, usetex):
+    set_figure_font('half_column', usetex)
+    values = to_units(durations, metric)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.boxplot(x=values, y=durations['service'], order=SERVICES, orient='h', ax=ax, color='white',
+                linecolor='black', flierprops=dict(marker='D', markersize=3))
+    medians = values.groupby(durations['service']).median()
+    for i, service in enumerate(SERVICES):
+        ax.text(medians[service], i, f'{medians[service]:.2f}', color='black', va='center', ha='center', fontsize=20)
+    ax.set_xscale('log')
+    for x, label in REFERENCE_LINES[metric]:
+        ax.axvline(x=x, color='black', linestyle='--', linewidth=1)
+        ax.text(x, -1, bold(label), color='black', fontsize=18, ha='center', va='top')
+    ax.set_yticks(range(len(SERVICES)))
+    ax.set_yticklabels([bold(service) for service in SERVICES], fontsize=20)
+    ax.set_ylabel('')
+    ax.set_xlabel(bold(f'{metric} [{DURATION_UNITS[metric]}]'))
+    ax.grid(axis='both', linestyle='--', alpha=0.6, which='both')
+    fig.tight_layout()
+    return save_figure(fig, path)
+
+
+def plot_status_shares(incidents, path, usetex):
+    """Share of each lifecycle path in the incidents of every service, paths through S5 stacked as one."""
+    set_figure_font('half_column', usetex)
+    shares = get_status_shares(incidents)
+    fig, ax = plt.subplots(figsize=(16, 10))
+    bottom = np.zeros(len(shares))
+    colors = sns.color_palette('tab10', n_colors=len(shares.columns))
+    for case, color in zip(shares.columns, colors):
+        ax.bar(range(len(shares)), shares[case], bottom=bottom, label=bold(case.replace('_', '-')), color=color,
+               width=0.85)
+        for i, value in enumerate(shares[case]):
+            if value > 0:
+                ax.text(i, bottom[i] + value / 2, escape(f'{value:.2%}'), ha='center', va='center', color='white',
+                        fontsize=26)
+        bottom += shares[case].to_numpy()
+    handles, labels = ax.get_legend_handles_labels()
+    ax.legend(handles[::-1], labels[::-1], title=bold('Status Cases'), bbox_to_anchor=(1.01, 1.0), loc='upper left')
+    ax.set_xlabel(bold('Service'), fontsize=30)
+    ax.yaxis.set_major_formatter(PercentFormatter(1, symbol=escape('%')))
+    ax.tick_params(axis='y', labelsize=28)
+    ax.set_xticks(range(len(shares)))
+    ax.set_xticklabels([f'${name}$' for name in get_short_service_names()], fontsize=28)
+    fig.tight_layout()
+    return save_figure(fig, path)
+
+
+def plot_status_shares_horizontal(incidents, path, usetex):
+    """The lifecycle path shares as horizontal bars, one per service from O_1 at the top, legend above."""
+    set_figure_font('half_column', usetex)
+    shares = get_status_shares(incidents)
+    fig, ax = plt.subplots(figsize=(18, 6))
+    left = np.zeros(len(shares))
+    y = np.arange(len(shares))
+    colors = sns.color_palette('deep', n_colors=len(shares.columns))
+    for case, color in zip(shares.columns, colors):
+        ax.barh(y, shares[case], left=left, label=bold(case.replace('_', '-')), color=color, height=0.85)
+        for i, value in enumerate(shares[case]):
+            if value > 0:
+                ax.text(left[i] + value / 2, i, f'{value * 100:.2f}', ha='center', va='center', color='white',
+                        fontsize=16)
+        left += shares[case].to_numpy()
+    ax.legend(bbox_to_anchor=(0.0, 1.0), loc='lower left', ncol=len(shares.columns), fontsize=14)
+    ax.set_xlim(0, 1)
+    ax.xaxis.set_major_formatter(PercentFormatter(1, symbol=escape('%')))
+    ax.tick_params(axis='x', labelsize=28)
+    ax.set_yticks(y)
+    ax.set_yticklabels([f'${name}$' for name in get_short_service_names()], fontsize=28)
+    ax.invert_yaxis()
+    fig.tight_layout()
+    return save_figure(fig, path)
+
+
+def plot_chatgpt_visits(monthly, path, usetex):
+    """Monthly ChatGPT website visits, with its monthly outage days and incidents on a second axis."""
+    set_figure_font('one_column', usetex)
+    visits, outages, incidents = monthly['visits'], monthly['outages'], monthly['incidents']
+    months = pd.Index(visits['Month'])
+    fig, ax1 = plt.subplots(figsize=(12, 6))
+    ax1.plot(range(len(months)), visits['Monthly Website Visits (billions)'], marker='o', linewidth=2, color='b')
+    ax1.set_xlabel(bold('Month'))
+    ax1.set_ylabel(bold('Number of Visits [billions]'))
+    ax1.tick_params(axis='y', labelsize=22)
+    ax2 = ax1.twinx()
+    ax2.plot(months.get_indexer(outages.index), outages.to_numpy(), marker='^', linewidth=2, color='r')
+    ax2.plot(months.get_indexer(incidents.index), incidents.to_numpy(), marker='s', linewidth=2, color='g')
+    ax2.set_ylabel(bold('Monthly Failures'))
+    ax2.tick_params(axis='y', labelsize=22)
+    ax1.set_xticks(range(len(months)))
+    ax1.set_xticklabels(months, rotation=45, ha='right', fontsize=22)
+    # label positions of the notebook, next to the end of each line
+    ax1.text(len(months) - 14, visits['Monthly Website Visits (billions)'].iloc[-13] + 0.4, bold('Website Visits'),
+             color='b', fontsize=22, va='center')
+    ax2.text(len(outages) - 5, outages.iloc[-4] - 2, bold('Outages'), color='r', fontsize=22, va='center')
+    ax2.text(len(incidents) - 6, incidents.iloc[-1] - 2, bold('Incidents'), color='g', fontsize=22, va='center')
+    ax1.grid(True, linestyle='--', color='gray', alpha=0.7)
+    ax1.set_title(bold('ChatGPT'), fontsize=22)
+    return save_figure(fig, path, bbox_inches='tight')
+
+
+def plot_mttr_shares(durations, path, usetex):
+    set_figure_font('half_column', usetex)
+    _, _, shares = util_lifecycle.get_period_share_tables(durations)
+    fig, ax = plt.subplots(figsize=(16, 7))
+    bottom = np.zeros(len(shares))
+    colors = sns.color_palette('Set2', n_colors=3)
+    for period, label, color in zip(util_lifecycle.PERIODS, ['Investigating', 'Repairing', 'Checking'], colors):
+        ax.bar(range(len(shares)), shares[period], 0.7, label=bold(label), bottom=bottom, color=color)
+        for i, share in enumerate(shares[period]):
+            ax.text(i, bottom[i] + share / 2, escape(f'{share:.2%}'), ha='center', va='center', color='black')
+        bottom += shares[period].to_numpy()
+    ax.set_xticks(range(len(shares)))
+    ax.set_xticklabels([bold(service) for service in shares.index], rotation=30)
+    ax.legend(bbox_to_anchor=(0.46, 1.2), loc='upper center', ncol=3)
+    ax.yaxis.set_major_formatter(PercentFormatter(1, symbol=escape('%')))
+    ax.tick_params(axis='y', labelsize=28)
+    ax.set_ylabel(bold('Percent of MTTR'))
+    fig.tight_layout()
+    return save_figure(fig, path)
+
+
+def plot_calendar_counts(starts, calendar, path, usetex):
+    """Incident counts by day of week or hour of day, one panel per provider with its services stacked."""
+    set_figure_font('half_column', usetex)
+    histogram = util_temporal.get_calendar_histograms(starts)[calendar]
+    fig, axs = plt.subplots(1, len(PROVIDER_SERVICES), figsize=(30, 6))
+    fig.subplots_adjust(wspace=0.0)
+    for ax, (provider, (services, palette)) in zip(axs, PROVIDER_SERVICES.items()):
+        colors = sns.color_palette(palette, 4)[::-1]
+        x = np.arange(histogram.shape[1])
+        bottom = np.zeros(len(x))
+        bars = []
+        # the last service of the provider at the bottom, as in the notebooks
+        for service, color in zip(services[::-1], colors[:len(services)][::-1]):
+            counts = histogram.loc[service].to_numpy() if service in histogram.index else np.zeros(len(x))
+            bars.append(ax.bar(x, counts, color=color, width=0.6, bottom=bottom))
+            bottom += counts
+        labels = [bold('API' if service.startswith('API') else service) for service in services]
+        ax.legend(bars[::-1], labels, loc='upper right', fontsize=30)
+        ax.set_title(bold(provider), fontsize=41)
+        if calendar == 'day_of_week':
+            ax.set_xticks(x)
+            ax.set_xticklabels([bold(f'{day[:3]}.') for day in histogram.columns])
+        else:
+            ax.set_xticks([0, 5, 10, 15, 20])
+        ax.grid(axis='y', linestyle='--', alpha=0.8)
+        ax.tick_params(axis='both', labelsize=41)
+    axs[0].set_ylabel(bold('Incident Count'), fontsize=41)
+    return save_figure(fig, path, bbox_inches='tight')
+
+
+def plot_autocorrelation(acf_series, provider, path, usetex):
+    """Month, week and day autocorrelation of a provider's incident counts, drawn like statsmodels plot_acf."""
+    set_figure_font('half_column', usetex)
+    fig, axs = plt.subplots(1, len(ACF_FREQUENCIES), figsize=(15, 5))
+    fig.subplots_adjust(wspace=0.0)
+    for ax, freq in zip(axs, ACF_FREQUENCIES):
+        acf = acf_series[freq]['acf'].loc[provider].to_numpy()
+        confidence = acf_series[freq]['confidence'].loc[provider].to_numpy()
+        lags = np.arange(len(acf))
+        ax.vlines(lags, 0, acf, color='tab:blue')
+        ax.plot(lags, acf, 'o', color='tab:blue', markersize=5)
+        ax.axhline(0, color='black', linewidth=1)
+        ax.fill_between(lags[1:], -confidence[1:], confidence[1:], color='tab:blue', alpha=0.25, linewidth=0)
+        ax.set_xlabel(bold(f'{freq.capitalize()} (Lags={len(acf) - 1})'), fontsize=24.9)
+        ax.tick_params(axis='both', labelsize=24.9)
+        ax.set_ylim(bottom=0)
+    fig.tight_layout()
+    return save_figure(fig, path, bbox_inches='tight')
+
+
+def plot_daily_availability(outages, column, path, usetex):
+    set_figure_font('one_column', usetex)
+    outage_minutes, services, dates = util_availability.get_day_matrix(outages, column=column)
+    availability = pd.DataFrame(util_availability.get_daily_availability(outage_minutes), index=services,
+                                columns=dates)
+    bins = [50, 90, 99, 99.9, 99.99, 100]
+    cmap = ListedColormap(['#ef4146', '#ea7711', '#f3ac36', '#c0aa47', '#10a37f'])
+    fig, ax = plt.subplots(figsize=(16, 3))
+    sns.heatmap(availability, cmap=cmap, norm=BoundaryNorm(bins, cmap.N), ax=ax, cbar_kws={'ticks': bins})
+    months = pd.date_range(dates.min(), dates.max(), freq='MS')
+    ax.set_xticks(dates.get_indexer(months))
+    ax.set_xticklabels([month.strftime('%Y-%m') for month in months], rotation=30)
+    ax.set_xlabel('')
+    return save_figure(fig, path, bbox_inches='tight')
+
+
+def plot_cooccurrence(cooccurrence, value, path, usetex):
+    """Heatmap of the co-occurrence day counts or conditional outage probabilities of all service pairs."""
+    set_figure_font('one_column', usetex)
+    fig, ax = plt.subplots(figsize=(10, 8))
+    cmap = ListedColormap(sns.color_palette('Greys', 5))
+    if value == 'count':
+        label, kwargs = 'Co-occurrence Outages in Days Count', {'annot_kws': {'fontsize': 20}}
+    else:
+        label, kwargs = 'Co-occurrence Outage Probability (%)', {'fmt': '.2f'}
+    sns.heatmap(cooccurrence[value], cmap=cmap, norm=BoundaryNorm([0, 20, 40, 60, 80, 100], cmap.N), annot=True,
+                ax=ax, cbar_kws={'label': bold(label)}, **kwargs)
+    tick_labels = [bold(service) for service in cooccurrence[value].index]
+    ax.set_xticklabels(tick_labels, fontsize=14, rotation=30)
+    ax.set_yticklabels(tick_labels, fontsize=14)
+    ax.set_ylabel('')
+    return save_figure(fig, path, bbox_inches='tight')
+
+
+def plot_service_combinations(incidents, provider, path, usetex):
+    """Incidents of a provider per combination of impacted services, with the short service labels."""
+    set_figure_font('half_column', usetex)
+    short_labels = COMBINATION_SERVICES[provider]
+    df = incidents[incidents['provider'] == provider]
+    flags = df[list(short_labels)].to_numpy() == 1
+    combinations = [', '.join(np.array(list(short_labels.values()))[row]) or 'Not Given' for row in flags]
+    counts = pd.Series(combinations).value_counts()
+    fig, ax = plt.subplots(figsize=(6, 6))
+    counts[::-1].plot(kind='barh', color='grey', edgecolor='black', ax=ax)
+    for i, count in enumerate(counts[::-1]):
+        ax.text(count + 2, i, str(count), ha='left', va='center', fontsize=25.9, color='black')
+    ax.set_title(bold('OpenAI' if provider == 'openai' else 'Anthropic'))
+    ax.set_ylabel(bold('Impacted Services'))
+    ax.set_xlabel(bold('Number of Incidents'))
+    ax.tick_params(axis='x', rotation=45)
+    legend = '\n'.join(f'{label}: {util_lifecycle.SERVICE_LABELS[column]}' for column, label in short_labels.items())
+    ax.text(0.99, 0.01, legend, ha='right', va='bottom', transform=ax.transAxes, fontsize=25.9,
+            bbox=dict(facecolor='white', alpha=0.5))
+    return save_figure(fig, path, bbox_inches='tight')
+
+
+# figure name -> section folder (empty for the plot folder itself), plotting function, data stage and parameters
+FIGURES = {
+    'chatgpt_visits': ('', plot_chatgpt_visits, 'data/visits', {}),
+    'MTTR-grouped-by-provider-ecdf': ('sec4-failure_recovery', plot_provider_ecdf, 'data/durations',
+                                      {'metric': 'MTTR'}),
+    'MTBF-grouped-by-provider-ecdf': ('sec4-failure_recovery', plot_provider_ecdf, 'data/durations',
+                                      {'metric': 'MTBF'}),
+    'MTTR-grouped-by-provider-ecdf-10-6': ('sec4-failure_recovery', plot_provider_ecdf, 'data/durations',
+                                           {'metric': 'MTTR', 'titled': True}),
+    'MTBF-grouped-by-provider-ecdf-10-6': ('sec4-failure_recovery', plot_provider_ecdf, 'data/durations',
+                                           {'metric': 'MTBF', 'titled': True}),
+    'horizontal-box-plot-by-service-MTTR': ('sec4-failure_recovery', plot_service_boxes, 'data/durations',
+                                            {'metric': 'MTTR'}),
+    'horizontal-box-plot-by-service-MTBF': ('sec4-failure_recovery', plot_service_boxes, 'data/durations',
+                                            {'metric': 'MTBF'}),
+    'stacked_bar_incident_status_count_by_service': ('sec4-failure_recovery', plot_status_shares, 'data/lifecycle',
+                                                     {}),
+    'horizontal-stacked-bar-incident-status-count-by-service': ('sec4-failure_recovery', plot_status_shares_horizontal,
+                                                                'data/lifecycle', {}),
+    'stacked-bar-percent-of-MTTR': ('sec4-failure_recovery', plot_mttr_shares, 'data/durations', {}),
+    'incident_count_day_of_week_by_provider': ('sec5-temporal_analysis', plot_calendar_counts, 'data/starts',
+                                               {'calendar': 'day_of_week'}),
+    'incident_count_hour_of_day_by_provider': ('sec5-temporal_analysis', plot_calendar_counts, 'data/starts',
+                                               {'calendar': 'hour_of_day'}),
+    'auto_correlation_openai': ('sec5-temporal_analysis', plot_autocorrelation, 'data/acf', {'provider': 'openai'}),
+    'auto_correlation_anthropic': ('sec5-temporal_analysis', plot_autocorrelation, 'data/acf',
+                                   {'provider': 'anthropic'}),
+    'fig-daily_availability_by_scaled_outage_minutes': ('sec5-temporal_analysis', plot_daily_availability,
+                                                        'data/outages', {'column': 'scaled_total_outage_minutes'}),
+    'fig-daily_availability_by_total_outage_minutes': ('sec5-temporal_analysis', plot_daily_availability,
+                                                       'data/outages', {'column': 'total_outage_minutes'}),
+    'fig-outage_co-ocurrence_count': ('sec6-co_occurrence_failures', plot_cooccurrence, 'data/cooccurrence',
+                                      {'value': 'count'}),
+    'fig-outage_probability': ('sec6-co_occurrence_failures', plot_cooccurrence, 'data/cooccurrence',
+                               {'value': 'probability'}),
+    'fig-incident_impacted_service_combinations_openai': ('sec6-co_occurrence_failures', plot_service_combinations,
+                                                          'data/incidents', {'provider': 'openai'}),
+    'fig-incident_impacted_service_combinations_anthropic': ('sec6-co_occurrence_failures',
+                                                             plot_service_combinations, 'data/incidents',
+                                                             {'provider': 'anthropic'}),
+}
+
+# shared helpers whose source is part of the cache key of every figure, besides the presets of util.plotting
+FIGURE_CODE = [plotting, set_figure_font, escape, bold, save_figure, add_reference_lines]
+# helpers and modules of single figures
+FIGURE_EXTRA_CODE = {
+    plot_provider_ecdf: [to_units, get_provider_durations],
+    plot_service_boxes: [to_units],
+    plot_status_shares: [get_status_shares, get_short_service_names, util_lifecycle],
+    plot_status_shares_horizontal: [get_status_shares, get_short_service_names, util_lifecycle],
+    plot_mttr_shares: [util_lifecycle],
+    plot_calendar_counts: [util_temporal, util_incident],
+    plot_service_combinations: [util_lifecycle, util_incident],
+    plot_daily_availability: [util_availability],
+}
+
+
+def get_stages(plot_dir=PLOT_DIR, incident_path=INCIDENT_PATH, outage_path=OUTAGE_PATH, usetex=None,
+               visits_path=VISITS_PATH):
+    """Shared datasets, computed once per run, then one stage per figure and per table."""
+    usetex = get_usetex() if usetex is None else usetex
+    stages = [
+        Stage('data/incidents', util_lifecycle.load_incident_stages, inputs=[incident_path],
+              params={'path': incident_path}, code=[util_lifecycle]),
+        Stage('data/lifecycle', util_lifecycle.drop_ordering_violations, upstream=['data/incidents'],
+              code=[util_lifecycle]),
+        Stage('data/durations', util_lifecycle.get_service_durations, upstream=['data/lifecycle'],
+              code=[util_lifecycle]),
+        Stage('data/starts', util_temporal.load_incident_starts, inputs=[incident_path], params={'path': incident_path},
+              code=[util_temporal, util_incident]),
+        Stage('data/acf', get_acf_series, upstream=['data/starts'], code=[util_temporal, util_incident]),
+        Stage('data/outages', util_availability.load_outage_days, inputs=[outage_path], params={'path': outage_path}),
+        Stage('data/cooccurrence', get_outage_cooccurrence, upstream=['data/outages'], code=[util_availability]),
+        Stage('data/visits', get_monthly_visits, inputs=[visits_path], upstream=['data/outages', 'data/incidents'],
+              params={'path': visits_path}),
+    ]
+    for name, (section, func, data, params) in FIGURES.items():
+        path = os.path.join(plot_dir, section, name)
+        stages.append(Stage(f'figure/{name}', func, upstream=[data],
+                            params={**params, 'path': path, 'usetex': usetex},
+                            code=FIGURE_CODE + FIGURE_EXTRA_CODE.get(func, []),
+                            outputs=[f'{path}.pdf', f'{path}.png']))
+
+    table_dir = os.path.join(plot_dir, 'backup_table_csv')
+    for tables, func, data, code, table_names in (
+            ('tables/incident', get_incident_tables, 'data/incidents', TABLE_CODE,
+             ['table-incident-status-count.csv', 'table-incident-status-count-by-service.csv',
+              'table-mean-duration-of-model-parameters-by-service.csv']),
+            ('tables/outage', get_outage_tables, 'data/outages', TABLE_CODE, ['table-service_availability.csv']),
+            ('tables/cooccurrence', get_cooccurrence_tables, 'data/cooccurrence', [],
+             ['table-outage_probability.csv', 'table-outage_days_percent.csv'])):
+        stages.append(Stage(tables, func, upstream=[data], code=code))
+        for table in table_names:
+            path = os.path.join(table_dir, table)
+            stages.append(Stage(f'table/{table}', write_table, upstream=[tables], params={'table': table, 'path': path},
+                                outputs=[path]))
+    return stages
+
+
+def select_stages(stages, patterns):
+    """The stages whose name matches one of the glob patterns, e.g. 'figure/*ecdf', and the stages they need."""
+    stages = {stage.name: stage for stage in stages}
+    selected = set()
+    todo = [name for name in stages if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)]
+    if not todo:
+        raise ValueError(f"No figure or table matches: {', '.join(patterns)}")
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(stages[name].upstream)
+    return [stage for name, stage in stages.items() if name in selected]
+
+
+def print_render_times(run_times):
+    """Figures and tables slowest first, the shared data stages are not outputs and only counted."""
+    rows = []
+    for name, seconds in run_times.items():
+        if name.startswith(('figure/', 'table/')):
+            rows.append({'output': name, 'status': 'cached' if seconds is None else 'built',
+                         'seconds': np.nan if seconds is None else seconds})
+    if rows:
+        report = pd.DataFrame(rows).sort_values('seconds', ascending=False, na_position='last', kind='stable')
+        print(report.to_string(index=False, na_rep='-', float_format='{:.2f}'.format))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Render the paper figures and backup table CSVs from the clean data, '
+                                                 'rebuilding only the outputs whose data or plotting code changed.')
+    parser.add_argument('--plot-dir', default=PLOT_DIR)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--incident-path', default=INCIDENT_PATH)
+    parser.add_argument('--outage-path', default=OUTAGE_PATH)
+    parser.add_argument('--visits-path', default=VISITS_PATH)
+    parser.add_argument('-W', '--workers', type=int, default=None, help='Parallel processes, default all cores.')
+    parser.add_argument('-o', '--only', nargs='+', default=None,
+                        help="Glob patterns of the outputs to render, e.g. 'figure/*ecdf' 'table/*'.")
+    parser.add_argument('--usetex', action=argparse.BooleanOptionalAction, default=None,
+                        help='LaTeX text rendering, default when latex is installed.')
+    parser.add_argument('--force', action='store_true', help='Render every figure and table.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    start_time = time.perf_counter()
+    stages = get_stages(args.plot_dir, args.incident_path, args.outage_path, args.usetex, args.visits_path)
+    if args.only:
+        stages = select_stages(stages, args.only)
+    run_times = run_pipeline(stages, args.cache_dir, args.workers, args.force)
+    print()
+    print_render_times(run_times)
+    built = [name for name, seconds in run_times.items() if seconds is not None]
+    print(f'{len(built)} stages built, {len(run_times) - len(built)} cached, in {time.perf_counter() - start_time:.1f}s')
@@ -0,0 +1,192 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.util_timestamp import parse_timestamp_columns
+from util.util_transform import INCIDENT_SERVICES
+
+
+CATEGORY_COLUMNS = ['provider', 'Incident_color', 'Incident_Impact']
+TEXT_COLUMNS = ['Incident_Title', 'Incident_Link', 'Service']
+# service names in the stg services lists, e.g. "['API', 'ChatGPT']"
+SERVICE_NAME_PATTERN = r"'([^']*)'"
+
+
+def get_mask_dtype(n_services):
+    """Smallest unsigned integer type with one bit per service."""
+    if n_services > 64:
+        raise ValueError(f"{n_services} services do not fit into a 64 bit service mask.")
+    return next(dtype for dtype in (np.uint8, np.uint16, np.uint32, np.uint64) if n_services <= np.iinfo(dtype).bits)
+
+
+def get_service_mask(df, services=None):
+    """
+    Service membership of each incident as a bitmask, bit i is set when the incident affected services[i].
+    Built from the 0/1 service columns of the clean incidents, or else from the services lists of the stg incidents
+    (as lists or as their text), without parsing each row. Returns the mask and the services of its bits.
+    """
+    flag_columns = [service for service in (services or INCIDENT_SERVICES) if service in df.columns]
+    if flag_columns and 'services' not in df.columns:
+        services = flag_columns
+        flags = df[services].to_numpy() == 1
+    else:
+        # few distinct service combinations, extract the names of each combination once
+        codes, combinations = pd.factorize(df['services'].astype(str))
+        names = pd.Series(combinations).str.extractall(SERVICE_NAME_PATTERN)[0]
+        names = names[names != '']
+        if services is None:
+            services = list(pd.unique(names))
+        columns = pd.Index(services).get_indexer(names)
+        combination_flags = np.zeros((len(combinations), len(services)), dtype=bool)
+        combination_flags[names.index.get_level_values(0)[columns >= 0], columns[columns >= 0]] = True
+        flags = combination_flags[codes]
+
+    dtype = get_mask_dtype(len(services))
+    bits = (np.ones(1, dtype=dtype) << np.arange(len(services), dtype=dtype))
+    mask = np.bitwise_or.reduce(np.where(flags, bits, dtype(0)), axis=1) if len(services) else np.zeros(len(df), dtype)
+    return pd.Series(mask.astype(dtype), index=df.index, name='service_mask'), services
+
+
+def to_typed_incident(df, services=None, tz='UTC'):
+    """
+    Compact typed copy of stg or clean incidents: the service columns or lists become one service_mask column
+    (services in df.attrs['services']), provider, colors and impact are categoricals, flags and levels int8,
+    timestamps datetime64 and text pyarrow strings.
+    """
+    mask, services = get_service_mask(df, services)
+    df = df.drop(columns=[column for column in services + ['services'] if column in df.columns])
+    df['service_mask'] = mask
+
+    timestamp_columns = [column for column in df.columns if column.endswith('_timestamp')]
+    df = parse_timestamp_columns(df, timestamp_columns, tz)
+    for column in df.columns:
+        if column.endswith('_flag') or column == 'incident_impact_level':
+            df[column] = df[column].astype(np.int8)
+        elif column in CATEGORY_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif column == 'time_span':
+            if {'start_timestamp', 'close_timestamp'} <= set(df.columns):
+                df[column] = df['close_timestamp'] - df['start_timestamp']
+            else:
+                df[column] = pd.to_timedelta(df[column])
+        elif column == 'over_one_day':
+            df[column] = df[column].astype(bool)
+        elif column.endswith('_description') or column in TEXT_COLUMNS or column == 'incident_id':
+            df[column] = df[column].astype('string[pyarrow]')
+    df.attrs['services'] = list(services)
+    return df
+
+
+def load_typed_incident(path='data/clean/incident/2024-08-31/incident_stages.csv', services=None, tz='UTC'):
+    return to_typed_incident(pd.read_csv(path), services, tz)
+
+
+def get_service_bits(df, services):
+    """Bitmask selecting the given services of a typed incident frame."""
+    positions = pd.Index(df.attrs['services']).get_indexer(services)
+    if (positions < 0).any():
+        raise ValueError(f"Unknown services: {[s for s, p in zip(services, positions) if p < 0]}")
+    return np.bitwise_or.reduce(np.left_shift(1, positions).astype(np.uint64))
+
+
+def select_by_service(df, services, match='any'):
+    """Boolean row selection of the incidents affecting any (or all, with match='all') of the services."""
+    if isinstance(services, str):
+        services = [services]
+    bits = get_service_bits(df, services)
+    hits = df['service_mask'].to_numpy().astype(np.uint64) & bits
+    return hits == bits if match == 'all' else hits != 0
+
+
+def filter_by_service(df, services, match='any'):
+    """Incidents affecting the services, without exploding the rows."""
+    return df[select_by_service(df, services, match)]
+
+
+def get_service_matrix(df):
+    """Service membership as a boolean incident x service frame."""
+    services = df.attrs['services']
+    mask = df['service_mask'].to_numpy().astype(np.uint64)
+    flags = (mask[:, None] >> np.arange(len(services), dtype=np.uint64)) & np.uint64(1)
+    return pd.DataFrame(flags.astype(bool), index=df.index, columns=services)
+
+
+def count_by_service(df):
+    return get_service_matrix(df).sum()
+
+
+def explode_service_mask(df):
+    """One row per incident and affected service, with a categorical service column."""
+    services = df.attrs['services']
+    rows, columns = np.nonzero(get_service_matrix(df).to_numpy())
+    exploded = df.iloc[rows].drop(columns='service_mask')
+    exploded.insert(0, 'service', pd.Categorical.from_codes(columns, categories=services))
+    return exploded
+
+
+def to_stg_incident(df):
+    """Clean incidents with the stg services list column, as text like in data/stg/incident/."""
+    services = [service for service in INCIDENT_SERVICES if service in df.columns]
+    flags = df[services].to_numpy() == 1
+    df = df.drop(columns=services)
+    df['services'] = [str([service for service, flag in zip(services, row) if flag]) for row in flags]
+    return df
+
+
+def run_benchmark(path, scale):
+    clean = pd.concat([pd.read_csv(path)] * scale, ignore_index=True)
+    stg = to_stg_incident(clean)
+    print(f'{len(clean)} incidents ({scale}x)')
+
+    timestamp_columns = [column for column in stg.columns if column.endswith('_timestamp')]
+    start = time.perf_counter()
+    # what load_stg_incident() and the notebooks do: parse each list, then one 0/1 column per service
+    untyped = parse_timestamp_columns(stg.copy(), timestamp_columns)
+    untyped['services'] = untyped['services'].apply(lambda x: json.loads(x.replace("'", '"')))
+    for service in INCIDENT_SERVICES:
+        untyped[service] = untyped['services'].apply(lambda x: 1 if service in x else 0)
+    untyped_load = time.perf_counter() - start
+    start = time.perf_counter()
+    typed = to_typed_incident(stg, INCIDENT_SERVICES)
+    typed_load = time.perf_counter() - start
+    print(f'load: per-row lists {untyped_load:.2f}s, typed {typed_load:.2f}s')
+
+    untyped_memory = untyped.memory_usage(deep=True).sum() / 2 ** 20
+    typed_memory = typed.memory_usage(deep=True).sum() / 2 ** 20
+    print(f'memory: {untyped_memory:.1f} MiB -> {typed_memory:.1f} MiB ({untyped_memory / typed_memory:.1f}x)')
+
+    start = time.perf_counter()
+    expected = {service: untyped['services'].apply(lambda x: service in x).to_numpy() for service in INCIDENT_SERVICES}
+    untyped_select = time.perf_counter() - start
+    start = time.perf_counter()
+    selected = {service: select_by_service(typed, service) for service in INCIDENT_SERVICES}
+    typed_select = time.perf_counter() - start
+    mismatches = sum((expected[s] != selected[s]).any() for s in INCIDENT_SERVICES)
+    print(f'selecting all services: per-row {untyped_select:.4f}s, bitmask {typed_select:.4f}s '
+          f'({untyped_select / typed_select:.0f}x), {mismatches} mismatches')
+
+    start = time.perf_counter()
+    for service in INCIDENT_SERVICES:
+        untyped[untyped['services'].apply(lambda x: service in x)]
+    untyped_slice = time.perf_counter() - start
+    start = time.perf_counter()
+    for service in INCIDENT_SERVICES:
+        filter_by_service(typed, service)
+    typed_slice = time.perf_counter() - start
+    print(f'slicing all services: per-row {untyped_slice:.3f}s, bitmask {typed_slice:.3f}s')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the typed incident schema against services lists.')
+    parser.add_argument('--path', default='data/clean/incident/2024-08-31/incident_stages.csv')
+    parser.add_argument('--scale', type=int, default=100, help='Times the incidents are repeated.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    run_benchmark(args.path, args.scale)
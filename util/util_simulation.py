@@ -0,0 +1,282 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from util.util_availability import NINES, load_outage_days, get_day_matrix, get_daily_availability, \
+    get_rolling_availability
+from util.util_incident import SERVICE_LABELS
+from util.util_lifecycle import PERIODS, SERVICE_COLUMNS, load_incident_stages, drop_ordering_violations, \
+    get_service_durations, to_hours
+
+
+YEAR_HOURS = 365 * 24
+# the stages until resolved make up the downtime of an incident, P_other is the part of the MTTR spent in stages
+# that were skipped on the status page, e.g. S1 -> S3 leaves neither P_investigate nor P_repair
+DOWNTIME_STAGES = PERIODS[:3] + ['P_other']
+DISTRIBUTIONS = {'lognorm': stats.lognorm, 'weibull_min': stats.weibull_min, 'expon': stats.expon}
+# components with fewer positive values use the fit over all services
+MIN_FIT_SAMPLES = 5
+SLA_LEVELS = [bound for _, bound in NINES[1:]]
+
+
+def get_components(durations):
+    """Stage durations, the unattributed rest of the MTTR and the time between failures, in hours."""
+    hours = to_hours(durations[PERIODS[:3] + ['MTTR', 'MTBF']])
+    hours['P_other'] = (hours['MTTR'] - hours[PERIODS[:3]].sum(axis=1)).clip(lower=0)
+    hours.loc[hours['MTTR'].isna(), 'P_other'] = np.nan
+    return hours
+
+
+def fit_distribution(values):
+    """Distribution of the positive values with the lowest AIC, fitted with its location at 0."""
+    best = None
+    for name, dist in DISTRIBUTIONS.items():
+        params = dist.fit(values, floc=0)
+        aic = 2 * (len(params) - 1) - 2 * np.sum(dist.logpdf(values, *params))
+        if np.isfinite(aic) and (best is None or aic < best[2]):
+            best = (name, params, aic)
+    return {'dist': best[0], 'params': tuple(float(param) for param in best[1])}
+
+
+def fit_component(values, pooled=None):
+    """
+    Share of the incidents with a positive value, i.e. the stage happened (a skipped stage has no duration), and the
+    distribution of the positive values. Falls back to the pooled fit when there are too few values.
+    """
+    positive = values[values > 0].to_numpy()
+    share = len(positive) / len(values) if len(values) else 0.0
+    if len(positive) < MIN_FIT_SAMPLES or np.ptp(positive) == 0:
+        if pooled is None:
+            raise ValueError(f'Too few values to fit a distribution: {len(positive)}')
+        return {**pooled, 'share': share, 'n': len(positive), 'pooled': True}
+    return {**fit_distribution(positive), 'share': share, 'n': len(positive), 'pooled': False}
+
+
+def get_component_mean(component):
+    return component['share'] * DISTRIBUTIONS[component['dist']].mean(*component['params'])
+
+
+def fit_service_models(durations):
+    """Fitted stage and failure models of every service, keyed by service label."""
+    components = get_components(durations)
+    pooled = {name: fit_component(components[name]) for name in DOWNTIME_STAGES + ['MTBF']}
+    models = {}
+    for service in [SERVICE_LABELS[column] for column in SERVICE_COLUMNS]:
+        service_components = components[durations['service'] == service]
+        if service_components.empty:
+            continue
+        model = {name: fit_component(service_components[name], pooled[name]) for name in DOWNTIME_STAGES + ['MTBF']}
+        model['MTBF']['share'] = 1.0
+        model['incidents'] = len(service_components)
+        models[service] = model
+    return models
+
+
+def get_fit_table(models):
+    rows = []
+    for service, model in models.items():
+        for name in DOWNTIME_STAGES + ['MTBF']:
+            component = model[name]
+            rows.append({'service': service, 'component': name, 'dist': component['dist'],
+                         'share': round(component['share'], 3), 'n': component['n'], 'pooled': component['pooled'],
+                         'mean_hours': round(DISTRIBUTIONS[component['dist']].mean(*component['params']), 3)})
+    return pd.DataFrame(rows)
+
+
+def draw(component, size, rng):
+    return DISTRIBUTIONS[component['dist']].rvs(*component['params'], size=size, random_state=rng)
+
+
+def simulate_batch(model, n_years, seed, shrink=None, outage_share=1.0):
+    """
+    Yearly availability in percent of n_years simulated service-years, as one batch of arrays.
+    Failures are a renewal process with the fitted MTBF, each downtime the sum of the stages that happened,
+    stage durations scaled by shrink (e.g. {'P_repair': 0.5}) and the total by the outage share.
+    """
+    rng = np.random.default_rng(seed)
+    shrink = shrink or {}
+    mean_gap = DISTRIBUTIONS[model['MTBF']['dist']].mean(*model['MTBF']['params'])
+    slots = int(2 * YEAR_HOURS / mean_gap) + 10
+    gaps = draw(model['MTBF'], (n_years, slots), rng)
+    # start each year at a random point of a gap, not right after a failure
+    starts = np.cumsum(gaps, axis=1) - rng.uniform(size=(n_years, 1)) * gaps[:, :1]
+    while (starts[:, -1] < YEAR_HOURS).any():
+        more = draw(model['MTBF'], (n_years, slots), rng)
+        starts = np.concatenate([starts, starts[:, -1:] + np.cumsum(more, axis=1)], axis=1)
+    in_year = starts < YEAR_HOURS
+
+    downtime = np.zeros(starts.shape)
+    for stage in DOWNTIME_STAGES:
+        component = model[stage]
+        happened = rng.uniform(size=starts.shape) < component['share']
+        downtime += np.where(happened, draw(component, starts.shape, rng), 0) * shrink.get(stage, 1.0)
+    # an incident open at the end of the year only counts until then
+    downtime = np.minimum(downtime, YEAR_HOURS - np.maximum(starts, 0)) * in_year
+    yearly = np.minimum(downtime.sum(axis=1) * outage_share, YEAR_HOURS)
+    return (100 * (1 - yearly / YEAR_HOURS)).astype(np.float32)
+
+
+def get_outage_shares(models, outages):
+    """
+    Status page downtime per hour of simulated incident downtime, per service: the incidents' MTTR counts every
+    degradation in full, the uptime calendar only the (scaled) outage minutes.
+    Returns the shares and the empirical mean availability of each service.
+    """
+    outage_minutes, services, _ = get_day_matrix(outages)
+    availability = pd.Series(np.nanmean(get_daily_availability(outage_minutes), axis=1), index=services)
+    shares = {}
+    for service, model in models.items():
+        if service not in availability.index:
+            continue
+        rate = YEAR_HOURS / DISTRIBUTIONS[model['MTBF']['dist']].mean(*model['MTBF']['params'])
+        model_downtime = rate * sum(get_component_mean(model[stage]) for stage in DOWNTIME_STAGES)
+        shares[service] = (100 - availability[service]) / 100 * YEAR_HOURS / model_downtime
+    return shares, availability
+
+
+def summarize(availability, levels=SLA_LEVELS):
+    summary = {
+        'years': len(availability),
+        'mean': float(np.mean(availability)),
+        'p1': float(np.percentile(availability, 1)),
+        'p5': float(np.percentile(availability, 5)),
+        'p50': float(np.percentile(availability, 50)),
+        'p95': float(np.percentile(availability, 95)),
+    }
+    for level in levels:
+        summary[f'P(<{level:g}%)'] = float(np.mean(availability < level))
+    return summary
+
+
+def run_simulation(models, n_years, scenarios, outage_shares=None, batch_years=20000, workers=None, seed=0):
+    """
+    Simulate n_years service-years of every service in every scenario (name -> shrink factors), in batches over a
+    process pool. A batch uses the same seed in every scenario, so the scenarios differ only by their shrink.
+    Returns the yearly availability arrays keyed by (scenario, service).
+    """
+    outage_shares = outage_shares or {}
+    batches = [min(batch_years, n_years - start) for start in range(0, n_years, batch_years)]
+    seeds = np.random.SeedSequence(seed).spawn(len(models) * len(batches))
+    tasks = []
+    for scenario, shrink in scenarios.items():
+        for i, (service, model) in enumerate(models.items()):
+            for j, size in enumerate(batches):
+                tasks.append(((scenario, service), (model, size, seeds[i * len(batches) + j], shrink,
+                                                    outage_shares.get(service, 1.0))))
+    if workers == 1:
+        results = [simulate_batch(*args) for _, args in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(simulate_batch, *zip(*[args for _, args in tasks])))
+    availability = {}
+    for (key, _), result in zip(tasks, results):
+        availability.setdefault(key, []).append(result)
+    return {key: np.concatenate(arrays) for key, arrays in availability.items()}
+
+
+def get_summary_table(availability, scenario='baseline'):
+    return pd.DataFrame([{'service': service, **summarize(values)}
+                         for (name, service), values in availability.items() if name == scenario])
+
+
+def get_shrink_table(availability, level=99.9):
+    """Change of the mean availability (percentage points) and of the breach probability when a stage shrinks."""
+    rows = []
+    for (scenario, service), values in availability.items():
+        if scenario == 'baseline':
+            continue
+        baseline = availability[('baseline', service)]
+        rows.append({'service': service, 'scenario': scenario,
+                     'mean_change': float(np.mean(values) - np.mean(baseline)),
+                     f'P(<{level:g}%)': float(np.mean(values < level)),
+                     f'P(<{level:g}%)_change': float(np.mean(values < level) - np.mean(baseline < level))})
+    return pd.DataFrame(rows)
+
+
+def get_check_table(models, durations, availability, outages, shares, empirical_availability, calibrated=True):
+    """
+    Simulated against observed: incidents per year and MTTR of the fit, and the yearly availability quantiles of
+    the simulation against the 365-day windows of the uptime calendar.
+    The outage share is fitted so that the expected downtime matches the calendar, so with calibrated the simulated
+    mean equals the empirical availability by construction and only the spread is checked.
+    """
+    components = get_components(durations)
+    outage_minutes, services, _ = get_day_matrix(outages)
+    windows = get_rolling_availability(outage_minutes, 365)
+    rows = []
+    for service, model in models.items():
+        service_durations = durations[durations['service'] == service]
+        span_years = (service_durations['start_timestamp'].max() - service_durations['start_timestamp'].min()) / \
+            pd.Timedelta(days=365)
+        rate = YEAR_HOURS / DISTRIBUTIONS[model['MTBF']['dist']].mean(*model['MTBF']['params'])
+        row = {
+            'service': service,
+            'incidents/year': len(service_durations) / span_years if span_years else np.nan,
+            'sim incidents/year': rate,
+            'MTTR': components.loc[service_durations.index, 'MTTR'].mean(),
+            'sim MTTR': sum(get_component_mean(model[stage]) for stage in DOWNTIME_STAGES),
+            'outage_share': shares.get(service, np.nan),
+            'availability': empirical_availability.get(service, np.nan),
+        }
+        simulated = availability.get(('baseline', service))
+        if service in services and simulated is not None:
+            observed = windows[services.index(service)]
+            observed = observed[~np.isnan(observed)]
+            row.update({'365d min': observed.min() if len(observed) else np.nan,
+                        '365d median': np.median(observed) if len(observed) else np.nan,
+                        'sim mean (calibrated)' if calibrated else 'sim mean': float(np.mean(simulated)),
+                        'sim p5': float(np.percentile(simulated, 5)),
+                        'sim p50': float(np.percentile(simulated, 50)),
+                        'sim p95': float(np.percentile(simulated, 95))})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Monte Carlo yearly availability from fitted stage durations and '
+                                                 'failure times.')
+    parser.add_argument('--incident-path', default='data/clean/incident/2024-08-31/incident_stages.csv')
+    parser.add_argument('--outage-path', default='data/clean/outage/2024-08-31/outage_unexploded.csv')
+    parser.add_argument('-N', '--years', type=int, default=100000, help='Simulated years per service and scenario.')
+    parser.add_argument('--shrink', type=float, default=0.5, help='Factor applied to one stage in each scenario.')
+    parser.add_argument('--level', type=float, default=99.9, help='SLA level of the shrink table, in percent.')
+    parser.add_argument('--uncalibrated', action='store_true',
+                        help='Count the full MTTR of every incident as downtime, not the outage share.')
+    parser.add_argument('--batch-years', type=int, default=20000)
+    parser.add_argument('-W', '--workers', type=int, default=None, help='Parallel processes, default all cores.')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    durations = get_service_durations(drop_ordering_violations(load_incident_stages(args.incident_path)))
+    outages = load_outage_days(args.outage_path)
+    start_time = time.perf_counter()
+    models = fit_service_models(durations)
+    shares, empirical_availability = get_outage_shares(models, outages)
+    scenarios = {'baseline': {}}
+    scenarios.update({f'{stage} x{args.shrink:g}': {stage: args.shrink} for stage in DOWNTIME_STAGES[:3]})
+    availability = run_simulation(models, args.years, scenarios, None if args.uncalibrated else shares,
+                                  args.batch_years, args.workers, args.seed)
+    elapsed = time.perf_counter() - start_time
+
+    pd.set_option('display.width', 250)
+    pd.set_option('display.max_columns', 20)
+    print(f'Fitted components [hours]:\n{get_fit_table(models).to_string(index=False)}\n')
+    print(f'Yearly availability [%]:\n{get_summary_table(availability).round(4).to_string(index=False)}\n')
+    print(f'Shrinking one stage:\n{get_shrink_table(availability, args.level).round(4).to_string(index=False)}\n')
+    check = get_check_table(models, durations, availability, outages, shares, empirical_availability,
+                            not args.uncalibrated)
+    print(f'Check against the incidents and the uptime calendar:\n{check.round(4).to_string(index=False)}')
+    if not args.uncalibrated:
+        print('The calibrated mean equals the availability by construction, compare the quantiles with the '
+              '365-day windows.')
+    print()
+    total_years = args.years * len(models) * len(scenarios)
+    print(f'{total_years} service-years in {elapsed:.1f}s')
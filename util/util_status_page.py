@@ -0,0 +1,298 @@
+import argparse
+import glob
+import json
+import os
+from datetime import datetime
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+
+# status pages and services collected per provider
+PROVIDERS = {
+    'openai': {
+        'url': 'https://status.openai.com',
+        'services': ['api', 'chatgpt', 'labs', 'playground'],
+        # uptime calendar colours of the page theme: operational, partial, degraded and major outage
+        'calendar_colors': ['#10a37f', '#f3ac36', '#e86c09', '#ef4146'],
+    },
+    'anthropic': {
+        'url': 'https://status.anthropic.com',
+        'services': ['claude.ai', 'api.anthropic.com', 'console.anthropic.com'],
+        'calendar_colors': ['#2fcc66', '#f1c40f', '#e67e22', '#e74c3c'],
+    },
+    'characterai': {
+        'url': 'https://status.character.ai',
+        'services': ['character.ai'],
+        'calendar_colors': ['#2fcc66', '#f1c40f', '#e67e22', '#e74c3c'],
+    },
+}
+
+INCIDENT_COLUMNS = ['Incident_Title', 'Incident_Link', 'Incident_color', 'Incident_Impact', 'Updates', 'Service']
+UPTIME_COLUMNS = ['Date', 'Outages', 'Outage_Color', 'Incidents', 'Service']
+
+# outage keys in the uptime page state, in the order the tooltip lists them
+OUTAGE_TYPES = {'m': 'Major outage', 'p': 'Partial outage'}
+
+# The calendar colours a day client-side, from its outage seconds with partial outages weighted 0.3. The colour
+# runs from halfway between operational and partial at 36s, to partial at 20 min, degraded at 2000s and major from
+# an hour on. Fitted to the rect fills of data/raw, read from the live pages by sec3.2-scraper_uptime_page.py.
+PARTIAL_OUTAGE_WEIGHT = 0.3
+CALENDAR_COLOR_SECONDS = [0, 36, 20 * 60, 2000, 60 * 60]
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+def get_provider_host(provider):
+    return urlparse(PROVIDERS[provider]['url']).netloc
+
+
+def get_site_provider(site_url):
+    host = urlparse(site_url).netloc
+    return next(provider for provider in PROVIDERS if get_provider_host(provider) == host)
+
+
+def to_rgb(color):
+    return [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+
+
+def get_outage_color(major_seconds, partial_seconds, colors):
+    """Fill of an uptime calendar day as the page draws it, given the outage seconds of the day."""
+    operational, partial, degraded, major = (np.array(to_rgb(color), dtype=float) for color in colors)
+    stops = [operational, (operational + partial) / 2, partial, degraded, major]
+    score = major_seconds + PARTIAL_OUTAGE_WEIGHT * partial_seconds
+    if score <= 0:
+        return colors[0]
+    rgb = [np.interp(score, CALENDAR_COLOR_SECONDS, [stop[channel] for stop in stops]) for channel in range(3)]
+    return '#' + ''.join(f'{int(round(value)):02x}' for value in rgb)
+
+
+def get_partition_name(month_title):
+    """
+    Name of the archive file for a history page, given its first (most recent) month title, e.g. 'August 2024'.
+    Same naming as get_archive_path() in sec3.2-scraper_incident_page.py.
+    """
+    end_date = datetime.strptime(month_title, "%B %Y")
+    start_date = end_date - relativedelta(months=2)
+    return f"incident_history_{start_date.strftime('%Y%m')}_{end_date.strftime('%Y%m')}.csv"
+
+
+def format_tooltip_date(day):
+    # same format as the calendar tooltip, e.g. '1 Jun 2024'
+    return f"{day.day} {day.strftime('%b %Y')}"
+
+
+class Node:
+    def __init__(self, tag, attrs, parent=None):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.parent = parent
+        self.children = []
+
+    @property
+    def classes(self):
+        return (self.attrs.get('class') or '').split()
+
+    def iter(self):
+        yield self
+        for child in self.children:
+            if isinstance(child, Node):
+                yield from child.iter()
+
+    def find_all(self, tag=None, cls=None):
+        return [node for node in self.iter()
+                if (tag is None or node.tag == tag) and (cls is None or cls in node.classes)]
+
+    def find(self, tag=None, cls=None):
+        nodes = self.find_all(tag, cls)
+        return nodes[0] if nodes else None
+
+    def get_text(self, collapse=True):
+        parts = []
+        for child in self.children:
+            if isinstance(child, Node):
+                parts.append('\n' if child.tag == 'br' else child.get_text(collapse=False))
+            else:
+                parts.append(child)
+        text = ''.join(parts)
+        if collapse:
+            text = ' '.join(text.split())
+        return text.strip()
+
+    def get_style(self, name):
+        for declaration in (self.attrs.get('style') or '').split(';'):
+            key, _, value = declaration.partition(':')
+            if key.strip() == name:
+                return value.strip()
+        return None
+
+
+class TreeBuilder(HTMLParser):
+    """Minimal HTML tree builder, enough to run the scrapers' element lookups on a fetched page."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node('document', {})
+        self.current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, attrs, self.current)
+        self.current.children.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_startendtag(self, tag, attrs):
+        self.current.children.append(Node(tag, attrs, self.current))
+
+    def handle_endtag(self, tag):
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.children.append(data)
+
+
+def parse_html(html):
+    builder = TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def get_react_props(document, key):
+    """Return the first React component state (data-react-props) on the page that contains key."""
+    for node in document.iter():
+        props = node.attrs.get('data-react-props')
+        if props:
+            props = json.loads(props)
+            if key in props:
+                return props
+    return None
+
+
+def parse_history_page(html, site_url):
+    """
+    Parse an incident history page (/history?page=N).
+    Returns the month titles of the page (most recent first) and the incidents listed on it, in page order.
+    Collapsed incidents ('Show all') are part of the markup, so no expanding is needed.
+    """
+    document = parse_html(html)
+    month_titles = [node.get_text() for node in document.find_all('h4', 'month-title')]
+    incidents = []
+    for link in document.find_all('a', 'incident-title'):
+        # the list timestamp (first - last update) is the next <small> in the incident container
+        container = link.parent
+        history_timestamp = container.find('small')
+        incidents.append({
+            'Incident_Title': link.get_text(),
+            'Incident_Link': urljoin(site_url, link.attrs.get('href')),
+            'Incident_color': link.get_style('color'),
+            'Incident_Impact': next((cls for cls in link.classes if cls.startswith('impact-')), None),
+            'history_timestamp': history_timestamp.get_text() if history_timestamp else None,
+        })
+    return month_titles, incidents
+
+
+def parse_incident_page(html):
+    """Parse an incident detail page into the Updates and Service fields of the raw incident schema."""
+    document = parse_html(html)
+    updates = []
+    for update_row in document.find_all('div', 'update-row'):
+        updates.append({
+            "Update_Title": update_row.find(cls='update-title').get_text(),
+            "Update_Body": update_row.find(cls='update-body').get_text(collapse=False),
+            "Update_Timestamp": update_row.find(cls='update-timestamp').get_text()
+        })
+    service = document.find('div', 'components-affected')
+    return {
+        'Updates': json.dumps(updates),
+        'Service': service.get_text() if service else None,
+    }
+
+
+def parse_uptime_page(html, site_url, service):
+    """
+    Parse an uptime calendar page (/uptime/<component>?page=N).
+
+    The tooltip shown on hover is rendered client-side from the calendar state the page ships to its React
+    component (data-react-props): per day the outage seconds by type ('m' major, 'p' partial) and the related
+    events. Reading that state directly gives the same rows as hovering each rect. The rect fill is not part of the
+    state, it is derived from the outage seconds like the calendar does (get_outage_color).
+    Returns the components of the service dropdown, the uptime records, and whether the page has no-data days.
+    """
+    props = get_react_props(parse_html(html), 'months')
+    if props is None:
+        return [], [], True
+
+    colors = PROVIDERS[get_site_provider(site_url)]['calendar_colors']
+    records = []
+    flag_no_data = False
+    for month in props['months']:
+        for day in month['days']:
+            tooltip_date = format_tooltip_date(datetime.strptime(day['date'], '%Y-%m-%d'))
+            if day.get('no_data'):
+                print({'Date': tooltip_date, 'Warning!': 'No data exists for this day.'})
+                flag_no_data = True
+                continue
+            outages = [{"Outage_Type": outage_type, "Downtime (min)": day['outages'][key] // 60}
+                       for key, outage_type in OUTAGE_TYPES.items() if day['outages'].get(key)]
+            incidents = [{"Incident_Title": event['name'],
+                          "Incident_Link": urljoin(site_url, f"/incidents/{event['code']}")}
+                         for event in day.get('related_events', [])]
+            records.append({
+                "Date": tooltip_date,
+                "Outages": json.dumps(outages),
+                "Outage_Color": get_outage_color(day['outages'].get('m', 0), day['outages'].get('p', 0), colors),
+                "Incidents": json.dumps(incidents),
+                "Service": service
+            })
+    return props.get('components', []), records, flag_no_data
+
+
+def get_color_errors(raw_dir):
+    """
+    Largest RGB channel difference between the derived fill and the rect fill recorded in the raw uptime data, per
+    day. The raw data keeps whole downtime minutes, so days are scored at the middle of their minute.
+    """
+    frames = []
+    for provider, config in PROVIDERS.items():
+        for service in config['services']:
+            path = os.path.join(raw_dir, service, 'uptime_history.csv')
+            if not os.path.isfile(path):
+                continue
+            uptime = pd.read_csv(path).dropna(subset=['Outage_Color'])
+            derived = []
+            for outages in uptime['Outages']:
+                minutes = {outage['Outage_Type']: outage['Downtime (min)'] for outage in json.loads(outages)}
+                major, partial = (minutes.get(OUTAGE_TYPES[key], 0) for key in ('m', 'p'))
+                derived.append(get_outage_color(major * 60 + 30 if major else 0, partial * 60 + 30 if partial else 0,
+                                                config['calendar_colors']))
+            errors = np.abs(np.array([to_rgb(color) for color in derived]) -
+                            np.array([to_rgb(color) for color in uptime['Outage_Color']])).max(axis=1)
+            frames.append(pd.DataFrame({'service': service, 'recorded': uptime['Outage_Color'].to_numpy(),
+                                        'derived': derived, 'error': errors}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compare the derived uptime calendar colours with the rect fills '
+                                                 'of a raw uptime scrape.')
+    parser.add_argument('--raw-dir', default=max(glob.glob('data/raw/uptime/*'), default='data/raw/uptime'))
+    parser.add_argument('--tolerance', type=int, default=3, help='Largest RGB channel difference of a match.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    errors = get_color_errors(args.raw_dir)
+    errors['match'] = errors['error'] <= args.tolerance
+    print(errors.groupby('service').agg(days=('match', 'size'), matching=('match', 'mean'), max_error=('error', 'max')))
+    print(f"\n{errors['match'].mean():.2%} of {len(errors)} days within {args.tolerance}, mismatches:")
+    print(errors[~errors['match']].to_string(index=False))
@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from util.util_data import explode_incident_dates
+from util.util_status_page import get_partition_name
+
+
+SYNTHETIC_ROOT = 'data/synthetic'
+SERVICE_SUFFIXES = ['api', 'chat', 'console', 'playground', 'images', 'voice', 'search', 'embeddings']
+
+# impact, incident color, share of incidents, and the outage type it shows on the uptime calendar
+IMPACTS = [('impact-none', '#050505', 0.15, None),
+           ('impact-minor', '#f4ac36', 0.35, 'Partial outage'),
+           ('impact-major', '#e86c09', 0.40, 'Major outage'),
+           ('impact-critical', '#ef4146', 0.10, 'Major outage')]
+OUTAGE_COLORS = {None: '#10a37f', 'Partial outage': '#e0ab3c', 'Major outage': '#ef4146'}
+
+# share of incidents posting each stage, resolved is always posted
+STAGE_SHARES = {'Investigating': 0.73, 'Identified': 0.39, 'Monitoring': 0.56, 'Resolved': 1.0, 'Postmortem': 0.06}
+# mean minutes from the previous stage, the postmortem follows the resolution by days
+STAGE_MINUTES = {'Investigating': 0, 'Identified': 50, 'Monitoring': 85, 'Resolved': 95, 'Postmortem': 4 * 24 * 60}
+UPDATE_RATE = 0.5
+
+TITLES = ['Elevated error rates on {}', 'Increased latency on {}', 'Degraded performance of {}', '{} unavailable',
+          'Elevated API errors on {}', 'Login issues with {}']
+BODIES = {
+    'Investigating': 'We are currently investigating this issue.',
+    'Identified': 'The issue has been identified and a fix is being implemented.',
+    'Monitoring': 'A fix has been implemented and we are monitoring the results.',
+    'Resolved': 'This incident has been resolved.',
+    'Postmortem': 'We have published a postmortem of this incident.',
+    'Update': 'We are continuing to work on a fix for this issue.',
+}
+LINK_CHARACTERS = np.array(list('0123456789abcdefghijklmnopqrstuvwxyz'))
+
+
+def get_providers(n_providers=3, services_per_provider=3):
+    """Synthetic providers in the layout of util_status_page.PROVIDERS."""
+    providers = {}
+    for i in range(n_providers):
+        name = f'provider{i:03d}'
+        providers[name] = {
+            'url': f'https://status.{name}.com',
+            'services': [f'{name}-{SERVICE_SUFFIXES[j % len(SERVICE_SUFFIXES)]}{j // len(SERVICE_SUFFIXES) or ""}'
+                         for j in range(services_per_provider)],
+        }
+    return providers
+
+
+def format_posted_ago(posted, execution_time):
+    """Relative part of the update timestamps, e.g. 'Posted 3 days ago'."""
+    minutes = (execution_time - posted) / pd.Timedelta(minutes=1)
+    hours, days = minutes // 60, minutes // (24 * 60)
+    value = np.select([days < 1, days < 31, days < 345], [hours, days, np.round(days / 30.4)], np.round(days / 365))
+    unit = np.select([days < 1, days < 31, days < 345], ['hour', 'day', 'month'], 'year')
+    value = np.maximum(value, 1).astype(int)
+    return 'Posted ' + pd.Series(value).astype(str) + ' ' + unit + np.where(value > 1, 's', '') + ' ago'
+
+
+def format_update_timestamps(posted, execution_time):
+    """'Posted 3 days ago. Aug 28, 2024 - 13:36 PDT', the status pages print the Pacific time."""
+    local = pd.Series(posted).dt.tz_convert('America/Los_Angeles')
+    return (format_posted_ago(pd.Series(posted), execution_time) + '. ' + local.dt.strftime('%b %d, %Y - %H:%M %Z'))
+
+
+def generate_provider_incidents(provider, config, start, end, incidents_per_year, rng):
+    """Incidents of one provider: services, impact, and the posted stages with their times, newest first."""
+    services = np.array(config['services'])
+    span_minutes = (end - start) / pd.Timedelta(minutes=1)
+    n = rng.poisson(incidents_per_year * span_minutes / (365 * 24 * 60))
+    starts = start + pd.to_timedelta(np.sort(rng.uniform(0, span_minutes, n))[::-1], unit='min').round('min')
+
+    impact = rng.choice(len(IMPACTS), n, p=[share for _, _, share, _ in IMPACTS])
+    # most incidents affect one service, some several
+    n_affected = np.minimum(rng.geometric(0.7, n), len(services))
+    ranks = rng.random((n, len(services))).argsort(axis=1).argsort(axis=1)
+    affected = ranks < n_affected[:, None]
+
+    stages = list(STAGE_SHARES)
+    posted = rng.random((n, len(stages))) < np.array(list(STAGE_SHARES.values()))
+    gaps = rng.exponential(np.array(list(STAGE_MINUTES.values()), dtype=float), (n, len(stages)))
+    offsets = np.cumsum(np.where(posted, gaps, 0), axis=1).round()
+    ids = [''.join(characters) for characters in LINK_CHARACTERS[rng.integers(0, 36, (n, 12))]]
+    titles = rng.integers(0, len(TITLES), n)
+    extra_updates = rng.poisson(UPDATE_RATE, n)
+
+    return {
+        'provider': provider,
+        'url': config['url'],
+        'starts': starts,
+        'impact': impact,
+        'affected': affected,
+        'services': services,
+        'stages': stages,
+        'posted': posted,
+        'offsets': offsets,
+        'ids': ids,
+        'titles': titles,
+        'extra_updates': extra_updates,
+    }
+
+
+def get_incident_records(incidents, execution_time, rng):
+    """Raw incident rows with the scraper schema, Updates is the JSON list of the detail page, newest first."""
+    n = len(incidents['starts'])
+    stages = incidents['stages']
+    # every posted stage and extra 'Update' as one row, then format all update timestamps at once
+    rows, columns = np.nonzero(incidents['posted'])
+    update_rows = np.repeat(np.arange(n), incidents['extra_updates'])
+    resolved = incidents['offsets'][:, stages.index('Resolved')]
+    update_offsets = (rng.random(len(update_rows)) * resolved[update_rows]).round()
+    incident_rows = np.concatenate([rows, update_rows])
+    titles = np.concatenate([np.array(stages)[columns], np.full(len(update_rows), 'Update')])
+    offsets = np.concatenate([incidents['offsets'][rows, columns], update_offsets])
+    posted = incidents['starts'][incident_rows] + pd.to_timedelta(offsets, unit='min')
+    timestamps = format_update_timestamps(posted, execution_time).to_numpy()
+
+    order = np.lexsort((-offsets, incident_rows))
+    updates = [[] for _ in range(n)]
+    for row, title, timestamp in zip(incident_rows[order], titles[order], timestamps[order]):
+        updates[row].append({'Update_Title': title, 'Update_Body': BODIES[title], 'Update_Timestamp': timestamp})
+
+    services = incidents['services']
+    records = []
+    for i in range(n):
+        affected = list(services[incidents['affected'][i]])
+        impact, color, _, _ = IMPACTS[incidents['impact'][i]]
+        service_text = ', '.join(affected[:-1]) + ' and ' + affected[-1] if len(affected) > 1 else affected[0]
+        records.append({
+            'Incident_Title': TITLES[incidents['titles'][i]].format(affected[0]),
+            'Incident_Link': f"{incidents['url']}/incidents/{incidents['ids'][i]}",
+            'Incident_color': color,
+            'Incident_Impact': impact,
+            'Updates': json.dumps(updates[i]),
+            'Service': f'This incident affected: {service_text}.',
+        })
+    df = pd.DataFrame(records, columns=['Incident_Title', 'Incident_Link', 'Incident_color', 'Incident_Impact',
+                                        'Updates', 'Service'])
+    # about a tenth of the incidents do not list the affected services
+    df.loc[rng.random(n) < 0.11, 'Service'] = np.nan
+    return df
+
+
+def get_outage_days(incidents):
+    """Outage minutes and incidents per service and calendar day (UTC), from the incident intervals."""
+    stages = incidents['stages']
+    resolved = incidents['offsets'][:, stages.index('Resolved')]
+    rows, columns = np.nonzero(incidents['affected'])
+    intervals = pd.DataFrame({
+        'service': incidents['services'][columns],
+        'start_timestamp': incidents['starts'][rows],
+        'close_timestamp': incidents['starts'][rows] + pd.to_timedelta(np.maximum(resolved[rows], 1), unit='min'),
+        'outage_type': [IMPACTS[impact][3] for impact in incidents['impact'][rows]],
+        'title': [TITLES[title].format(incidents['services'][incidents['affected'][row]][0])
+                  for row, title in zip(rows, incidents['titles'][rows])],
+        'link': [f"{incidents['url']}/incidents/{incidents['ids'][row]}" for row in rows],
+    })
+    days = explode_incident_dates(intervals, overlap_minutes=True)
+    days['date'] = pd.to_datetime(days['date'])
+    return days
+
+
+def get_uptime_records(service, start, end, outage_days):
+    """Raw uptime rows of one service with the scraper schema: one calendar day per row, newest month first."""
+    dates = pd.date_range(start.normalize().tz_localize(None), end.normalize().tz_localize(None), freq='D')[::-1]
+    service_days = outage_days[outage_days['service'] == service]
+
+    outages = service_days.dropna(subset=['outage_type'])
+    minutes = outages.groupby(['date', 'outage_type'])['overlap_minutes'].sum().clip(upper=24 * 60).round()
+    outage_lists = {}
+    for (day, outage_type), downtime in minutes.sort_index(level=1).items():
+        outage_lists.setdefault(day, []).append({'Outage_Type': outage_type, 'Downtime (min)': int(downtime)})
+    incident_lists = {}
+    for day, title, link in zip(service_days['date'], service_days['title'], service_days['link']):
+        incident_lists.setdefault(day, []).append({'Incident_Title': title, 'Incident_Link': link})
+
+    return pd.DataFrame({
+        'Date': dates.day.astype(str) + ' ' + dates.strftime('%b %Y'),
+        'Outages': [json.dumps(outage_lists.get(day, [])) for day in dates],
+        'Outage_Color': [OUTAGE_COLORS[outage_lists[day][0]['Outage_Type']] if day in outage_lists
+                         else OUTAGE_COLORS[None] for day in dates],
+        'Incidents': [json.dumps(incident_lists.get(day, [])) for day in dates],
+        'Service': service,
+    })
+
+
+def write_incident_pages(df, starts, provider_dir, execution_date):
+    """One CSV per 3-month history page, named like the scraper's archive files."""
+    execution_month = pd.Period(execution_date, freq='M')
+    months_back = ((execution_month.year - starts.year) * 12 + execution_month.month - starts.month).to_numpy()
+    pages = months_back // 3
+    for page in np.unique(pages):
+        page_end = (execution_month - int(page) * 3).to_timestamp()
+        path = os.path.join(provider_dir, get_partition_name(page_end.strftime('%B %Y')))
+        df[pages == page].to_csv(path, index=False)
+
+
+def generate_dataset(root=SYNTHETIC_ROOT, n_providers=3, services_per_provider=3, years=3.0, incidents_per_year=60,
+                     execution_date='2024-08-31', seed=0):
+    """
+    Write raw incident and uptime CSVs of synthetic providers to {root}/raw/{incident,uptime}/{execution_date}/,
+    in the layout and schema of the scrapers. Returns the config, which is also saved as {root}/config.json.
+    """
+    config = {'n_providers': n_providers, 'services_per_provider': services_per_provider, 'years': years,
+              'incidents_per_year': incidents_per_year, 'execution_date': execution_date, 'seed': seed}
+    rng = np.random.default_rng(seed)
+    execution_time = pd.Timestamp(execution_date, tz='UTC') + pd.Timedelta(days=1)
+    start = execution_time - pd.Timedelta(days=round(years * 365))
+    providers = get_providers(n_providers, services_per_provider)
+
+    incident_count = 0
+    for provider, provider_config in providers.items():
+        incidents = generate_provider_incidents(provider, provider_config, start, execution_time, incidents_per_year,
+                                                rng)
+        incident_count += len(incidents['starts'])
+        provider_dir = os.path.join(root, 'raw', 'incident', execution_date, provider)
+        os.makedirs(provider_dir, exist_ok=True)
+        write_incident_pages(get_incident_records(incidents, execution_time, rng), incidents['starts'], provider_dir,
+                             execution_date)
+
+        outage_days = get_outage_days(incidents)
+        for service in provider_config['services']:
+            service_dir = os.path.join(root, 'raw', 'uptime', execution_date, service)
+            os.makedirs(service_dir, exist_ok=True)
+            uptime = get_uptime_records(service, start, execution_time - pd.Timedelta(days=1), outage_days)
+            uptime.to_csv(os.path.join(service_dir, 'uptime_history.csv'), index=False)
+
+    config['incident_count'] = incident_count
+    config['providers'] = providers
+    config['services'] = [service for provider_config in providers.values() for service in provider_config['services']]
+    with open(os.path.join(root, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate a synthetic raw status page dataset.')
+    parser.add_argument('--root', default=SYNTHETIC_ROOT)
+    parser.add_argument('-P', '--providers', type=int, default=3)
+    parser.add_argument('-S', '--services', type=int, default=3, help='Services per provider.')
+    parser.add_argument('-Y', '--years', type=float, default=3.0)
+    parser.add_argument('-R', '--rate', type=float, default=60, help='Incidents per provider and year.')
+    parser.add_argument('--execution-date', default='2024-08-31')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    start_time = time.perf_counter()
+    config = generate_dataset(args.root, args.providers, args.services, args.years, args.rate, args.execution_date,
+                              args.seed)
+    print(f"{config['incident_count']} incidents of {len(config['services'])} services written to {args.root} "
+          f"in {time.perf_counter() - start_time:.1f}s")
@@ -0,0 +1,221 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import fft, stats
+
+from util.util_incident import TIMEZONE, DAY_NAMES, get_day_of_week, get_incident_services
+
+
+# count series resolutions, as numpy datetime units, except weeks (starting on Monday)
+FREQUENCIES = {'month': 'M', 'week': 'W', 'day': 'D', 'hour': 'h', 'minute': 'm'}
+# default lags of the autocorrelation plots of sec5-temporal_analysis.ipynb
+DEFAULT_LAGS = {'month': 12, 'week': 50, 'day': 80, 'hour': 24 * 7, 'minute': 24 * 60}
+CALENDAR_BINS = {'day_of_week': 7, 'hour_of_day': 24}
+# count series values transformed at once, series are split into batches of at most this many FFT values
+MAX_BATCH_VALUES = 2 ** 24
+
+
+def load_incident_starts(path='data/clean/incident/2024-08-31/incident_stages.csv', timezone=TIMEZONE):
+    """
+    Local start minute of every incident and affected service, converted from UTC once for all rows.
+    Returns one row per incident and service, with the service label and provider.
+    """
+    df = pd.read_csv(path)
+    services = get_incident_services(df)
+    rows = services['row'].to_numpy()
+    start = pd.to_datetime(df['start_timestamp'], utc=True).iloc[rows].dt.tz_convert(timezone).dt.tz_localize(None)
+    return pd.DataFrame({
+        'incident_id': df['incident_id'].to_numpy()[rows],
+        'service': services['service'].to_numpy(),
+        'provider': services['provider'].to_numpy(),
+        'start': start.to_numpy().astype('datetime64[m]'),
+    })
+
+
+def get_series_events(starts):
+    """
+    Series code and start minute of every event of every series: the services, then the providers. A provider
+    counts an incident once, however many of its services it affected.
+    """
+    services = list(dict.fromkeys(starts['service']))
+    providers = list(dict.fromkeys(starts['provider']))
+    provider_starts = starts.drop_duplicates(['incident_id', 'provider'])
+    codes = np.concatenate([pd.Index(services).get_indexer(starts['service']),
+                            len(services) + pd.Index(providers).get_indexer(provider_starts['provider'])])
+    minutes = np.concatenate([starts['start'].to_numpy(), provider_starts['start'].to_numpy()])
+    return codes, minutes, services + providers
+
+
+def get_calendar_histograms(starts):
+    """Day of week and hour of day counts of every service and provider, one bincount per calendar for all series."""
+    codes, minutes, names = get_series_events(starts)
+    days = minutes.astype('datetime64[D]').astype(np.int64)
+    calendar_codes = {
+        'day_of_week': get_day_of_week(days),
+        'hour_of_day': minutes.astype('datetime64[h]').astype(np.int64) % 24,
+    }
+    histograms = {}
+    for calendar, bins in CALENDAR_BINS.items():
+        counts = np.bincount(codes * bins + calendar_codes[calendar], minlength=len(names) * bins)
+        columns = DAY_NAMES if calendar == 'day_of_week' else list(range(bins))
+        histograms[calendar] = pd.DataFrame(counts.reshape(len(names), bins), index=names, columns=columns)
+    return histograms
+
+
+def to_bins(minutes, freq):
+    """Integer bin of each minute at a resolution of FREQUENCIES."""
+    if freq == 'week':
+        days = minutes.astype('datetime64[D]').astype(np.int64)
+        return (days + 3) // 7
+    return minutes.astype(f'datetime64[{FREQUENCIES[freq]}]').astype(np.int64)
+
+
+def get_bin_start(bins, freq):
+    if freq == 'week':
+        return (bins * 7 - 3).astype('datetime64[D]')
+    return bins.astype(f'datetime64[{FREQUENCIES[freq]}]')
+
+
+def get_count_matrix(starts, freq, end=None):
+    """
+    Event counts of every series per bin, as one (series x bins) matrix from a single bincount.
+    All series share the bins from the first event of any series to end (default the last event). Each series is
+    counted from its own first event, so a service is not padded with zeros from before it existed; lengths holds
+    the number of bins of each series, which end at the last column.
+    """
+    codes, minutes, names = get_series_events(starts)
+    bins = to_bins(minutes, freq)
+    first_bin = bins.min()
+    last_bin = bins.max() if end is None else to_bins(np.array([pd.Timestamp(end).to_datetime64()],
+                                                               dtype='datetime64[m]'), freq)[0]
+    n_bins = last_bin - first_bin + 1
+    counts = np.bincount(codes * n_bins + (bins - first_bin), minlength=len(names) * n_bins).reshape(len(names),
+                                                                                                    n_bins)
+    series_first = np.full(len(names), n_bins)
+    np.minimum.at(series_first, codes, bins - first_bin)
+    lengths = n_bins - series_first
+    index = pd.DatetimeIndex(get_bin_start(np.arange(first_bin, last_bin + 1), freq))
+    return counts.astype(float), lengths, names, index
+
+
+def get_demeaned(matrix, lengths):
+    """Each row minus its mean over its own bins, zero before its first bin."""
+    n_bins = matrix.shape[1]
+    valid = np.arange(n_bins) >= (n_bins - lengths)[:, None]
+    means = np.where(valid, matrix, 0).sum(axis=1) / np.maximum(lengths, 1)
+    return np.where(valid, matrix - means[:, None], 0.0)
+
+
+def iter_batches(n_rows, row_values, max_batch_values=MAX_BATCH_VALUES):
+    batch_size = max(1, max_batch_values // row_values)
+    for start in range(0, n_rows, batch_size):
+        yield slice(start, min(start + batch_size, n_rows))
+
+
+def get_autocorrelation(matrix, lengths, nlags, workers=None):
+    """
+    Autocorrelation of every row up to nlags, the same estimator as statsmodels acf(x, nlags, fft=True) on each row's
+    own bins. The rows of a batch go through one rfft: the power spectrum of a zero-padded row is the Fourier
+    transform of its autocovariance (Wiener-Khinchin). Padding by nlags is enough to keep the first nlags lags from
+    wrapping around. Rows are batched by length, so a short series is not transformed at the length of the longest.
+    Rows without variance are NaN.
+    """
+    centered = get_demeaned(matrix, lengths)
+    acf = np.empty((len(matrix), nlags + 1))
+    order = np.argsort(lengths)[::-1]
+    position = 0
+    while position < len(order):
+        width = max(int(lengths[order[position]]), 1)
+        n_fft = fft.next_fast_len(width + nlags, real=True)
+        rows = order[position:position + max(1, MAX_BATCH_VALUES // n_fft)]
+        spectrum = fft.rfft(centered[rows, matrix.shape[1] - width:], n=n_fft, axis=1, workers=workers)
+        autocovariance = fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n=n_fft, axis=1, workers=workers)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            acf[rows] = autocovariance[:, :nlags + 1] / autocovariance[:, :1]
+        position += len(rows)
+    # lags beyond a short series are undefined
+    acf[np.arange(nlags + 1)[None, :] >= lengths[:, None]] = np.nan
+    return acf
+
+
+def get_confidence_band(acf, lengths, alpha=0.05):
+    """Half width of the Bartlett confidence band of each lag, as drawn by statsmodels plot_acf."""
+    variance = np.ones_like(acf) / lengths[:, None]
+    variance[:, 0] = 0
+    variance[:, 2:] *= 1 + 2 * np.cumsum(acf[:, 1:-1] ** 2, axis=1)
+    return stats.norm.ppf(1 - alpha / 2) * np.sqrt(variance)
+
+
+def get_periodogram(matrix, lengths, workers=None):
+    """
+    Periodogram |X(f)|^2 / n of every demeaned row, from one rfft per batch. Frequencies are in cycles per bin, on
+    the grid of the longest row; shorter rows are zero-padded, which interpolates their periodogram.
+    """
+    centered = get_demeaned(matrix, lengths)
+    frequencies = fft.rfftfreq(matrix.shape[1])
+    power = np.empty((len(matrix), len(frequencies)))
+    for rows in iter_batches(len(matrix), matrix.shape[1]):
+        spectrum = fft.rfft(centered[rows], axis=1, workers=workers)
+        power[rows] = (spectrum.real ** 2 + spectrum.imag ** 2) / np.maximum(lengths[rows], 1)[:, None]
+    return frequencies, power
+
+
+def get_dominant_periods(frequencies, power, names, top=3):
+    """The periods in bins with the most power of every series, without the zero frequency."""
+    order = np.argsort(power[:, 1:], axis=1)[:, ::-1][:, :top] + 1
+    return pd.DataFrame({f'period_{i + 1}': np.round(1 / frequencies[order[:, i]], 2) for i in range(top)},
+                        index=names)
+
+
+def analyze_series(starts, freq, nlags=None, alpha=0.05, end=None, workers=None):
+    """Counts, autocorrelation with its confidence band and dominant periods of every series at one resolution."""
+    nlags = DEFAULT_LAGS[freq] if nlags is None else nlags
+    matrix, lengths, names, index = get_count_matrix(starts, freq, end)
+    acf = get_autocorrelation(matrix, lengths, nlags, workers)
+    frequencies, power = get_periodogram(matrix, lengths, workers)
+    return {
+        'counts': pd.DataFrame(matrix.T, index=index, columns=names),
+        'lengths': pd.Series(lengths, index=names),
+        'acf': pd.DataFrame(acf, index=names),
+        'confidence': pd.DataFrame(get_confidence_band(acf, lengths, alpha), index=names),
+        'periods': get_dominant_periods(frequencies, power, names),
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Calendar histograms, autocorrelation and periodograms of the '
+                                                 'incident counts of every service and provider.')
+    parser.add_argument('--path', default='data/clean/incident/2024-08-31/incident_stages.csv')
+    parser.add_argument('--timezone', default=TIMEZONE)
+    parser.add_argument('-f', '--frequencies', nargs='+', choices=list(FREQUENCIES), default=['month', 'week', 'day'])
+    parser.add_argument('--nlags', type=int, default=None, help='Default the lags of the sec5 plots.')
+    parser.add_argument('--end', default='2024-08-31 23:59', help='End of the count series, the scrape date.')
+    parser.add_argument('-W', '--workers', type=int, default=None, help='FFT threads.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    starts = load_incident_starts(args.path, args.timezone)
+    pd.set_option('display.width', 250)
+    pd.set_option('display.max_columns', 30)
+
+    start_time = time.perf_counter()
+    histograms = get_calendar_histograms(starts)
+    print(f'{len(starts)} incident starts binned in {(time.perf_counter() - start_time) * 1000:.1f}ms\n')
+    for calendar, histogram in histograms.items():
+        print(f'{calendar}:\n{histogram}\n')
+
+    for freq in args.frequencies:
+        start_time = time.perf_counter()
+        result = analyze_series(starts, freq, args.nlags, end=args.end, workers=args.workers)
+        elapsed = time.perf_counter() - start_time
+        acf = result['acf']
+        significant = (acf.abs() > result['confidence']).iloc[:, 1:].sum(axis=1)
+        summary = pd.DataFrame({'bins': result['lengths'], 'acf_lag1': acf[1].round(3),
+                                'significant_lags': significant}).join(result['periods'])
+        print(f'{freq} (lags={acf.shape[1] - 1}), {len(acf)} series x {len(result["counts"])} bins in {elapsed:.2f}s:'
+              f'\n{summary}\n')
@@ -0,0 +1,171 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from dateutil import parser as dateutil_parser
+from dateutil.tz import gettz
+
+
+STAGES = ["Investigating", "Identified", "Monitoring", "Resolved", "Postmortem"]
+
+# UTC offsets in minutes of the timezone abbreviations status pages print after the update time
+TIMEZONE_OFFSETS = {
+    'UTC': 0, 'GMT': 0,
+    'PST': -8 * 60, 'PDT': -7 * 60,
+    'MST': -7 * 60, 'MDT': -6 * 60,
+    'CST': -6 * 60, 'CDT': -5 * 60,
+    'EST': -5 * 60, 'EDT': -4 * 60,
+    'BST': 60, 'CET': 60, 'CEST': 2 * 60,
+}
+
+# 'Posted 3 days ago. Aug 28, 2024 - 13:36 PDT' -> 'Aug 28, 2024 - 13:36', 'PDT'
+UPDATE_TIMESTAMP_PATTERN = r'(?P<local>[A-Z][a-z]{2} \d{1,2}, \d{4} - \d{1,2}:\d{2}) (?P<tz>[A-Z]{2,5})$'
+UPDATE_TIMESTAMP_FORMAT = '%b %d, %Y - %H:%M'
+
+
+def parse_update_time(timestamp_str):
+    """Per-row reference parser of the incident transformation notebook, kept for comparison."""
+    tzinfos = {
+        "PST": gettz("America/Los_Angeles"),
+        "PDT": gettz("America/Los_Angeles")
+    }
+    timestamp_str = " ".join(timestamp_str.split(". ")[1].split(" - "))
+    timestamp = dateutil_parser.parse(timestamp_str, ignoretz=False, tzinfos=tzinfos)
+    return timestamp.astimezone(gettz('UTC'))
+
+
+def parse_updates(updates_list, stages=None):
+    """Per-row reference of the incident transformation notebook: stage flag, timestamp and description."""
+    if stages is None:
+        stages = STAGES
+    updates_dict = {}
+
+    for stage in stages:
+        stage = stage.lower()
+        updates_dict[f'{stage}_flag'] = int(0)
+        updates_dict[f'{stage}_timestamp'] = None
+        updates_dict[f'{stage}_description'] = None
+
+    for update in updates_list:
+        stage = update.get("Update_Title")
+        if stage in stages:
+            stage = stage.lower()
+            updates_dict[f'{stage}_flag'] = int(1)
+            updates_dict[f'{stage}_timestamp'] = parse_update_time(update.get("Update_Timestamp"))
+            updates_dict[f'{stage}_description'] = update.get("Update_Body")
+    return updates_dict
+
+
+def parse_update_timestamps(timestamps, tz='UTC'):
+    """
+    Parse a column of status page update timestamps at once, e.g. 'Posted 3 days ago. Aug 28, 2024 - 13:36 PDT'.
+    The abbreviation gives the UTC offset of the local time, so PST and PDT are exact also around DST changes.
+    Returns a tz-aware Series in tz, missing values stay NaT.
+    """
+    timestamps = pd.Series(timestamps)
+    if timestamps.isna().all():
+        # nothing to parse, an all-missing column is not of strings and has no .str accessor
+        return pd.Series(pd.NaT, index=timestamps.index, dtype=f'datetime64[ns, {tz}]')
+    # parse every distinct string once, updates repeat across scrapes and partitions
+    codes, uniques = pd.factorize(timestamps)
+    if len(uniques) < len(timestamps):
+        parsed = parse_update_timestamps(pd.Series(uniques), tz).to_numpy()
+        return pd.Series(pd.array(np.where(codes >= 0, parsed[codes], pd.NaT), dtype=f'datetime64[ns, {tz}]'),
+                         index=timestamps.index)
+    parts = timestamps.str.extract(UPDATE_TIMESTAMP_PATTERN)
+    unknown = set(parts['tz'].dropna()) - set(TIMEZONE_OFFSETS)
+    if unknown:
+        raise ValueError(f"Unknown timezone abbreviations: {', '.join(sorted(unknown))}")
+    unparsed = timestamps.notna() & parts['local'].isna()
+    if unparsed.any():
+        raise ValueError(f"Unexpected update timestamp format: {timestamps[unparsed].iloc[0]}")
+
+    local = pd.to_datetime(parts['local'], format=UPDATE_TIMESTAMP_FORMAT)
+    offsets = pd.to_timedelta(parts['tz'].map(TIMEZONE_OFFSETS), unit='min')
+    return (local - offsets).dt.tz_localize('UTC').dt.tz_convert(tz)
+
+
+def parse_timestamp_columns(df, columns, tz='UTC'):
+    """Parse ISO 8601 text columns, e.g. '2024-02-26 17:09:00+00:00' from the stg/clean CSVs, into tz-aware columns."""
+    for column in columns:
+        df[column] = pd.to_datetime(df[column], format='ISO8601', utc=True).dt.tz_convert(tz)
+    return df
+
+
+def parse_updates_frame(updates, stages=None):
+    """
+    Column-wise parse_updates() for a Series of update lists (as loaded by load_json_column).
+    Returns one row per incident with the {stage}_flag, {stage}_timestamp and {stage}_description columns.
+    Like parse_updates(), a stage posted more than once keeps its last update in the list, i.e. the earliest.
+    """
+    if stages is None:
+        stages = STAGES
+    index = updates.index
+    updates = updates.reset_index(drop=True)
+    lengths = updates.str.len().fillna(0).astype(int).to_numpy()
+    rows = pd.DataFrame([update for update_list in updates if isinstance(update_list, list) for update in update_list],
+                        columns=['Update_Title', 'Update_Body', 'Update_Timestamp'])
+    rows['incident'] = np.repeat(np.arange(len(updates)), lengths)
+    rows = rows[rows['Update_Title'].isin(stages)].drop_duplicates(['incident', 'Update_Title'], keep='last')
+    rows['timestamp'] = parse_update_timestamps(rows['Update_Timestamp']).to_numpy()
+
+    parsed = pd.DataFrame(index=pd.RangeIndex(len(updates)))
+    for stage in stages:
+        stage_rows = rows[rows['Update_Title'] == stage].set_index('incident')
+        stage = stage.lower()
+        parsed[f'{stage}_flag'] = parsed.index.isin(stage_rows.index).astype(int)
+        parsed[f'{stage}_timestamp'] = stage_rows['timestamp'].reindex(parsed.index)
+        parsed[f'{stage}_description'] = stage_rows['Update_Body'].reindex(parsed.index).replace({np.nan: None})
+    parsed.index = index
+    return parsed
+
+
+def get_benchmark_updates(raw_dir, scale):
+    # util_data uses this module, import it here only
+    from util.util_data import read_data
+    df = read_data(raw_dir).drop_duplicates().reset_index(drop=True)
+    updates = df['Updates'].apply(json.loads)
+    return pd.concat([updates] * scale, ignore_index=True)
+
+
+def run_benchmark(raw_dir, scale):
+    updates = get_benchmark_updates(raw_dir, scale)
+    timestamps = pd.Series([update['Update_Timestamp'] for update_list in updates for update in update_list])
+    print(f'{len(updates)} incidents, {len(timestamps)} update timestamps ({scale}x)')
+
+    start = time.perf_counter()
+    expected = timestamps.apply(parse_update_time)
+    per_row = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = parse_update_timestamps(timestamps)
+    vectorized = time.perf_counter() - start
+    mismatches = (pd.to_datetime(expected, utc=True) != parsed).sum()
+    print(f'timestamps: per-row {per_row:.2f}s, vectorized {vectorized:.3f}s ({per_row / vectorized:.0f}x), '
+          f'{mismatches} mismatches')
+
+    start = time.perf_counter()
+    expected = pd.DataFrame(updates.apply(parse_updates).tolist())
+    per_row = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = parse_updates_frame(updates)
+    vectorized = time.perf_counter() - start
+    timestamp_columns = [column for column in expected.columns if column.endswith('_timestamp')]
+    expected[timestamp_columns] = expected[timestamp_columns].apply(lambda x: pd.to_datetime(x, utc=True))
+    pd.testing.assert_frame_equal(expected, parsed, check_dtype=False)
+    print(f'incident stages: per-row {per_row:.2f}s, vectorized {vectorized:.3f}s ({per_row / vectorized:.0f}x), '
+          f'identical output')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark per-row against vectorized update timestamp parsing.')
+    parser.add_argument('--raw-dir', default='data/raw/incident/2024-08-31')
+    parser.add_argument('--scale', type=int, default=100, help='Times the raw incidents are repeated.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    run_benchmark(args.raw_dir, args.scale)
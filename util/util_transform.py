@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from util.util_data import load_json_column, unnest_dict, get_incident_id
+from util.util_dedup import drop_duplicate_snapshots
+from util.util_status_page import PROVIDERS
+from util.util_timestamp import parse_updates_frame
+
+
+# service flag columns of the cleaned incidents
+INCIDENT_SERVICES = ['Playground', 'API', 'Labs', 'ChatGPT', 'api.anthropic.com', 'claude.ai', 'console.anthropic.com',
+                     'Character.AI']
+INCIDENT_INFO_COLUMNS = ['incident_id', 'Incident_Title', 'incident_impact_level', 'Incident_color', 'provider']
+
+IMPACT_LEVELS = {
+    'impact-none': 0,
+    'impact-minor': 1,
+    'impact-major': 2,
+    'impact-critical': 3,
+    'impact-maintenance': 4
+}
+
+OUTAGE_TYPES = ['Partial outage', 'Major outage']
+
+
+def get_services(service_str):
+    if pd.isna(service_str):
+        return []
+    else:
+        service_str = service_str.split(':')[-1].rstrip('.')
+        service_str = service_str.replace("and", ",")
+        services = service_str.split(',')
+        return [service.strip() for service in services]
+
+
+def get_incident_provider(incident_url):
+    if pd.isna(incident_url):
+        return incident_url
+    else:
+        return incident_url.split('/')[2].split('.')[1]
+
+
+def get_uptime_provider(service):
+    return next((provider for provider, config in PROVIDERS.items() if service in config['services']), 'unknown')
+
+
+def parse_outages(outages_list, outage_types=None):
+    if outage_types is None:
+        outage_types = OUTAGE_TYPES
+    outages_dict = {}
+
+    for outage_type in outage_types:
+        outage_type = outage_type.lower().replace(' ', '_')
+        outages_dict[outage_type + '_flag'] = int(0)
+        outages_dict[outage_type + '_minutes'] = int(0)
+
+    for outage in outages_list:
+        outage_type = outage['Outage_Type'].lower().replace(' ', '_')
+        outages_dict[outage_type + '_flag'] = int(1)
+        outages_dict[outage_type + '_minutes'] = outage['Downtime (min)']
+
+    return outages_dict
+
+
+def get_outage_impact_level(total_minutes):
+    """This function calculates the outage impact level based on the scaled total outage minutes."""
+    if total_minutes == 0:
+        return 0
+    else:
+        return min((total_minutes - 1) // 20 + 1, 4)
+
+
+def transform_incidents(df, services=None):
+    """Raw incident history to incident_stages.csv rows, as in sec3.2-transformation_incidents.ipynb."""
+    if services is None:
+        services = INCIDENT_SERVICES
+    df = drop_duplicate_snapshots(df, 'incident').reset_index(drop=True)
+    df = load_json_column(df, 'Updates')
+    df['provider'] = df['Incident_Link'].apply(get_incident_provider)
+    df['incident_id'] = df['Incident_Link'].apply(get_incident_id)
+    df['incident_impact_level'] = df['Incident_Impact'].map(IMPACT_LEVELS)
+
+    df['services'] = df['Service'].apply(get_services)
+    for service in services:
+        df[service] = df['services'].apply(lambda x: 1 if service in x else 0)
+
+    df = df.join(parse_updates_frame(df['Updates']))
+    # the incident spans the stages up to resolved, the postmortem is posted later
+    cols_timestamp = [col for col in df.columns if col.endswith('_timestamp') and col != 'postmortem_timestamp']
+    df['start_timestamp'] = df[cols_timestamp].min(axis=1)
+    df['close_timestamp'] = df[cols_timestamp].max(axis=1)
+    df['time_span'] = df['close_timestamp'] - df['start_timestamp']
+    df['over_one_day'] = df['time_span'] > timedelta(days=1)
+
+    cols_stages = [col for col in df.columns if col.endswith(('_flag', '_timestamp', '_description'))]
+    return df[INCIDENT_INFO_COLUMNS + list(services) + cols_stages + ['time_span', 'over_one_day']]
+
+
+def transform_uptime(df):
+    """Raw uptime history to outage_unexploded.csv rows, as in sec3.2-transformation_outage.ipynb."""
+    df = drop_duplicate_snapshots(df, 'uptime').reset_index(drop=True)
+    df['Date'] = pd.to_datetime(df['Date'])
+    df = load_json_column(df, 'Outages')
+    df = load_json_column(df, 'Incidents')
+    df['incident_count'] = df['Incidents'].apply(lambda x: len(x))
+
+    df['Outages'] = df['Outages'].apply(parse_outages)
+    df = unnest_dict(df, 'Outages')
+    df['outage_flag'] = df['major_outage_flag'] + df['partial_outage_flag']
+    df['total_outage_minutes'] = df['major_outage_minutes'] + df['partial_outage_minutes']
+    df['scaled_total_outage_minutes'] = df['major_outage_minutes'] + (df['partial_outage_minutes'] * 0.3)
+    df['outage_impact_level'] = df['scaled_total_outage_minutes'].apply(get_outage_impact_level).astype(int)
+    df['provider'] = df['Service'].apply(get_uptime_provider)
+    return df
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# parent row position of each unnested record
+PARENT_COLUMN = 'parent'
+
+
+def parse_json_values(values):
+    """Parsed JSON strings of a column, missing values parse to None."""
+    return [json.loads(value) if isinstance(value, str) else None for value in values]
+
+
+def flatten_record(record, prefix=''):
+    """Key and value pairs of a record, nested dicts flattened to dotted keys like pd.json_normalize."""
+    for key, value in record.items():
+        if isinstance(value, dict):
+            yield from flatten_record(value, f'{prefix}{key}.')
+        else:
+            yield f'{prefix}{key}', value
+
+
+def flatten_records(values, keep_empty=False, offset=0):
+    """
+    Flatten parsed JSON values in one pass: each list item (or dict) becomes a record row, built into columns at
+    once by the DataFrame constructor. Keys are in order of first appearance, missing keys are NaN.
+    Returns the records frame and the parent position of each row (starting at offset).
+    With keep_empty, rows with an empty list or null keep one all-NaN record, like explode.
+    """
+    parents = []
+    rows = []
+    for position, value in enumerate(values, offset):
+        records = value if isinstance(value, list) else [] if value is None else [value]
+        if not records and keep_empty:
+            parents.append(position)
+            rows.append({})
+        for record in records:
+            parents.append(position)
+            nested = any(isinstance(item, dict) for item in record.values())
+            rows.append(dict(flatten_record(record)) if nested else record)
+    return pd.DataFrame(rows, index=pd.RangeIndex(len(rows))), np.asarray(parents, dtype=np.int64)
+
+
+def unnest_json_column(df, column, keep_columns=None, keep_empty=False, parsed=False):
+    """
+    One row per record of a JSON list (or dict) column, with the parent row position and the kept parent columns
+    taken by position, without exploding and joining the whole frame.
+    """
+    values = df[column] if parsed else parse_json_values(df[column])
+    records, parents = flatten_records(values, keep_empty)
+    parent_columns = df[keep_columns].iloc[parents].reset_index(drop=True) if keep_columns else pd.DataFrame(
+        index=records.index)
+    parent_columns.insert(0, PARENT_COLUMN, parents)
+    return pd.concat([parent_columns, records], axis=1)
+
+
+def iter_json_chunks(paths, column, keep_columns=None, keep_empty=False, chunksize=10000):
+    """
+    Unnest a JSON column of raw CSVs chunk by chunk, so a partition never has to fit in memory.
+    Parent positions count rows across all the files.
+    """
+    offset = 0
+    for path in paths:
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            records, parents = flatten_records(parse_json_values(chunk[column]), keep_empty, offset)
+            unnested = chunk[keep_columns or []].iloc[parents - offset].reset_index(drop=True)
+            unnested.insert(0, PARENT_COLUMN, parents)
+            offset += len(chunk)
+            yield pd.concat([unnested, records], axis=1)
+
+
+def get_csv_paths(base_dir):
+    return sorted(os.path.join(root, file_name) for root, _, files in os.walk(base_dir)
+                  for file_name in files if file_name.endswith('.csv'))
+
+
+def unnest_json_files(base_dir, column, path, keep_columns=None, keep_empty=False, chunksize=10000):
+    """
+    Write the unnested records of all raw CSVs under base_dir to one CSV, appended chunk by chunk.
+    Chunks may have different record keys, so the header is fixed by the first chunk and later keys are dropped
+    with a warning.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    header = None
+    row_count = 0
+    for chunk in iter_json_chunks(get_csv_paths(base_dir), column, keep_columns, keep_empty, chunksize):
+        if header is None:
+            header = list(chunk.columns)
+            chunk.to_csv(path, index=False)
+        else:
+            extra = [key for key in chunk.columns if key not in header]
+            if extra:
+                print(f'warning: dropping keys missing from the header: {extra}')
+            chunk.reindex(columns=header).to_csv(path, mode='a', header=False, index=False)
+        row_count += len(chunk)
+    print(f'writing {row_count} records to: {path}')
+    return row_count
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Unnest a JSON column of raw CSVs into one record per row.')
+    parser.add_argument('-i', '--input-dir', default='data/raw/incident/2024-08-31')
+    parser.add_argument('-c', '--column', default='Updates', help='JSON column, e.g. Updates, Outages or Incidents.')
+    parser.add_argument('-k', '--keep', nargs='*', default=['Incident_Link'], help='Parent columns to keep.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Default <column>_unnested.csv in the stg partition of the input, e.g. data/stg/incident/'
+                             '2024-08-31/updates_unnested.csv.')
+    parser.add_argument('--chunksize', type=int, default=10000, help='Raw rows parsed at a time.')
+    parser.add_argument('--keep-empty', action='store_true', help='Keep rows with empty lists as NaN records.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_arguments()
+    data_type, partition = os.path.normpath(args.input_dir).split(os.sep)[-2:]
+    output = args.output or os.path.join('data', 'stg', data_type, partition, f'{args.column.lower()}_unnested.csv')
+    start_time = time.perf_counter()
+    unnest_json_files(args.input_dir, args.column, output, args.keep, args.keep_empty, args.chunksize)
+    print(f'done in {time.perf_counter() - start_time:.2f}s')